@@ -4,6 +4,7 @@ import random
 from badge.asyncbutton import ButtonEvents
 from badge.games import fwdbutton
 from badge.msg import BadgeAdr, null_badge_adr
+from badge.msg.bus import LEAVE, STALE
 from badge.msg.connection import NowListener
 from bdg.utils import singleton, Timer
 from bdg.config import Config
@@ -66,7 +67,8 @@ class GameScanScr(Screen):
     def update_status(self):
         print(">>> update_status")
 
-        b_found = len(NowListener.last_seen)
+        # badges that walked away no longer count
+        b_found = NowListener.last_seen.fresh_len()
         try:
             b_needed = Config.config["espnow"]["b_needed"]
         except KeyError:
@@ -156,8 +158,9 @@ class BadgeGame:
 
     def acquire_opponent(self) -> BadgeAdr:
         """
-        Attempts to acquire an opponent from the list of last seen entities and starts the
-        opponent timer if successful. The method checks two conditions before selecting
+        Attempts to acquire an opponent from the badges heard within
+        last_seen.stale_s and starts the opponent timer if successful. The method
+        checks two conditions before selecting
         an opponent: whether the opponent timer is still active and whether the cooldown
         timer for the badge is active. If either condition is true, it raises a
         BadgeCooldown exception. If no opponents are available in the list, a null
@@ -174,8 +177,10 @@ class BadgeGame:
             if self.opponent_cooldown_t.is_act():
                 raise BadgeCooldown("Badge in cooldown {opponent_cooldown_t.time_left()}s ")
 
-        if len(NowListener.last_seen):
-            self.opponent = random.choice(NowListener.last_seen.keys())
+        fresh = NowListener.last_seen.fresh_keys()
+        if fresh:
+            mac = random.choice(fresh)
+            self.opponent = NowListener.last_seen[mac]
             self.opponent_timer.start()
             return self.opponent
 
@@ -221,6 +226,7 @@ class ActiveGameScr(Screen):
         self.game = None
 
         self.mode = self.MODE_READY
+        self.lt = None  # listen_handler task
         # verbose default indicates if fast rendering is enabled
         self.opponent: BadgeAdr = None
         wri = CWriter(ssd, font10, WHITE, BLACK, verbose=False)
@@ -260,10 +266,17 @@ class ActiveGameScr(Screen):
         self.update_ui()
 
     async def listen_handler(self):
-        async for opponent in NowListener.updates(filer_mac=self.opponent.mac):
-            print(f"listen_handler: {opponent}")
-            self.opponent = opponent
-            self.update_ui()
+        updates = NowListener.updates(filter_mac=self.opponent.mac)
+        try:
+            async for opponent in updates:
+                print(f"listen_handler: {opponent}")
+                self.opponent = opponent
+                gone = updates.event & (STALE | LEAVE)
+                if gone and not NowListener.last_seen.is_fresh(opponent.mac):
+                    self.mode = self.MODE_NO_OPPONENT
+                self.update_ui()
+        finally:
+            updates.close()
 
     def after_open(self):
         self.game = BadgeGame()
@@ -275,6 +288,8 @@ class ActiveGameScr(Screen):
                     self.mode = self.MODE_NO_OPPONENT
                 else:
                     self.mode = self.MODE_READY
+                    if not self.lt or self.lt.done():
+                        self.lt = self.reg_task(self.listen_handler(), True)
             except BadgeCooldown as e:
                 # FIXME: jump to cooldown screen
                 Screen.change("CooldownScr", args=[str(e)])
@@ -286,8 +301,11 @@ class ActiveGameScr(Screen):
         if self.mode == self.MODE_SEARCHING:
             self.track_b.visible = False
             self.lbl_s.value("SEARCHING")
-            # TODO: implement changing message from rssi and time
-            self.lbl_t.value(f"{self.opponent} signal is too weak!")
+            # TODO: implement changing message from time
+            if self.opponent.band == 0:
+                self.lbl_t.value(f"{self.opponent} signal is too weak!")
+            else:
+                self.lbl_t.value(f"{self.opponent} is in range")
         elif self.mode == self.MODE_READY:
             self.track_b.visible = True
             self.lbl_t.value(f"Opponent: {self.opponent}")
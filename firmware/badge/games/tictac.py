@@ -25,6 +25,9 @@ NEW_ROUND = 3
 
 @AppMsg.register
 class TttStart(BadgeMsg):
+    TYPE_ID = 16
+    _fields = ("iam", "move", "init", "round")
+
     def __init__(self, iam, move: int, init: float, round: int):
         super().__init__()
         self.iam: bool = iam
@@ -35,6 +38,9 @@ class TttStart(BadgeMsg):
 
 @AppMsg.register
 class TttMove(BadgeMsg):
+    TYPE_ID = 17
+    _fields = ("move",)
+
     def __init__(self, move: int):
         super().__init__()
         self.move: int = move
@@ -42,6 +48,9 @@ class TttMove(BadgeMsg):
 
 @AppMsg.register
 class TttEnd(BadgeMsg):
+    TYPE_ID = 18
+    _fields = ("iam_winner", "move")
+
     def __init__(self, iam_winner: bool, move: int):
         super().__init__()
         # if player does not claim win, it must be tie
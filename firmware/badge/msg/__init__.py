@@ -7,29 +7,143 @@ from time import time
 
 import umsgpack
 
+from array import array
+from struct import pack, unpack_from
+
+# Wire format
+#
+# Every frame starts with a fixed header: message type id (u8) and message
+# id (u16, big endian), followed by the message fields packed as a msgpack
+# array in the order given by the class ``_fields``. AppMsg flattens its
+# content into the same array: [con_id, seq, content type id, *fields].
+# NowListener.send_msg() stamps the id with a per peer sequence number, seq
+# is the per connection sequence number used to deliver app messages in
+# order (None for messages that are not ordered).
+#
+# Older firmware sent a msgpack map {"msg_type": name, "_id": id, ...}. A map
+# always starts with 0x80..0x8f, 0xde or 0xdf, so type ids are kept in range
+# 1..0x7e and desrlz() can tell the two formats apart from the first byte.
+HDR = ">BH"
+HDR_LEN = 3
+MAX_TYPE_ID = 0x7E
+
+# Peers that sent a map frame get map frames back, see BadgeMsg.srlz_dict().
+# Older firmware knows only these messages, ids there are 0..LEGACY_IDS - 1
+# and acked one by one.
+LEGACY_TYPES = ("BeaconMsg", "AckMsg", "OpenConn", "ConTerm", "AppMsg")
+LEGACY_IDS = 255
+
+
+# Several message frames for the same peer can travel in one ESP-NOW frame
+# as a bundle: BUNDLE type byte followed by (length u8, frame) records.
+BUNDLE = 0x7F
+MAX_FRAME = 250  # ESP-NOW payload limit
+BROADCAST = b"\xff\xff\xff\xff\xff\xff"  # beacons and groups
+
+
+def bundle(frames) -> bytes:
+    out = bytearray([BUNDLE])
+    for f in frames:
+        out.append(len(f))
+        out.extend(f)
+    return bytes(out)
+
+
+def unbundle(frame):
+    # yields the records of a bundle in the order they were added
+    i, end = 1, len(frame)
+    while i < end:
+        n = frame[i]
+        i += 1
+        if i + n > end:
+            print(f"Truncated bundle record at {i}")
+            return
+        yield frame[i : i + n]
+        i += n
+
+
+def is_legacy(frame) -> bool:
+    b = frame[0]
+    return 0x80 <= b <= 0x8F or b == 0xDE or b == 0xDF
+
+
+def peek(frame):
+    # type id and message id from the header without decoding the body,
+    # (None, None) for frames in the legacy map format
+    if is_legacy(frame):
+        return None, None
+    return unpack_from(HDR, frame)
+
+
+def _name_type_id(name: str) -> int:
+    # stable fallback id for messages that don't declare TYPE_ID
+    h = 0x811C9DC5
+    for c in name.encode():
+        h = ((h ^ c) * 0x01000193) & 0xFFFFFFFF
+    return h % MAX_TYPE_ID + 1
+
+
+def _compile_codec(cls, app=False):
+    # Build a dedicated decoder and encoder for cls from its _fields, so no
+    # introspection is left for send / receive time. For AppMsg content
+    # (app set) the encoder takes the wrapping AppMsg (or GroupMsg) as second
+    # argument, the header type id is the wrapper's.
+    #   dec(v, o) -> cls(v[o], v[o + 1], ...)
+    #   fill(m, v, o) -> decode into an existing (pooled) instance m
+    #   enc(m) / enc(c, m) -> header + msgpack array of the fields
+    args = ", ".join(f"v[o + {i}]" for i in range(len(cls._fields)))
+    sets = "".join(f" m.{f} = v[o + {i}]\n" for i, f in enumerate(cls._fields))
+    vals = [f"c.{f}" for f in cls._fields]
+    if not app:
+        head = "m):\n c = m\n"
+        tid = cls.TYPE_ID
+    else:
+        head = "c, m):\n"
+        vals = ["m.con_id", "m.seq", str(cls.TYPE_ID)] + vals
+        tid = "m.TYPE_ID"
+    src = (
+        f"def dec(v, o):\n return cls({args})\n"
+        f"def fill(m, v, o):\n{sets} return m\n"
+        f"def enc({head}"
+        f" return pack(HDR, {tid}, m._id) + dumps([{', '.join(vals)}])\n"
+    )
+    ns = {"cls": cls, "pack": pack, "HDR": HDR, "dumps": umsgpack.dumps}
+    exec(src, ns)
+    return ns["dec"], ns["fill"], ns["enc"]
+
 
 # Low level messages that handle connection link
 class BadgeMsg(object):
-    __message_id = random.randint(0,255)
+    _message_id = random.randint(0, 0xFFFF)
 
     # store all known message types trough .register decorator
-    __msg_type_reg = {}
-    __core_types = ()
+    _types = {}  # type id -> class
+    _names = {}  # class name -> class, used by the legacy decoder
+    _dec = {}  # type id -> decoder built by register()
+    _fill = {}  # type id -> in place decoder, for pooled instances
+    _core_types = ()
+
+    TYPE_ID = None  # stable wire id, derived from class name if not set
+    _fields = None  # field order on wire, tuple of attribute names
+    RETRY = 3  # resends before giving up, app content types can override
 
     @property
     def id(self):
-        return  self.__id % 255
+        return self._id
+
+    def retry_budget(self):
+        return self.RETRY
 
     def __init__(self):
-        if type(self) in BadgeMsg.__core_types:
-            BadgeMsg.__message_id += 1
-            self.__id = BadgeMsg.__message_id
+        if type(self) in BadgeMsg._core_types:
+            BadgeMsg._message_id = (BadgeMsg._message_id + 1) & 0xFFFF
+            self._id = BadgeMsg._message_id
         self.msg_type: str = type(self).__name__
 
     def to_dict(self):
-        d = {"_id": self.id} if type(self) in BadgeMsg.__core_types else dict()
+        d = {"_id": self.id} if type(self) in BadgeMsg._core_types else dict()
         for k, v in self.__dict__.items():
-            if k.startswith("__") or callable(v):
+            if k.startswith("_") or callable(v):
                 continue
             if isinstance(v, BadgeMsg):
                 d.update({k: v.to_dict()})
@@ -41,33 +155,102 @@ class BadgeMsg(object):
     def __str__(self):
         return str(self.to_dict())
 
+    # Generic codec for messages registered without _fields, fields travel
+    # as a single map. register() replaces these for messages with _fields.
+    def _map(self):
+        d = self.to_dict()
+        d.pop("msg_type")
+        d.pop("_id", None)
+        return d
+
+    @classmethod
+    def _from(cls, v, o):
+        return cls(**v[o])
+
+    _into = None  # map messages can't be decoded in place
+
     def srlz(self):
-        return umsgpack.dumps(self.to_dict())
+        return pack(HDR, self.TYPE_ID, self.id) + umsgpack.dumps([self._map()])
+
+    def srlz_dict(self):
+        # the name keyed map older firmware reads, None for messages it
+        # doesn't know. Fields its constructors don't take are left out
+        if self.msg_type not in LEGACY_TYPES:
+            return None
+        d = self.to_dict()
+        d["_id"] = self.id % LEGACY_IDS
+        d.pop("seq", None)
+        d.pop("sack", None)
+        d.pop("run", None)
+        return umsgpack.dumps(d)
+
+    def _app_srlz(self, m):
+        return pack(HDR, m.TYPE_ID, m.id) + umsgpack.dumps(
+            [m.con_id, m.seq, self.TYPE_ID, self._map()]
+        )
 
     @classmethod
     def register(cls, subclass):
         def decorator(subclz):
             # print(f"{cls=} ad {subclz=}")
-            cls.__msg_type_reg[subclz.__name__] = subclz
-            cls.__registered_messages = cls.__msg_type_reg.keys()
-            cls.__core_types = tuple(cls.__msg_type_reg.values())
+            tid = subclz.TYPE_ID
+            if tid is None:
+                tid = _name_type_id(subclz.__name__)
+            if not 0 < tid <= MAX_TYPE_ID:
+                raise ValueError(f"{subclz.__name__}: TYPE_ID out of range")
+            known = cls._types.get(tid)
+            if known is not None and known.__name__ != subclz.__name__:
+                raise ValueError(
+                    f"{subclz.__name__}: TYPE_ID {tid} taken by {known.__name__}"
+                )
+            subclz.TYPE_ID = tid
+            if subclz._fields is None:
+                cls._dec[tid], cls._fill[tid] = subclz._from, subclz._into
+            elif cls is BadgeMsg:
+                cls._dec[tid], cls._fill[tid], subclz.srlz = _compile_codec(subclz)
+            else:
+                cls._dec[tid], cls._fill[tid], subclz._app_srlz = _compile_codec(
+                    subclz, app=True
+                )
+            cls._types[tid] = subclz
+            cls._names[subclz.__name__] = subclz
+            if cls is BadgeMsg:
+                BadgeMsg._core_types = tuple(cls._types.values())
             return subclz
 
         return decorator(subclass)
 
     @staticmethod
-    def desrlz(dump) -> "BadgeMsg":
+    def desrlz(dump, pool=None) -> "BadgeMsg":
+        # with pool given, the message is decoded into a pooled instance that
+        # the caller hands back with pool.put() once done with it
         try:
-            d = umsgpack.loads(dump)
-            ctype, mid, rest = d["msg_type"],d["_id"], {k: v for k, v in d.items() if k not in ["msg_type", "_id"]}
-            #print(f"{ctype=} {mid=} {rest=}")
-            msg = BadgeMsg.__msg_type_reg.get(ctype)(**rest)
-            msg.__id = mid
+            if is_legacy(dump):
+                return BadgeMsg.desrlz_dict(dump)
+            tid, mid = unpack_from(HDR, dump)
+            # umsgpack takes only bytes and bytearray, frames from the
+            # receive buffer are memoryviews of its slots
+            v = umsgpack.loads(bytes(dump[HDR_LEN:]))
+            msg = pool.get(tid) if pool else None
+            if msg is None:
+                msg = BadgeMsg._dec[tid](v, 0)
+            else:
+                BadgeMsg._fill[tid](msg, v, 0)
+            msg._id = mid
             return msg
         except Exception as e:
             print(f"Error deserializing msg: {e}")
             return None
 
+    @staticmethod
+    def desrlz_dict(dump) -> "BadgeMsg":
+        # compatibility decoder for the name keyed map format
+        d = umsgpack.loads(bytes(dump))
+        ctype, mid = d.pop("msg_type"), d.pop("_id")
+        msg = BadgeMsg._names.get(ctype)(**d)
+        msg._id = mid
+        return msg
+
 
 # send beacon messages to other
 
@@ -75,6 +258,9 @@ class BadgeMsg(object):
 # Low level message that handle connection link
 @BadgeMsg.register
 class BeaconMsg(BadgeMsg):
+    TYPE_ID = 1
+    _fields = ("nick",)
+
     def __init__(self, nick: str):
         super().__init__()
         self.nick: str = nick
@@ -83,10 +269,18 @@ class BeaconMsg(BadgeMsg):
 # Low level message that handle connection link
 @BadgeMsg.register
 class AckMsg(BadgeMsg):
-    def __init__(self, id: int=None):
+    # Cumulative ack: the run ids up to and including id (in the header)
+    # have been received, bit n of sack marks id + 1 + n as received as well.
+    TYPE_ID = 2
+    _fields = ("sack", "run")
+
+    def __init__(self, sack: int = 0, run: int = 1, id: int = None):
+        # sack and run first to match _fields, id is set from the header
         # super().__init__() no super init as this would advance msg_id
         self.msg_type: str = type(self).__name__
-        self.__id = id
+        self._id = id
+        self.sack: int = sack
+        self.run: int = run
 
 
 # ask for connection
@@ -95,6 +289,10 @@ class AckMsg(BadgeMsg):
 # Low level message that handle connection link
 @BadgeMsg.register
 class OpenConn(BadgeMsg):
+    TYPE_ID = 3
+    RETRY = 6  # losing connection setup costs more than a few extra frames
+    _fields = ("con_id", "accept")
+
     def __init__(self, con_id: int, accept: bool = True):
         super().__init__()
         self.con_id: int = con_id  # if True  request, if False response
@@ -104,11 +302,30 @@ class OpenConn(BadgeMsg):
 # Low level message that handle connection link
 @BadgeMsg.register
 class ConTerm(BadgeMsg):
+    TYPE_ID = 4
+    RETRY = 6
+    _fields = ("con_id",)
+
     def __init__(self, con_id: int):
         super().__init__()
         self.con_id: int = con_id
 
 
+# Flow control of a connection: the receiver grants the sender app messages
+# up to sequence number limit (exclusive). probe=True is sent by a sender
+# that has waited long for credit, the receiver answers with its limit.
+@BadgeMsg.register
+class ConCredit(BadgeMsg):
+    TYPE_ID = 6
+    _fields = ("con_id", "limit", "probe")
+
+    def __init__(self, con_id: int, limit: int, probe: bool = False):
+        super().__init__()
+        self.con_id: int = con_id
+        self.limit: int = limit
+        self.probe: bool = probe
+
+
 # Application to application message header AppMsg contains a msg instance
 # and application ID Application is talking to device B to same App id,
 # a bit like content type.
@@ -119,12 +336,18 @@ class ConTerm(BadgeMsg):
 
 @BadgeMsg.register
 class AppMsg(BadgeMsg):
+    TYPE_ID = 5
 
-    __msg_type_reg = {}
+    # content types have their own id space
+    _types = {}
+    _names = {}
+    _dec = {}
+    _fill = {}
 
-    def __init__(self, content: object, con_id: int = 0):
+    def __init__(self, content: object, con_id: int = 0, seq: int = None):
         super().__init__()
         self.con_id = con_id
+        self.seq = seq  # set by Connection.send_app_msg()
         if isinstance(content, BadgeMsg):
             self.content = content
         elif isinstance(content, dict):
@@ -134,12 +357,128 @@ class AppMsg(BadgeMsg):
             ctype, rest = content["msg_type"], {
                 k: v for k, v in content.items() if k != "msg_type"
             }
-            self.content: BadgeMsg = self.__msg_type_reg.get(ctype)(**rest)
+            self.content: BadgeMsg = self._names.get(ctype)(**rest)
+
+    def srlz(self):
+        return self.content._app_srlz(self)
+
+    def retry_budget(self):
+        return self.content.RETRY
+
+    @classmethod
+    def _from(cls, v, o):
+        return cls(AppMsg._dec[v[o + 2]](v, o + 3), v[o], v[o + 1])
+
+    @staticmethod
+    def _into(m, v, o):
+        # content is handed to the app, so it is always a new instance
+        m.con_id = v[o]
+        m.seq = v[o + 1]
+        m.content = AppMsg._dec[v[o + 2]](v, o + 3)
+        return m
+
+
+# One to many: app content broadcast to a group, see badge.msg.group. Same
+# body as AppMsg with the group id in place of con_id, the header id is the
+# sender's sequence number in the group. Group ids are 1..127 so the id is
+# a single byte right after the array header and triage can read it.
+@BadgeMsg.register
+class GroupMsg(AppMsg):
+    TYPE_ID = 7
+
+    def __init__(self, content: object, group: int = 0, seq: int = None):
+        super().__init__(content, group, seq)
+
+    @property
+    def group(self):
+        return self.con_id
+
+
+def peek_group(frame):
+    # group id of a GroupMsg frame without decoding it
+    return frame[HDR_LEN + 1]
+
+
+# the nick of a beacon starts here when it is short, see peek_nick_len()
+BEACON_NICK = HDR_LEN + 2
+
+
+def peek_nick_len(frame):
+    # byte length of the nick at BEACON_NICK in a BeaconMsg frame without
+    # decoding it, -1 if the body isn't [short str]
+    b = frame[HDR_LEN + 1]
+    if frame[HDR_LEN] != 0x91 or b & 0xE0 != 0xA0:
+        return -1
+    return b & 0x1F
+
+
+# Receiver of a group asks the sender to resend count frames from first
+@BadgeMsg.register
+class GroupNack(BadgeMsg):
+    TYPE_ID = 8
+    _fields = ("group", "first", "count")
+
+    def __init__(self, group: int, first: int, count: int):
+        super().__init__()
+        self.group: int = group
+        self.first: int = first
+        self.count: int = count
+
+
+# Frame classes, the same on the transmit and the receive side. Lower is
+# sent first and dropped last: a full receive buffer gives up beacons, then
+# data frames, which the peer resends or is asked for again.
+CONTROL = 0  # connection control, and types not listed
+ACK = 1
+DATA = 2
+BEACON = 3
+
+FRAME_CLASS = {
+    OpenConn.TYPE_ID: CONTROL,
+    ConTerm.TYPE_ID: CONTROL,
+    AckMsg.TYPE_ID: ACK,
+    AppMsg.TYPE_ID: DATA,
+    GroupMsg.TYPE_ID: DATA,
+    ConCredit.TYPE_ID: DATA,
+    GroupNack.TYPE_ID: DATA,
+    BeaconMsg.TYPE_ID: BEACON,
+}
+
+# older firmware puts the type name somewhere in the map
+_LEGACY_CLASS = (
+    (b"\xa6AppMsg", DATA),
+    (b"\xa9BeaconMsg", BEACON),
+    (b"\xa6AckMsg", ACK),
+)
+
+
+def frame_class(frame) -> int:
+    t = frame[0]
+    if t == BUNDLE:
+        # the highest class of the records, read in place
+        cls, i, end = BEACON, 1, len(frame)
+        while i + 1 < end and cls > CONTROL:
+            c = FRAME_CLASS.get(frame[i + 1], CONTROL)
+            if c < cls:
+                cls = c
+            i += 1 + frame[i]
+        return cls
+    if is_legacy(frame):
+        b = bytes(frame)  # only old badges pay for the copy
+        for name, cls in _LEGACY_CLASS:
+            if name in b:
+                return cls
+        return CONTROL
+    return FRAME_CLASS.get(t, CONTROL)
 
 
 # most basic App msg that is handled by the connection stack
 @AppMsg.register
 class PingMsg(BadgeMsg):
+    TYPE_ID = 1
+    _fields = ("mark", "reply")
+    RETRY = 1  # a late ping measures nothing
+
     def __init__(self, mark: float, reply):
         super().__init__()
         self.mark: float = mark
@@ -148,11 +487,16 @@ class PingMsg(BadgeMsg):
 
 # Now messages does not have to be defined in this file, it is enough to import
 # BadgeMsg and decorate all messages with @BadgeMsg.register.
+# Give each message a fixed TYPE_ID and list its constructor arguments in
+# _fields, messages without _fields are sent as a name keyed map.
 
 
 # Example of AppMsg
 @AppMsg.register
 class RPSMsg(BadgeMsg):
+    TYPE_ID = 2
+    _fields = ("choice",)
+
     def __init__(self, choice: int):
         super().__init__()
         self.choice: int = choice
@@ -160,6 +504,9 @@ class RPSMsg(BadgeMsg):
 
 @AppMsg.register
 class VictoryMsg(BadgeMsg):
+    TYPE_ID = 3
+    _fields = ("your", "mine", "tie", "me_win")
+
     def __init__(self, your: int, mine: int, tie: bool = False, me_win: bool = False):
         super().__init__()
         self.your: int = your
@@ -168,6 +515,51 @@ class VictoryMsg(BadgeMsg):
         self.me_win: bool = me_win
 
 
+class MsgPool:
+    """
+    Fixed set of reusable message instances per core message type, used by
+    the receive path to decode frames in place instead of allocating.
+
+    Instances enter the pool through put() and are reused by get() until
+    released again. AppMsg content is always handed over to the app and is
+    never pooled, put() drops the reference to it.
+
+    Attributes:
+        size (int): Max number of idle instances kept per type.
+        hits (int): get() calls served from the pool.
+        misses (int): get() calls that had to allocate.
+    """
+
+    def __init__(self, size=2):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._free = {}  # type id -> list of idle instances
+
+    def get(self, tid):
+        free = self._free.get(tid)
+        if free and BadgeMsg._fill[tid]:
+            self.hits += 1
+            return free.pop()
+        self.misses += 1
+        return None
+
+    def put(self, msg):
+        tid = msg.TYPE_ID
+        if BadgeMsg._types.get(tid) is not type(msg):
+            return  # not a core message
+        if isinstance(msg, AppMsg):
+            msg.content = None
+        free = self._free.get(tid)
+        if free is None:
+            free = self._free[tid] = []
+        if len(free) < self.size:
+            free.append(msg)
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
+
+
 async def send_message(espnow, mac: bytes, msg: bytes, sync=False, retries=3):
     for _ in range(retries):  # tree retries on sending
         try:
@@ -182,8 +574,8 @@ async def send_message(espnow, mac: bytes, msg: bytes, sync=False, retries=3):
                 espnow.active(True)
                 gc.collect()
             elif err.args[1] == "ESP_ERR_ESPNOW_NOT_FOUND":
+                # not sent through a PeerTable, e.g. Beacon before NowListener
                 espnow.add_peer(mac)
-                gc.collect()
             elif err.args[1] == "ESP_ERR_ESPNOW_IF":
                 import network
 
@@ -199,12 +591,18 @@ async def send_message(espnow, mac: bytes, msg: bytes, sync=False, retries=3):
 
 
 class BadgeAdr(object):
-    # BadgeAdr is result in receivers end of receiving BeaconMsg
-    def __init__(self, mac: bytes, nick: str, rssi: int, last_seen: float):
+    # BadgeAdr is result in receivers end of receiving BeaconMsg. The peers
+    # of a BadgeAdrDict are packed in arrays, it hands out BadgeAdr copies,
+    # read them again for fresh values. band is the RSSI band of the peer,
+    # 0 the weakest
+    def __init__(
+        self, mac: bytes, nick: str, rssi: int, last_seen: float, band: int = 0
+    ):
         self.mac: bytes = mac
         self.nick: bytes = nick
         self.rssi: int = rssi
         self.last_seen: float = last_seen
+        self.band: int = band
 
     def __hash__(self):
         return hash(self.mac)
@@ -220,20 +618,253 @@ class BadgeAdr(object):
 
 null_badge_adr = BadgeAdr(b"\x00\x00\x00\x00\x00\x00", b"[none]", -1, 0)
 
+NICK_LEN = 20  # Config.set_nick() takes up to this, longer ones are cut here
+RSSI_BANDS = (-65, -55, -45)  # dBm, band n is at or above edge n - 1
+
+# peer events of a BadgeAdrDict, bits so a listener can ask for several
+APPEAR = 1  # new peer, or a stale one heard again
+BAND = 2  # smoothed RSSI changed band
+LEAVE = 4  # peer left the table, evicted or expired
+STALE = 8  # not heard for stale_s
+NICK = 16  # sent a new nick
+
 
 class BadgeAdrDict:
-    # Dict like class for having fixed number of BadgeAdr instances with mac as key
-    def __init__(self, max_size):
+    """
+    Dict like class for a fixed number of peers with mac as key, without a
+    Python object per peer. Every peer has a small integer handle indexing
+    arrays: 6 packed mac bytes, length prefixed nick bytes, RSSI and last
+    seen time (time() seconds), and the links of a recency list, newest
+    first. Macs are found through an open addressing index of handles.
+    Storing and refreshing a peer moves it to the front and a full table
+    reuses the handle of the peer seen longest ago, all in O(1), about 36
+    bytes per peer.
+
+    RSSI is smoothed per peer, an EWMA weighing a new sample by
+    1 / 2**rssi_shift kept in 1/16 dB. The smoothed value places the peer
+    in a band between the edges of bands, it has to get hyst_db past an
+    edge to change band, so a beacon only needs to be shown when a peer
+    appears or changes band.
+
+    sweep() ages peers: one not heard for stale_s is stale, out of
+    matchmaking (fresh_keys(), fresh_len()) but still known, one not heard
+    for expire_s is removed. The recency list is sorted by last seen, so a
+    sweep walks only the peers that turn stale or expire, from the stale
+    end of the list, whatever the size. last_seen must not go backwards.
+
+    Changes go to on_event(event, mac, adr) if set: APPEAR, BAND, NICK,
+    STALE and LEAVE, adr the BadgeAdr of a peer that left, else None.
+
+    Reading a peer (d[mac], values(), latest()) builds a BadgeAdr, the
+    receive path stores and refreshes peers without one.
+
+    Methods:
+        add(mac, nick, rssi, last_seen): Store a peer, returns its handle.
+        handle(mac): Handle of mac, -1 if not known.
+        view(h): BadgeAdr of handle h.
+        nick_is(mac, buf, o, n): True if mac is known with nick buf[o:o + n].
+        refresh(mac, last_seen, rssi=None): Refresh a known peer, -1 if not
+            known, else the event bits it caused.
+        update_last_seen(mac, last_seen, rssi=None): Same, True if known.
+        items(), values(), keys(), latest(): Like a dict of BadgeAdr.
+        sweep(now): Mark peers stale and expire them, returns peers expired.
+        is_fresh(mac), fresh_len(), fresh_keys(): Peers heard within stale_s.
+    """
+
+    def __init__(
+        self,
+        max_size,
+        bands=RSSI_BANDS,
+        hyst_db=3,
+        rssi_shift=2,
+        stale_s=30,
+        expire_s=1800,
+    ):
         self.max_size = max_size
-        self.store = {}
+        self.bands = bands
+        self.hyst_db = hyst_db
+        self.rssi_shift = rssi_shift
+        self.stale_s = stale_s
+        self.expire_s = expire_s
+        self.on_event = None
         self.last_index = None
+        self._len = 0
+        self._used = 0  # handles handed out at least once
+        self._free = -1  # chain of deleted handles, through _older
+        self._newest = -1
+        self._oldest = -1
+        self._macs = bytearray(6 * max_size)
+        self._nicks = bytearray((NICK_LEN + 1) * max_size)
+        self._rssi = array("h", bytes(2 * max_size))  # 1/16 dB
+        self._band = bytearray(max_size)
+        self._stale = bytearray(max_size)
+        self._nstale = 0
+        self._edge = -1  # newest stale peer, all older ones are stale too
+        self._seen = array("I", bytes(4 * max_size))
+        self._newer = array("h", bytes(2 * max_size))
+        self._older = array("h", bytes(2 * max_size))
+        n = 8
+        while n < 2 * max_size:
+            n *= 2
+        self._mask = n - 1
+        self._index = array("h", [-1] * n)  # hash slot -> handle, -1 empty
 
-    def _evict_if_necessary(self):
-        if len(self.store) >= self.max_size:
-            # Find the key with the oldest last_seen value
-            oldest_key = min(self.store, key=lambda k: self.store[k].last_seen)
-            # Remove that key from the store
-            del self.store[oldest_key]
+    @staticmethod
+    def _hash(b, o):
+        # last bytes of the mac, the vendor prefix is mostly the same
+        return b[o + 5] | b[o + 4] << 8 | (b[o + 3] ^ b[o + 2]) << 16
+
+    def _slot(self, mac):
+        # index slot holding mac, or the empty one where it would go
+        ix, ms, m = self._index, self._macs, self._mask
+        i = self._hash(mac, 0) & m
+        while True:
+            h = ix[i]
+            if h < 0:
+                return i
+            o = 6 * h
+            if (
+                ms[o + 5] == mac[5]
+                and ms[o + 4] == mac[4]
+                and ms[o + 3] == mac[3]
+                and ms[o + 2] == mac[2]
+                and ms[o + 1] == mac[1]
+                and ms[o] == mac[0]
+            ):
+                return i
+            i = (i + 1) & m
+
+    def _unindex(self, i):
+        # empty slot i, moving up entries that probed past it
+        ix, m = self._index, self._mask
+        j = i
+        while True:
+            j = (j + 1) & m
+            h = ix[j]
+            if h < 0:
+                break
+            k = self._hash(self._macs, 6 * h) & m
+            if (i < j and (k <= i or k > j)) or (i > j and k <= i and k > j):
+                ix[i] = h
+                i = j
+        ix[i] = -1
+
+    def _emit(self, event, h, adr=None):
+        if self.on_event:
+            self.on_event(event, self.mac(h), adr)
+
+    def _unlink(self, h):
+        # returns whether h was stale, it isn't once out of the list
+        was = self._stale[h]
+        if was:
+            self._stale[h] = 0
+            self._nstale -= 1
+            if h == self._edge:
+                self._edge = self._older[h]
+        newer, older = self._newer[h], self._older[h]
+        if newer >= 0:
+            self._older[newer] = older
+        else:
+            self._newest = older
+        if older >= 0:
+            self._newer[older] = newer
+        else:
+            self._oldest = newer
+        return was
+
+    def _push(self, h):
+        self._older[h] = self._newest
+        self._newer[h] = -1
+        if self._newest >= 0:
+            self._newer[self._newest] = h
+        else:
+            self._oldest = h
+        self._newest = h
+
+    def _remove(self, h):
+        if self.on_event:
+            self._emit(LEAVE, h, self.view(h))
+        self._unindex(self._slot(self.mac(h)))
+        self._unlink(h)
+        self._older[h] = self._free
+        self._free = h
+        self._len -= 1
+
+    def handle(self, mac):
+        return self._index[self._slot(mac)]
+
+    def add(self, mac, nick, rssi, last_seen):
+        i = self._slot(mac)
+        h = self._index[i]
+        event = 0
+        nick = nick.encode() if isinstance(nick, str) else nick
+        if h >= 0:
+            # a refresh, nobody else has to go
+            if self._unlink(h):
+                event = APPEAR
+            if not self._nick_is(h, nick, 0, len(nick)):
+                event |= NICK
+        else:
+            event = APPEAR
+            if self._len >= self.max_size:
+                # the end of the list is the one seen longest ago
+                self._remove(self._oldest)
+                i = self._slot(mac)
+            if self._free >= 0:
+                h = self._free
+                self._free = self._older[h]
+            else:
+                h = self._used
+                self._used += 1
+            self._index[i] = h
+            self._macs[6 * h : 6 * h + 6] = mac
+            self._len += 1
+        n = min(len(nick), NICK_LEN)
+        o = (NICK_LEN + 1) * h
+        self._nicks[o] = n
+        self._nicks[o + 1 : o + 1 + n] = nick[:n]
+        self._rssi[h] = rssi << 4
+        self._band[h] = self._move_band(h, 0, 0)
+        self._seen[h] = int(last_seen)
+        self._push(h)
+        self.last_index = self.mac(h)
+        if event:
+            self._emit(event, h)
+        return h
+
+    def _move_band(self, h, band, hyst):
+        s, edges = self._rssi[h], self.bands
+        while band < len(edges) and s >= (edges[band] + hyst) << 4:
+            band += 1
+        while band > 0 and s < (edges[band - 1] - hyst) << 4:
+            band -= 1
+        return band
+
+    def _nick_is(self, h, buf, o, n):
+        # compared the way add() stores it, cut to NICK_LEN bytes
+        n = min(n, NICK_LEN)
+        nicks = self._nicks
+        p = (NICK_LEN + 1) * h
+        if n < 0 or nicks[p] != n:
+            return False
+        p += 1 - o
+        for i in range(o, o + n):
+            if nicks[p + i] != buf[i]:
+                return False
+        return True
+
+    def nick_is(self, mac, buf, o, n):
+        h = self.handle(mac)
+        return h >= 0 and self._nick_is(h, buf, o, n)
+
+    def mac(self, h):
+        return bytes(self._macs[6 * h : 6 * h + 6])
+
+    def view(self, h):
+        o = (NICK_LEN + 1) * h
+        nick = bytes(self._nicks[o + 1 : o + 1 + self._nicks[o]]).decode()
+        rssi = (self._rssi[h] + 8) >> 4
+        return BadgeAdr(self.mac(h), nick, rssi, self._seen[h], self._band[h])
 
     def __setitem__(self, key, value):
         if not isinstance(value, BadgeAdr):
@@ -242,52 +873,109 @@ class BadgeAdrDict:
         if key != value.mac:
             raise ValueError("Key must match the 'mac' attribute of the value.")
 
-        self._evict_if_necessary()
-        self.store[key] = value
-        self.store[key].last_seen = time()
-        self.last_index = key
+        self.add(key, value.nick, value.rssi, time())
 
     def __getitem__(self, key):
-        if key in self.store:
-            return self.store[key]
+        h = self.handle(key)
+        if h >= 0:
+            return self.view(h)
         raise KeyError(f"Key {key} not found in store.")
 
     def __delitem__(self, key):
-        if key in self.store:
-            del self.store[key]
+        h = self.handle(key)
+        if h >= 0:
+            self._remove(h)
         else:
             raise KeyError(f"Key {key} not found in store.")
 
     def __contains__(self, key):
-        return key in self.store
+        return self.handle(key) >= 0
 
     def __len__(self):
-        return len(self.store)
+        return self._len
+
+    def _handles(self):
+        h = self._newest
+        while h >= 0:
+            yield h
+            h = self._older[h]
 
     def __iter__(self):
-        # for casting a simple dict(badge_addr_dict)
-        for key in self.store:
-            yield key, self.store[key]
+        # for casting a simple dict(badge_addr_dict), newest first
+        for h in self._handles():
+            yield self.mac(h), self.view(h)
 
     def items(self):
-        return self.store.items()
+        return list(self)
 
     def values(self):
-        return self.store.values()
+        return [self.view(h) for h in self._handles()]
 
     def keys(self):
-        return self.store.keys()
+        return [self.mac(h) for h in self._handles()]
 
     def latest(self):
-        return self.store[self.last_index]
-
-    def update_last_seen(self, key, last_seen):
-        if key in self.store:
-            self.store[key].last_seen = last_seen
-            self.last_index = key
-            return True
-        return False
-
+        return self[self.last_index]
+
+    def refresh(self, key, last_seen, rssi=None):
+        h = self.handle(key)
+        if h < 0:
+            return -1
+        self._seen[h] = int(last_seen)
+        event = 0
+        if h != self._newest or self._stale[h]:
+            if self._unlink(h):
+                event = APPEAR
+            self._push(h)
+        self.last_index = key
+        if rssi is not None:
+            s = self._rssi[h]
+            s += ((rssi << 4) - s) >> self.rssi_shift
+            self._rssi[h] = s
+            band = self._band[h]
+            new = self._move_band(h, band, self.hyst_db)
+            if new != band:
+                self._band[h] = new
+                event |= BAND
+        if event:
+            self._emit(event, h)
+        return event
+
+    def update_last_seen(self, key, last_seen, rssi=None):
+        return self.refresh(key, last_seen, rssi) >= 0
+
+    def sweep(self, now):
+        now = int(now)
+        seen, newer = self._seen, self._newer
+        # peers newer than the edge turn stale oldest first, stop at the
+        # first one heard recently enough
+        h = newer[self._edge] if self._edge >= 0 else self._oldest
+        while h >= 0 and now - seen[h] >= self.stale_s:
+            self._stale[h] = 1
+            self._nstale += 1
+            self._edge = h
+            self._emit(STALE, h)
+            h = newer[h]
+        n = 0
+        while self._oldest >= 0 and now - seen[self._oldest] >= self.expire_s:
+            self._remove(self._oldest)
+            n += 1
+        return n
+
+    def is_fresh(self, mac):
+        h = self.handle(mac)
+        return h >= 0 and not self._stale[h]
+
+    def fresh_len(self):
+        return self._len - self._nstale
+
+    def fresh_keys(self):
+        keys = []
+        h = self._newest
+        while h >= 0 and not self._stale[h]:
+            keys.append(self.mac(h))
+            h = self._older[h]
+        return keys
 
 
 def test():
@@ -307,4 +995,7 @@ def test():
     print(f"{b.srlz()=}")
     bb: VictoryMsg = BadgeMsg.desrlz(b.srlz())
     print(f"{bb.to_dict()=}")
-    print(f"{AppMsg.__registered_messages =} \n" f"{BadgeMsg.__registered_messages=} ")
+    legacy = umsgpack.dumps(b.to_dict())
+    print(f"{len(legacy)=} {len(b.srlz())=}")
+    print(f"{BadgeMsg.desrlz(legacy).to_dict()=}")
+    print(f"{AppMsg._types =} \n" f"{BadgeMsg._types=} ")
@@ -0,0 +1,135 @@
+import asyncio
+
+from badge.msg import APPEAR, BAND, LEAVE, NICK, STALE, BadgeAdr
+
+# peer events as the table raises them, bits a subscriber can combine
+ALL = APPEAR | BAND | LEAVE | STALE | NICK
+
+
+class Subscription:
+    """
+    One listener of a PeerBus, with its own queue. The queue holds peers,
+    not events: an event for a peer already queued is merged into its
+    entry, the listener gets the peer's state when it reads it. At most
+    depth peers wait, a new one pushes out the one waiting longest.
+
+    Attributes:
+        mac (bytes): Only events of this peer, None for all.
+        events (int): Bits of the events wanted.
+        event (int): Event bits of the peer get() returned last.
+        dropped (int): Peers pushed out of a full queue.
+
+    Methods:
+        async get(): Next peer as BadgeAdr, event bits in self.event.
+        async for adr in subscription: Same, closes when cancelled.
+        close(): Stop receiving, done by the bus user.
+    """
+
+    def __init__(self, bus, mac=None, events=ALL, depth=16):
+        self.bus = bus
+        self.mac = mac
+        self.events = events
+        self.depth = depth
+        self.event = 0
+        self.dropped = 0
+        self._q = {}  # mac -> [event bits, BadgeAdr of a peer that left]
+        self._order = []  # queued macs, oldest first
+        self._ev = asyncio.Event()
+
+    def __len__(self):
+        return len(self._order)
+
+    def _put(self, event, mac, adr):
+        if not event & self.events or (self.mac is not None and mac != self.mac):
+            return
+        e = self._q.get(mac)
+        if e is not None:
+            e[0] |= event
+            e[1] = adr
+            self.bus.coalesced += 1
+            return
+        if len(self._order) >= self.depth:
+            del self._q[self._order.pop(0)]
+            self.dropped += 1
+        self._q[mac] = [event, adr]
+        self._order.append(mac)
+        self._ev.set()
+
+    async def get(self):
+        try:
+            while not self._order:
+                self._ev.clear()
+                await self._ev.wait()
+        except asyncio.CancelledError:
+            self.close()
+            raise
+        mac = self._order.pop(0)
+        self.event, adr = self._q.pop(mac)
+        if mac in self.bus.table:
+            return self.bus.table[mac]  # latest state
+        return adr or BadgeAdr(mac, "", 0, 0)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.get()
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class PeerBus:
+    """
+    Publishes changes of a peer table (BadgeAdrDict) to any number of
+    subscribers, each with its own filters and queue, so a slow one never
+    holds back or steals from another. The table publishes its own changes:
+    peers appearing, changing band or nick, going stale and leaving it.
+
+    Attributes:
+        table (BadgeAdrDict): The peers events are about.
+        published (int): Events published.
+        coalesced (int): Events merged into a peer already queued.
+        on_leave (callable): Called with the mac of a peer that left the
+            table, before any subscriber hears of it. None by default.
+
+    Methods:
+        subscribe(mac=None, events=ALL, depth=16): New Subscription.
+        unsubscribe(sub): Remove a subscription.
+        publish(event, mac, adr=None): Tell subscribers, adr for a peer that
+            is no longer in the table.
+        stats(): Counters, subscribers and their queue depth as a dict.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self.published = 0
+        self.coalesced = 0
+        self._subs = []
+        self.on_leave = None
+        table.on_event = self.publish
+
+    def subscribe(self, mac=None, events=ALL, depth=16):
+        sub = Subscription(self, mac, events, depth)
+        self._subs.append(sub)
+        return sub
+
+    def unsubscribe(self, sub):
+        if sub in self._subs:
+            self._subs.remove(sub)
+
+    def publish(self, event, mac, adr=None):
+        self.published += 1
+        if event & LEAVE and self.on_leave:
+            self.on_leave(mac)
+        for sub in self._subs:
+            sub._put(event, mac, adr)
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subs),
+            "queued": [len(s) for s in self._subs],
+            "dropped": sum(s.dropped for s in self._subs),
+            "published": self.published,
+            "coalesced": self.coalesced,
+        }
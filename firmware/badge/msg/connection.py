@@ -1,30 +1,47 @@
 import asyncio
+from random import randint
 from time import ticks_ms, ticks_diff, time
 
-import aioespnow
-from collections import namedtuple, deque
-
 from badge.msg import (
     OpenConn,
     send_message,
     ConTerm,
+    ConCredit,
+    GroupMsg,
+    GroupNack,
     PingMsg,
     AppMsg,
     BadgeMsg,
     BeaconMsg,
-    BadgeAdr,
     BadgeAdrDict,
     AckMsg,
+    MsgPool,
+    peek,
+    BUNDLE,
+    BROADCAST,
+    BEACON_NICK,
+    LEGACY_IDS,
+    unbundle,
+    is_legacy,
+    peek_group,
+    peek_nick_len,
+)
+from badge.msg.bus import ALL, PeerBus
+from badge.msg.peers import PeerTable
+from badge.msg.rx import RxBuffer
+from badge.msg.stats import LinkStats
+from badge.msg.tx import (
+    DupFilter,
+    FrameAggregator,
+    RetxScheduler,
+    SEQ_MASK,
+    seq_diff,
 )
 
 from bdg.utils import AProc
 from primitives import Queue
 
 
-OutQueMsg = namedtuple("OutQueMsg", ["msg", "mac", "id", "retry"])
-OutQueAck = namedtuple("OutQueMsg", ["mac", "id"])
-
-
 class Connection(object):
     """
     Connection is a bidirectional communication channel between two badges.
@@ -36,6 +53,10 @@ class Connection(object):
         last_msg (timestamp): Timestamp of the last message received.
         con_id: Unique identifier for the app that uses this connection. Like content-type
         in_q (Queue): Queue to store incoming messages.
+        window (int): Max app messages in flight (sent, not acked), more wait in out_q.
+        tx_seq (int): Sequence number of the next app message sent.
+        rx_seq (int): Sequence number of the next app message to deliver to in_q.
+        credit (int): App messages the peer can still take, see ConCredit.
 
     Methods:
         async connect(self, rcvr=False):
@@ -50,8 +71,18 @@ class Connection(object):
         async recv_msg(self, msg: BadgeMsg):
             Handles the reception of messages internally and processes different types of messages. Called by NowListener.
 
-        async send_app_msg(self, msg: BadgeMsg, sync=False):
+        send_app_msg(self, msg: BadgeMsg, sync=False):
             Sends an application message over the connection. Receiving end gets the same class as the sender sent.
+            App messages are delivered in the order they were sent, up to window of
+            them are in flight at once, and no more than the receiver has room for
+            in its in_q. The rest waits in out_q, dropped if it is full.
+
+        async send(self, msg: BadgeMsg):
+            Like send_app_msg, but waits while out_q is full instead of dropping.
+
+        async recv_app_msg(self, app_msg: AppMsg):
+            Puts received app messages back in order before passing them to
+            recv_msg. Called by NowListener.
 
         async send_msg_b(self, msg: bytes, sync=False):
             Sends a byte message over the connection.
@@ -63,9 +94,15 @@ class Connection(object):
             Returns an asynchronous iterator to iterate over incoming messages.
     """
 
+    WINDOW = 8
+    OUT_Q = 16
+    IN_Q = 5  # app messages, the peer gets this much credit to start with
+    HOLD_MS = 3000  # give up waiting for a missing app message after this
+    PROBE_MS = 2000  # ask for credit after waiting this long
+
     # Connection is a bidirectional communication channel between two badges
     #
-    def __init__(self, mac: bytes, con_id, espnow):
+    def __init__(self, mac: bytes, con_id, espnow, window=WINDOW):
         self._sender_t: asyncio.Task = None
         self.espnow: espnow = espnow
         self.c_mac: bytes = mac
@@ -75,22 +112,34 @@ class Connection(object):
         self.closed = False
         self.last_msg = time()
         self.con_id = con_id
-        self.in_q = Queue(maxsize=5)
-        self.out_q = Queue(maxsize=3)
+        # room for control messages (OpenConn, ConTerm) on top of app messages
+        self.in_q = Queue(maxsize=Connection.IN_Q + 2)
+        self.out_q = Queue(maxsize=Connection.OUT_Q)
+        self.window = window
+        self.tx_seq = 0
+        self._in_flight = []  # message ids of app messages not acked yet
+        self._limit = Connection.IN_Q  # peer takes app messages up to this seq
+        self._credit_ev = asyncio.Event()
+        self.rx_seq = 0
+        self._held = {}  # seq -> app message that arrived ahead of rx_seq
+        self._held_since = 0
+        self._release_t = None
+        self._granted = Connection.IN_Q  # limit last sent to the peer
 
         NowListener.register_con(self)
 
     def __del__(self):
         print("conn closed")
 
-    async def terminate(self, send_out=True, reply_to_id=None):
-        # send connection terminated to local listeners
+    async def terminate(self, send_out=True, retry=None):
+        # send connection terminated to local listeners, and to the peer with
+        # retry resends when send_out
         ct = ConTerm(con_id=self.con_id)
+        if self.in_q.full():
+            self.in_q.get_nowait()  # ending the connection matters more
         self.in_q.put_nowait(ct)
         if send_out:
-            if reply_to_id:
-                ct.__id = reply_to_id
-            self.send_msg(ct)
+            self.send_msg(ct, retry=retry)
             NowListener.unregister_con(self)
         self.active = False
         self.closed = True
@@ -125,21 +174,72 @@ class Connection(object):
         print(f"ping: ")
         mark = ticks_ms()
         self.send_app_msg(PingMsg(mark, False), sync=False)
-        reply = await asyncio.wait_for(self.in_q.get(), 5)
+        reply = await self.get(5)
         print(f"ping reply: {ticks_diff(ticks_ms(), mark)}ms {reply=}")
         return reply
 
+    def in_flight(self):
+        # app messages sent and not yet acked, or dropped after retries
+        retx = NowListener.retx_sched()
+        self._in_flight = [i for i in self._in_flight if retx.waiting(self.c_mac, i)]
+        return len(self._in_flight)
+
+    @property
+    def credit(self):
+        if self.c_mac in NowListener.legacy:
+            return Connection.IN_Q  # older firmware grants no credit
+        return max(0, seq_diff(self._limit, self.tx_seq))
+
+    def _can_send(self):
+        return self.credit > 0 and self.in_flight() < self.window
+
     async def _sender(self):
-        # sender task to decouple sync calls to async.
-        # micro gui callbacks are sync so this is needed
-        # if in async context self.send_app_msg can be called directly
-        if not self.active:
-            print(f"cannot send con {self.con_id} terminated")
-            return  # cannot send on closed connection
-        while self.out_q.qsize() > 0 or self.active:
-            msg = await asyncio.wait_for(self.out_q.get(), 5000)
-            print(f"_s:  {msg}")
-            self.send_app_msg(msg, sync=False)
+        # sends messages queued by send_app_msg as the window and credit open up
+        retx = NowListener.retx_sched()
+        while not self.out_q.empty() and not self.closed:
+            if self.credit == 0:
+                self._credit_ev.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._credit_ev.wait(), Connection.PROBE_MS / 1000
+                    )
+                except asyncio.TimeoutError:
+                    # the credit update may have been lost, ask for it
+                    self.send_msg(ConCredit(self.con_id, self.tx_seq, probe=True))
+                continue
+            if self.in_flight() >= self.window:
+                retx.acked.clear()
+                await retx.acked.wait()
+                continue
+            self._send_app(await self.out_q.get())
+
+    def _grant(self, force=False):
+        # tell the peer how far it can send once at least half of in_q has
+        # freed up since the last grant, not a control frame per message or
+        # two. A peer that ran out waits for that as well, or probes
+        # held messages count too, they are past rx_seq
+        room = max(0, Connection.IN_Q - self.in_q.qsize())
+        limit = (self.rx_seq + room) & SEQ_MASK
+        if not force and 2 * seq_diff(limit, self._granted) < Connection.IN_Q:
+            return
+        self._granted = limit
+        self.send_msg(ConCredit(self.con_id, limit))
+
+    def _put_in(self, msg):
+        if self.in_q.full():
+            print(f"con {self.con_id} in_q full, dropped {msg}")
+            return
+        self.in_q.put_nowait(msg)
+
+    async def get(self, timeout=None):
+        # next message from in_q, frees credit for the peer
+        if timeout is None:
+            msg = await self.in_q.get()
+        else:
+            msg = await asyncio.wait_for(self.in_q.get(), timeout)
+        if not self.closed:
+            self._grant()
+        return msg
 
     async def recv_msg(self, msg: BadgeMsg):
         # internal recv_msg that is called from NowListener
@@ -148,32 +248,116 @@ class Connection(object):
             if self.active:
                 await self.terminate(send_out=False)
                 print(f"connection {self.con_id} terminated")
+        elif isinstance(msg, ConCredit):
+            if msg.probe:
+                self._grant(force=True)
+            elif seq_diff(msg.limit, self._limit) > 0:
+                self._limit = msg.limit
+                self._credit_ev.set()
         elif isinstance(msg, OpenConn):
             if not self.active:
-                self.in_q.put_nowait(msg)
+                self._put_in(msg)
                 self.active = True
                 print(f"connection {self.con_id} activated")
             # self.send_msg(AckMsg(id=msg.id), retry=0)
         elif isinstance(msg, PingMsg):
             if msg.reply:
-                self.in_q.put_nowait(msg)
+                self._put_in(msg)
                 return
             msg.reply = True
             self.send_app_msg(msg)
         elif not self.active:
             print("connection not active")
         else:
-            # this can block, should check quefull and return something to client B
-            self.in_q.put_nowait(msg)
+            # a sender that keeps to its credit never finds in_q full
+            self._put_in(msg)
+
+    async def recv_app_msg(self, app_msg: AppMsg):
+        # internal, called from NowListener. Holds messages that arrive ahead
+        # of a lost one until its retry comes in, duplicates are dropped.
+        seq = app_msg.seq
+        if seq is None:
+            # unordered sender (old firmware)
+            return await self.recv_msg(app_msg.content)
+        d = seq_diff(seq, self.rx_seq)
+        if d < 0 or seq in self._held:
+            print(f"Filtered out {self.con_id=} {seq=}")
+            return
+        if not self._held:
+            self._held_since = ticks_ms()
+        self._held[seq] = app_msg.content
+        if d > 0 and len(self._held) <= self.window and self._holding():
+            if self._release_t is None:
+                # nothing else may come in, deliver them after HOLD_MS anyway
+                self._release_t = asyncio.create_task(self._release())
+            return
+        await self._deliver(skip=d > 0)
+
+    def _holding(self):
+        return ticks_diff(ticks_ms(), self._held_since) < Connection.HOLD_MS
+
+    async def _deliver(self, skip=False):
+        if skip:
+            # the missing ones ran out of retries, skip to the oldest held
+            skip = min(seq_diff(s, self.rx_seq) for s in self._held)
+            print(f"con {self.con_id} lost {skip} msgs")
+            self.rx_seq = (self.rx_seq + skip) & SEQ_MASK
+        while self.rx_seq in self._held:
+            msg = self._held.pop(self.rx_seq)
+            self.rx_seq = (self.rx_seq + 1) & SEQ_MASK
+            await self.recv_msg(msg)
+        self._held_since = ticks_ms()
+        self._grant()
+
+    async def _release(self):
+        # delivers held messages whose missing predecessor didn't come in
+        # HOLD_MS, when no later message arrives to notice it
+        try:
+            while self._held and not self.closed:
+                wait = Connection.HOLD_MS - ticks_diff(ticks_ms(), self._held_since)
+                if wait > 0:
+                    await asyncio.sleep(wait / 1000)
+                else:
+                    await self._deliver(skip=True)
+        finally:
+            self._release_t = None
 
     def send_app_msg(self, msg: BadgeMsg, sync=False):
-        amsg = AppMsg(con_id=self.con_id, content=msg)
         if self.closed:
             print(f"cannot send {self.con_id=} is terminated")
             return  # cannot send on closed connection
-        NowListener.send_msg(amsg, self.c_mac, sync=sync)
+        if self.out_q.empty() and self._can_send():
+            self._send_app(msg)
+            return
+        # window or credit used up, sent by _sender once acks / credit come in
+        if self.out_q.full():
+            print(f"con {self.con_id} out_q full, dropped {msg}")
+            return
+        self.out_q.put_nowait(msg)
+        self._start_sender()
+
+    async def send(self, msg: BadgeMsg):
+        # waits for room in out_q when the peer is slow to take messages
+        if self.closed:
+            print(f"cannot send {self.con_id=} is terminated")
+            return
+        if self.out_q.empty() and self._can_send():
+            self._send_app(msg)
+            return
+        await self.out_q.put(msg)
+        self._start_sender()
+
+    def _start_sender(self):
+        if self._sender_t is None or self._sender_t.done():
+            self._sender_t = asyncio.create_task(self._sender())
+
+    def _send_app(self, msg: BadgeMsg):
+        amsg = AppMsg(con_id=self.con_id, content=msg, seq=self.tx_seq)
+        self.tx_seq = (self.tx_seq + 1) & SEQ_MASK
+        NowListener.send_msg(amsg, self.c_mac)
+        self._in_flight.append(amsg.id)
 
-    def send_msg(self, msg: BadgeMsg, sync=False, retry=3):
+    def send_msg(self, msg: BadgeMsg, sync=False, retry=None):
         if self.closed:
             print(f"cannot send {self.con_id=} is terminated")
             return  # cannot send on closed connection # TODO :raise
@@ -182,7 +366,7 @@ class Connection(object):
     async def send_wait_reply(self, msg: BadgeMsg, sync=False, timeout=5.0):
         # raises TimeoutError if timeout exceeded
         self.send_msg(msg, sync=sync)
-        return await asyncio.wait_for(self.in_q.get(), timeout)
+        return await self.get(timeout)
 
     def get_msg_aiter(self):
         class Aiter:
@@ -193,7 +377,7 @@ class Connection(object):
                 return self
 
             async def __anext__(self):
-                msg: AppMsg = await self.conn.in_q.get()
+                msg: AppMsg = await self.conn.get()
                 print(f"__anext__ ")
                 if isinstance(msg, ConTerm):
                     raise StopAsyncIteration
@@ -218,14 +402,6 @@ async def def_con_cb(con: Connection, req=False):
     return True
 
 
-def wait_index(msg):
-    return msg.mac + bytes([msg.id])
-
-
-def wait_index_mac(mac, msg_id):
-    return mac + bytes([msg_id])
-
-
 class NowListener(object):
     """
     The NowListener class listens and processes incoming ESP-NOW messages. It manages connections,
@@ -237,242 +413,478 @@ class NowListener(object):
 
     Attributes:
         __instance (NowListener): Singleton instance of the class.
-        connections (dict): Dictionary holding active connections indexed by connection ID.
-        last_seen (BadgeAdrDict): Dict like object with eviction after max_size reached
-        update_event (asyncio.Event): Asyncio event to notify updates.
+        connections (dict): Session table, connections indexed by (peer mac, app id).
+            A badge can have sessions of the same app with several peers and of
+            several apps with one peer.
+        idle_s (int): Active sessions with nothing received for this long are
+            terminated.
+        age_s (int): How often last_seen is swept, peers go stale after
+            last_seen.stale_s and are removed after last_seen.expire_s.
+        groups (dict): Joined broadcast groups (badge.msg.group.Group) indexed by
+            group ID.
+        last_seen (BadgeAdrDict): Packed peer table, evicts the peer seen longest ago
+            after max_size
+        pool (MsgPool): Reusable message instances for the receive path, see
+            pool.stats()
+        tx (FrameAggregator): Bundles outgoing frames and acks per peer and sends them
+            by priority class (control, ack, data, beacon), tx.flush_ms sets the
+            window, tx.drops counts drops
+        retx (RetxScheduler): Keeps sent frames until acked and resends them on timeout
+        peers (PeerTable): ESP-NOW driver peer slots, LRU with session and group peers
+            pinned
+        stats (LinkStats): Per peer frames, bytes, retries, timeouts, duplicates, RSSI
+            and RTT, for peers with a driver slot
+        rx (RxBuffer): Received frames waiting for dispatch in preallocated slots, see
+            rx.stats()
+        seen (DupFilter): Message ids received per peer, retries of delivered frames
+            are dropped
+        legacy (dict): Peers on older firmware, their last ids received. They get
+            frames in their map format, unbundled, with each message acked on its own.
+        bus (PeerBus): Publishes peers appearing, changing RSSI band, going stale or
+            leaving last_seen to subscribers, see bus.stats().
         conn_request (asyncio.Event): Asyncio event for new connection requests.
-        __espnow (aioespnow.AIOESPNow): AIOESPNow instance to handle ESP-NOW communication.
+        __espnow (aioespnow.AIOESPNow): AIOESPNow instance to handle ESP-NOW
+            communication, or a host.transport.Transport to run without the
+            radio.
 
     Methods:
         incoming_con_cb(con): Callback for handling incoming connections.
         task(): Main task to listen and process incoming ESP-NOW messages.
-        get_updates(): Returns a generator that yields the last seen updates.
-        register_con(connection): Registers a new connection and adds the respective peer in ESP-NOW.
+        dispatch(): Worker decoding and routing the frames task() received.
+        updates(filter_mac=None): Subscription to last_seen changes, yields BadgeAdr.
+        register_con(connection): Registers a new connection and pins the respective
+            peer in ESP-NOW.
         unregister_con(connection): Unregisters a connection and removes it from the active connections.
+        session(mac, con_id): The connection for peer mac and app con_id, or None.
+        expire_idle(): Terminates sessions idle longer than idle_s, called by task()
+            periodically.
         start(espnow): Starts the NowListener instance if not already started.
         stop(): Stops the NowListener instance if it is running.
         dispatch_app_msg(app_msg): Dispatches an application message to the corresponding connection.
-        dispatch_msg(msg, con_id): Dispatches a message to the corresponding connection based on connection ID.
+        dispatch_msg(msg, con_id): Dispatches a message to the corresponding
+            connection based on sender and connection ID.
+        send_beacon(mac, frame): Queues a beacon frame with the lowest transmit
+            priority.
+        in_session(): True while any connection is active.
+        join_group(group), leave_group(group): Start and stop receiving a broadcast
+            group.
+        send_frame(mac, frame): Queues a frame to send once, without waiting for an ack.
+        link_stats(): Per peer transport counters (LinkStats), stats.line() for a one
+            line dump.
     """
 
     __task = None
     __instance = None
-    _sender_t = None
-    connections = {}
-    delivered = deque([], 5)
-    last_seen = BadgeAdrDict(max_size=20)
+    connections = {}  # (mac, con_id) -> Connection
+    _peers = {}  # mac -> number of sessions with it
+    idle_s = 300
+    age_s = 5
+    groups = {}
+    tx_seq = {}  # mac -> last sequence number sent
+    seen = DupFilter()  # message ids received per peer, drops retries
+    legacy = {}  # mac -> ids lately received from a peer on older firmware
+    last_seen = BadgeAdrDict(max_size=500)
+    bus = PeerBus(last_seen)
 
-    update_event = asyncio.Event()
     conn_request = asyncio.Event()
-    out_q = Queue(maxsize=5)
+    # reusable instances for received control frames, OpenConn is not pooled
+    # as it is handed to Connection.in_q
+    pool = MsgPool(size=2)
 
-    __espnow: aioespnow.AIOESPNow = None
+    __espnow: "aioespnow.AIOESPNow" = None
     con_cb = def_con_cb
 
     def __init__(self, e, con_cb=None):
         if not NowListener.__espnow:
             NowListener.__espnow = e
+        self.peers = PeerTable(NowListener.__espnow)
+        self.stats = LinkStats(self.peers)
+        self.tx = FrameAggregator(
+            NowListener.__espnow,
+            peers=self.peers,
+            stats=self.stats,
+            legacy=NowListener.legacy,
+        )
+        self.retx = RetxScheduler(self.tx, stats=self.stats)
+        self.rx = RxBuffer()
+        NowListener.bus.on_leave = self.forget_peer
         if con_cb:
             NowListener.con_cb = con_cb
 
-    def ack_msg(self, mac, msg_id):
-        self.out_q.put_nowait(OutQueAck(mac, msg_id))
-        # start sender task to eat the out_q
-        if self._sender_t is None or self._sender_t.done():
-            self._sender_t = asyncio.create_task(self._sender())
+    def ack_msg(self, mac, msg_id, sack=0, run=1):
+        # mark sent messages to mac, the run up to msg_id and the ones in
+        # sack, acked. Older firmware acks only the one
+        if mac in self.legacy:
+            self.retx.ack_one(mac, msg_id)
+        else:
+            self.retx.ack(mac, msg_id, sack, run)
+
+    def forget_peer(self, mac):
+        # mac left last_seen, drop what is kept to ack and tell retries from
+        # it. A peer still in session keeps it, its frames are still coming
+        if mac in NowListener._peers:
+            return
+        self.tx.acks.forget(mac)
+        self.seen.forget(mac)
+        self.legacy.pop(mac, None)
+
+    def legacy_rx(self, mac, msg):
+        # a map frame from older firmware. The peer gets map frames from now
+        # on. Its ids wrap at LEGACY_IDS and skip the ids of messages to other
+        # badges, the last few received tell retries. False for a retry
+        ids = self.legacy.get(mac)
+        if ids is None:
+            ids = self.legacy[mac] = []
+            self.tx.acks.forget(mac)
+            self.seen.forget(mac)
+            NowListener.tx_seq.pop(mac, None)
+        if isinstance(msg, (BeaconMsg, AckMsg)):
+            return True
+        if msg.id in ids:
+            self.stats.dup(mac)
+            self.tx.ack(mac, msg.id)
+            return False
+        ids.append(msg.id)
+        if len(ids) > 16:
+            ids.pop(0)
+        return True
 
     async def task(self):
         """
         Main task to listen and process incoming ESP-NOW messages.
-        Handles different types of messages (BeaconMsg, OpenConn, ConTerm, AppMsg) and updates connections.
+        Drains the ESP-NOW receive buffer into self.rx as fast as frames come
+        in, decoding and routing happens in the dispatch() worker.
         """
         print("NowListener active")
-        no_ack = 0
-        async for mac, msg in self.__espnow:
-            if mac is None:
-                continue
-
-            rssi = self.__espnow.peers_table[mac][0]
-            if rssi < -70:
-                continue
+        worker = asyncio.create_task(self.dispatch())
+        sweeper = asyncio.create_task(self.sweep())
+        try:
+            async for mac, msg in self.__espnow:
+                if mac is None:
+                    continue
 
-            incm_msg = BadgeMsg.desrlz(msg)
-            print(f">>>{mac}:{incm_msg if incm_msg else msg}")
-
-            if isinstance(incm_msg, BeaconMsg):
-                NowListener.last_seen[mac] = BadgeAdr(mac, incm_msg.nick, rssi, time())
-                self.update_event.set()  # trigger updates function
-            elif isinstance(incm_msg, AckMsg):
-                NowListener.last_seen.update_last_seen(mac, time())
-                # mark for retry buffer that msg is acked
-                self.ack_msg(mac, incm_msg.id)
-
-            elif isinstance(incm_msg, OpenConn):
-                NowListener.last_seen.update_last_seen(mac, time())
-                if await self.dispatch_msg(incm_msg, incm_msg.con_id, mac):
-                    # we found an active connection for the message, this was a reply
-                    self.ack_msg(mac, incm_msg.id)
-                    # ack our own OpenConn msg
+                rssi = self.__espnow.peers_table[mac][0]
+                if rssi < -70:
                     continue
 
-                # Add new incoming connection, ack the incoming OpenConn
-                await send_message(
-                    self.__espnow, mac, AckMsg(id=incm_msg.id).srlz(), sync=False
-                )
+                # msg is a buffer ESP-NOW reuses for the next frame, rx
+                # copies it into one of its own
+                self.stats.rx(mac, len(msg), rssi)
+                self.rx.put(mac, msg, rssi)
+        finally:
+            worker.cancel()
+            sweeper.cancel()
+
+    async def sweep(self):
+        # ages last_seen every age_s, idle sessions are checked less often
+        waited = 0
+        while True:
+            await asyncio.sleep(NowListener.age_s)
+            NowListener.last_seen.sweep(time())
+            waited += NowListener.age_s
+            if waited >= NowListener.idle_s / 4:
+                waited = 0
+                await NowListener.expire_idle()
+
+    async def dispatch(self):
+        """
+        Worker that handles the frames buffered by task(), one at a time.
+        An error in one frame is logged and does not stop the worker. The
+        frames are views of rx slots, only valid until the next one.
+        """
+        rx = self.rx
+        while True:
+            if not len(rx):
+                await rx.wait()
+            mac, msg, rssi = rx.get_nowait()
+            try:
+                if msg[0] == BUNDLE:
+                    for rec in unbundle(msg):
+                        await self.handle_msg(mac, rec, rssi)
+                else:
+                    await self.handle_msg(mac, msg, rssi)
+            except Exception as e:
+                print(f"dispatch error {mac}: {e}")
 
-                # proto connection, not yet capable of receiving other messages
-                conn = Connection(mac, incm_msg.con_id, self.__espnow)
-                conn.active = True
+    async def handle_msg(self, mac, msg, rssi):
+        """
+        Process a single message frame, either a whole ESP-NOW frame or one
+        record of a bundle.
+        """
+        if self.legacy and mac in self.legacy and not is_legacy(msg):
+            del self.legacy[mac]  # updated, back to the new format
+
+        if self.triage(mac, msg, rssi):
+            # handled from the header alone, no need to decode body
+            return
+
+        incm_msg = BadgeMsg.desrlz(msg, self.pool)
+        print(f">>>{mac}:{incm_msg if incm_msg else msg}")
+        if is_legacy(msg) and incm_msg is not None:
+            if not self.legacy_rx(mac, incm_msg):
+                return  # retry of a message already handled
+
+        if isinstance(incm_msg, BeaconMsg):
+            # publishes APPEAR through the bus
+            NowListener.last_seen.add(mac, incm_msg.nick, rssi, time())
+            self.pool.put(incm_msg)
+        elif isinstance(incm_msg, AckMsg):
+            NowListener.last_seen.update_last_seen(mac, time())
+            # mark for retry buffer that msg is acked
+            self.ack_msg(mac, incm_msg.id, incm_msg.sack, incm_msg.run)
+            self.pool.put(incm_msg)
+
+        elif isinstance(incm_msg, OpenConn):
+            NowListener.last_seen.update_last_seen(mac, time())
+            if await self.dispatch_msg(incm_msg, incm_msg.con_id, mac):
+                # we found an active connection for the message, this was a reply
+                return
 
-                try:
-                    # ask user process can we accept connection
-                    (await NowListener.con_cb(conn)) or 1 / 0
-                except (asyncio.TimeoutError, ZeroDivisionError):
-                    # connection was not opened in time, or it returned false
-                    NowListener.unregister_con(conn)
-                    await asyncio.sleep(0.1)  # Allow now esp stack to run
-                    await conn.terminate()
-                    continue
+            # Add new incoming connection, ack the incoming OpenConn
+            self.tx.ack(mac, incm_msg.id)
+            # asking the user can take a while, keep receiving meanwhile
+            asyncio.create_task(self.accept_con(mac, incm_msg.con_id))
+
+        elif isinstance(incm_msg, ConTerm):
+            self.tx.ack(mac, incm_msg.id)
+            NowListener.last_seen.update_last_seen(mac, time())
+
+            conn = self.session(mac, incm_msg.con_id)
+            if conn:
+                print(f"con term for {incm_msg=}")
+                # the peer has closed already, no ConTerm back
+                await conn.terminate(send_out=False)
+                NowListener.unregister_con(conn)
+            self.pool.put(incm_msg)
+
+        elif isinstance(incm_msg, ConCredit):
+            NowListener.last_seen.update_last_seen(mac, time())
+            await self.dispatch_msg(incm_msg, incm_msg.con_id, mac)
+            self.pool.put(incm_msg)
+
+        elif isinstance(incm_msg, GroupMsg):
+            # before AppMsg, a GroupMsg is one. Broadcasts are not acked
+            NowListener.last_seen.update_last_seen(mac, time())
+            group = self.groups.get(incm_msg.group)
+            if group:
+                group.recv(mac, incm_msg)
+            self.pool.put(incm_msg)
+
+        elif isinstance(incm_msg, GroupNack):
+            group = self.groups.get(incm_msg.group)
+            if group:
+                group.nacked(mac, incm_msg)
+            self.pool.put(incm_msg)
+
+        elif isinstance(incm_msg, AppMsg):
+            NowListener.last_seen.update_last_seen(mac, time())
+            self.tx.ack(mac, incm_msg.id)
+
+            if not await self.dispatch_app_msg(incm_msg, mac):
+                print(f"No receiver for RCV:{mac}->{incm_msg=}")
+            self.pool.put(incm_msg)  # content stays with the app
 
-                # connection accepted, register to allow subsequent messages
-                NowListener.register_con(conn)
-                await asyncio.sleep(0.1)  # Allow now esp stack to run
-                # Opening connection by replying OpenConn back with same msg id
-                oc = OpenConn(incm_msg.con_id, accept=True)
-                oc.__id = incm_msg.id
-                NowListener.send_msg(oc, mac)
-                # await send_message(self.__espnow, mac, msg, sync=False)
-
-            elif isinstance(incm_msg, ConTerm):
-                self.ack_msg(mac, incm_msg.id)
-                NowListener.last_seen.update_last_seen(mac, time())
-
-                if incm_msg.con_id in self.connections:
-                    print(f"con term for {incm_msg=}")
-                    conn = self.connections[incm_msg.con_id]
-                    await conn.terminate(send_out=True, reply_to_id=incm_msg.id)
-                    NowListener.unregister_con(conn)
-                else:
-                    await send_message(
-                        self.__espnow, mac, AckMsg(id=incm_msg.id).srlz(), sync=False
-                    )
+        else:
+            tmp = ":".join(f"{byte:02x}" for byte in mac)
+            print(f"{tmp} [{rssi}dBm] {msg} :")
 
-            elif isinstance(incm_msg, AppMsg):
-                NowListener.last_seen.update_last_seen(mac, time())
-                await send_message(
-                    self.__espnow, mac, AckMsg(id=incm_msg.id).srlz(), sync=False
-                )
+    async def accept_con(self, mac, con_id):
+        # proto connection, not yet capable of receiving other messages
+        conn = Connection(mac, con_id, self.__espnow)
+        conn.active = True
 
-                if not await self.dispatch_app_msg(incm_msg, mac):
-                    print(f"No receiver for RCV:{mac}->{incm_msg=}")
+        try:
+            # ask user process can we accept connection
+            (await NowListener.con_cb(conn)) or 1 / 0
+        except (asyncio.TimeoutError, ZeroDivisionError):
+            # connection was not opened in time, or it returned false
+            NowListener.unregister_con(conn)
+            await asyncio.sleep(0.1)  # Allow now esp stack to run
+            await conn.terminate()
+            return
+
+        # connection accepted, register to allow subsequent messages
+        NowListener.register_con(conn)
+        await asyncio.sleep(0.1)  # Allow now esp stack to run
+        # Opening connection by replying OpenConn back
+        oc = OpenConn(con_id, accept=True)
+        NowListener.send_msg(oc, mac)
+
+    def triage(self, mac, frame, rssi):
+        """
+        Handle a frame from its header (type id, message id) when the body is
+        not needed. Beacons of known peers that kept their nick only refresh
+        the peer table, and data frames that are duplicates or have no
+        connection for the sender are acked and dropped. Marks the message
+        id of other frames seen.
+        Group broadcasts for groups not joined, from non members or already
+        received are dropped.
 
-            else:
-                tmp = ":".join(f"{byte:02x}" for byte in mac)
-                print(f"{tmp} [{rssi}dBm] {msg} :")
-            await asyncio.sleep(
-                0.1
-            )  # Do not touch, MSG stack crashes when running without
+        Returns:
+            bool: True if the frame was handled, False if it needs a full decode.
+        """
+        if frame[0] == BeaconMsg.TYPE_ID:
+            # the most common frame, handled without unpacking the header.
+            # Listeners only hear of a known peer when it changes RSSI band
+            # or comes back after going stale, last_seen publishes that.
+            # A new peer or nick needs a full decode, the nick is in the body
+            seen = NowListener.last_seen
+            if not seen.nick_is(mac, frame, BEACON_NICK, peek_nick_len(frame)):
+                return False
+            return seen.refresh(mac, time(), rssi) >= 0
+
+        tid, mid = peek(frame)
+        if tid == GroupMsg.TYPE_ID:
+            group = self.groups.get(peek_group(frame))
+            return group is None or not group.accepts(mac, mid)
+
+        if tid in (
+            AppMsg.TYPE_ID,
+            ConTerm.TYPE_ID,
+            ConCredit.TYPE_ID,
+            OpenConn.TYPE_ID,
+        ):
+            if tid == OpenConn.TYPE_ID or self.has_con_to(mac):
+                if self.seen.check(mac, mid):
+                    return False
+                self.stats.dup(mac)
+            # nobody to deliver to, or a retry of a delivered frame
+            NowListener.last_seen.update_last_seen(mac, time())
+            self.tx.ack(mac, mid)
+            return True
+
+        return False
 
     @classmethod
-    def updates(cls, filter_mac=None):
-        return cls.__instance.get_updates(filter_mac=filter_mac)
+    def has_con_to(cls, mac):
+        return mac in cls._peers
 
-    def get_updates(self, filter_mac=None):
+    @classmethod
+    def session(cls, mac, con_id):
+        return cls.connections.get((mac, con_id))
+
+    @classmethod
+    async def expire_idle(cls):
         """
-        `get_updates` returns a generator that yields the latest BadgeAddr.
+        Terminates active sessions that received nothing for idle_s, the app
+        gets ConTerm in in_q and the peer is told with one ConTerm, not resent
+        as the peer has likely gone.
 
         Returns:
-            generator: A generator that yields the last seen updates.
+            int: Number of sessions terminated.
+        """
+        now = time()
+        idle = [
+            con
+            for con in cls.connections.values()
+            if con.active and now - con.last_msg > cls.idle_s
+        ]
+        for con in idle:
+            print(f"session {con.con_id} to {con.c_mac} idle, closing")
+            await con.terminate(retry=0)
+            cls.unregister_con(con)
+        return len(idle)
+
+    @classmethod
+    def updates(cls, filter_mac=None, events=ALL):
+        """
+        Subscribes to changes of last_seen: peers appearing, changing RSSI
+        band or nick, going stale or leaving. Every caller gets its own queue,
+        close() it when done, cancelling the task iterating it does that too.
+
+        Args:
             filter_mac: bytes(6) mac return only updates to this mac
+            events: badge.msg event bits to return (APPEAR, BAND, NICK, STALE, LEAVE)
+
+        Returns:
+            Subscription: Async iterator of BadgeAdr, event bits in .event
         """
+        return cls.bus.subscribe(filter_mac, events)
 
-        class Aiter:
-            def __init__(self, scanner):
-                self.scanner = scanner
+    @classmethod
+    def next_seq(cls, mac):
+        # per peer sequence number for sent messages, acks are cumulative on it
+        seq = cls.tx_seq.get(mac)
+        mask = LEGACY_IDS - 1 if mac in cls.legacy else SEQ_MASK
+        seq = randint(0, mask) if seq is None else (seq + 1) % (mask + 1)
+        cls.tx_seq[mac] = seq
+        return seq
 
-            def __aiter__(self):
-                return self
+    @classmethod
+    def send_msg(cls, msg: BadgeMsg, mac, sync=False, retry=None):
+        # send and resend until acked, or retry times, default by message type
+        msg._id = cls.next_seq(mac)
+        if retry is None:
+            retry = msg.retry_budget()
+        if mac in cls.legacy:
+            frame = msg.srlz_dict()
+            if frame is None:
+                return  # older firmware doesn't know it, ConCredit
+        else:
+            frame = msg.srlz()
+        cls.__instance.retx.send(mac, msg.id, frame, retry)
 
-            async def __anext__(self):
-                while True:
-                    await self.scanner.update_event.wait()
-                    self.scanner.update_event.clear()
-                    latest = self.scanner.last_seen.latest()
-                    if filter_mac is None or filter_mac == latest.mac:
-                        return latest
+    @classmethod
+    def send_frame(cls, mac, frame):
+        # send once, no ack expected
+        cls.__instance.tx.add(mac, frame)
 
-        return Aiter(self)
+    @classmethod
+    def join_group(cls, group):
+        old = cls.groups.get(group.group_id)
+        cls.groups[group.group_id] = group
+        if old is None:
+            cls.__instance.peers.pin(BROADCAST)
 
-    async def _sender(self):
-        # temporary task to send messages for retry times or until ack arrives
-        timeout_ms = 500
-        waiting_ack = {}
-        start = ticks_ms()
-        while self.out_q.qsize() > 0 or waiting_ack:
-            try:
-                out_q_t: OutQueMsg | OutQueAck = await asyncio.wait_for(
-                    self.out_q.get(), timeout_ms / 1000
-                )
-                if type(out_q_t) == OutQueMsg:
-                    waiting_ack[wait_index(out_q_t)] = out_q_t
-                    await send_message(
-                        self.__espnow, out_q_t.mac, out_q_t.msg, sync=False
-                    )
-                elif type(out_q_t) == OutQueAck:
-                    w_index = wait_index(out_q_t)
-                    if w_index in waiting_ack:
-                        print(f"ack mach {out_q_t=}")
-                        del waiting_ack[w_index]
-
-                if ticks_diff(ticks_ms(), start) > timeout_ms:
-                    raise asyncio.TimeoutError
-
-            except asyncio.TimeoutError:
-                ack_items = waiting_ack.items()
-                for k, out_que_msg in ack_items:
-                    if out_que_msg.retry <= 0:
-                        print(f"retry timeout {k=} {out_que_msg=}")
-                        del waiting_ack[k]
-                        continue
-
-                    print(f"<<{'r'*out_que_msg.retry}{out_que_msg.msg} {out_que_msg=}")
-                    await send_message(
-                        self.__espnow, out_que_msg.mac, out_que_msg.msg, sync=False
-                    )
-                    waiting_ack[k] = OutQueMsg(
-                        out_que_msg.msg,
-                        out_que_msg.mac,
-                        out_que_msg.id,
-                        out_que_msg.retry - 1,
-                    )
+    @classmethod
+    def leave_group(cls, group):
+        if cls.groups.get(group.group_id) is group:
+            del cls.groups[group.group_id]
+            cls.__instance.peers.unpin(BROADCAST)
 
-                start = ticks_ms()
+    @classmethod
+    def retx_sched(cls):
+        return cls.__instance.retx
 
-        print("sender done")
+    @classmethod
+    def send_beacon(cls, mac, frame):
+        # queue a beacon behind all other traffic, False if not running
+        if cls.__instance is None:
+            return False
+        cls.__instance.tx.beacon(mac, frame)
+        return True
+
+    @classmethod
+    def in_session(cls):
+        for con in cls.connections.values():
+            if con.active:
+                return True
+        return False
 
     @classmethod
-    def send_msg(cls, msg: BadgeMsg, mac, sync=False, retry=3):
-        out_q = cls.__instance.out_q
-        out_q.put_nowait(OutQueMsg(msg.srlz(), mac, msg.id, retry))
+    def rx_stats(cls):
+        return cls.__instance.rx.stats()
 
-        # start sender task
-        if cls.__instance._sender_t is None or cls.__instance._sender_t.done():
-            cls.__instance._sender_t = asyncio.create_task(cls.__instance._sender())
+    @classmethod
+    def link_stats(cls):
+        # LinkStats of the running listener, None if not started
+        return cls.__instance.stats if cls.__instance else None
 
     @classmethod
     def register_con(cls, connection: "Connection"):
         """
-        Registers a new connection and adds the respective peer in ESP-NOW.
+        Registers a new connection and pins the respective peer in ESP-NOW.
 
         Args:
             connection (Connection): The connection instance to register.
         """
         print(f"register: {connection.con_id}")
-        cls.connections[connection.con_id] = connection
-        try:
-            cls.__espnow.add_peer(connection.c_mac)
-        except Exception:
-            pass
+        key = (connection.c_mac, connection.con_id)
+        if key not in cls.connections:
+            cls._peers[key[0]] = cls._peers.get(key[0], 0) + 1
+            if cls.__instance:
+                cls.__instance.peers.pin(key[0])
+        cls.connections[key] = connection
 
     @classmethod
     def unregister_con(cls, connection: "Connection"):
@@ -482,9 +894,17 @@ class NowListener(object):
         Args:
             connection (Connection): The connection instance to unregister.
         """
-        if connection.con_id in cls.connections:
+        mac = connection.c_mac
+        key = (mac, connection.con_id)
+        if cls.connections.get(key) is connection:
             print(f"unregister: {connection.con_id}")
-            del cls.connections[connection.con_id]
+            del cls.connections[key]
+            if cls.__instance:
+                cls.__instance.peers.unpin(mac)
+            if cls._peers[mac] > 1:
+                cls._peers[mac] -= 1
+            else:
+                del cls._peers[mac]
 
     @classmethod
     def start(cls, espnow):
@@ -510,6 +930,7 @@ class NowListener(object):
         if cls.__task:
             cls.__task.cancel()
             cls.__task = None
+            cls.__instance.retx.stop()
 
     async def dispatch_app_msg(self, app_msg: AppMsg, s_mac):
         """
@@ -517,56 +938,40 @@ class NowListener(object):
 
         Args:
             app_msg (AppMsg): The application message.
+            s_mac (bytes): The sender.
 
         Returns:
             bool: True if the message was dispatched, False otherwise.
         """
-        if app_msg.con_id in self.connections:
-            if self.connections[app_msg.con_id].c_mac != s_mac:
-                print(f"con_id mismatch {app_msg.con_id=} {s_mac=}")
-                # TODO: send ConTerm for mismached
-                return False
-            # Pass only the inner content to app
-            # filter out retries, don't deliver message with same id
-            w_index = wait_index_mac(s_mac, msg_id=app_msg.id)
-            if w_index not in NowListener.delivered:
-                await self.connections[app_msg.con_id].recv_msg(app_msg.content)
-                NowListener.delivered.append(w_index)
-                return True
-            else:
-                print(f"Filtered out {w_index=} {app_msg=}")
-
-        return False
+        conn = self.connections.get((s_mac, app_msg.con_id))
+        if conn is None:
+            return False
+        conn.last_msg = time()
+        # Pass only the inner content to app, in order. Retries were
+        # already filtered out by triage()
+        await conn.recv_app_msg(app_msg)
+        return True
 
     async def dispatch_msg(self, msg: BadgeMsg, con_id, s_mac):
         """
-        Dispatches a message to the corresponding connection based on connection ID.
+        Dispatches a message to the corresponding connection based on sender and
+        connection ID.
 
         Args:
             msg (BadgeMsg): The message to dispatch.
             con_id: The connection ID.
+            s_mac (bytes): The sender.
 
         Returns:
             bool: True if the message was dispatched, False otherwise.
         """
-        if con_id in self.connections:
-            if self.connections[con_id].c_mac != s_mac:
-                print(f"con_id mismatch {con_id=} {s_mac=}")
-                # TODO: send ConTerm for mismached
-                return False
-
-            # filter out retries, don't deliver message with same id
-            w_index = wait_index_mac(s_mac, msg_id=msg.id)
-            if w_index not in NowListener.delivered:
-                await self.connections[con_id].recv_msg(msg)
-                NowListener.delivered.append(w_index)
-
-            # despite was msg retry or not send ack
-            await send_message(
-                self.__espnow, s_mac, AckMsg(id=msg.id).srlz(), sync=False
-            )
-            return True
-        return False  # Connection was not found
+        conn = self.connections.get((s_mac, con_id))
+        if conn is None:
+            return False  # Connection was not found
+        conn.last_msg = time()
+        await conn.recv_msg(msg)
+        self.tx.ack(s_mac, msg.id)
+        return True
 
     @classmethod
     async def conn_req(cls, mac, app_id):
@@ -587,11 +992,14 @@ class Beacon(AProc):
     # Beacon.start(task=True) will return a asyncio.task ans start running Beacon
     # Beacon.stop() will cancel the running task
     # Beacon.suspend(True|False) will suspend/resume the Beacon task # why not to use stop start?
-    __espnow: aioespnow.AIOESPNow = None
+    # While a connection is active beacons are held back, at most defer_max
+    # seconds, they go out with the lowest priority through NowListener.
+    __espnow: "aioespnow.AIOESPNow" = None
     __id: BeaconMsg = None
     peer = None
     _susp = asyncio.Event()
     timeout = 5
+    defer_max = 30
     _task = None
 
     @classmethod
@@ -601,9 +1009,17 @@ class Beacon(AProc):
     @classmethod
     async def task(cls, *args, **kwargs):
         try:
+            last = 0
             while not cls.stop_event.is_set():
-                msg = BeaconMsg(nick=cls.__id.nick).srlz()
-                await send_message(cls.__espnow, cls.peer, msg)
+                if not NowListener.in_session() or time() - last >= cls.defer_max:
+                    beacon = BeaconMsg(nick=cls.__id.nick)
+                    msg = beacon.srlz()
+                    if not NowListener.send_beacon(cls.peer, msg):
+                        await send_message(cls.__espnow, cls.peer, msg)
+                    elif NowListener.legacy:
+                        # older firmware around, it only reads the map format
+                        NowListener.send_frame(cls.peer, beacon.srlz_dict())
+                    last = time()
                 await asyncio.sleep(cls.timeout)
                 if not cls._susp.is_set():
                     print("Beacon suspended...")
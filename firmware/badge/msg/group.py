@@ -0,0 +1,117 @@
+from random import randint
+
+from badge.msg import BadgeMsg, GroupMsg, GroupNack, BROADCAST
+from badge.msg.tx import RESYNC, DupFilter, SEQ_MASK, seq_diff
+
+from primitives import Queue
+
+
+class Group:
+    """
+    One to many channel: a message sent to the group is one broadcast frame
+    that every badge that joined the same group id receives. Badges that
+    didn't join drop it at triage from the header.
+
+    Delivery is best effort. With reliable=True a receiver that sees a gap
+    in a sender's sequence numbers sends that sender a GroupNack and gets
+    the missing frames resent to it alone, the sender keeps its last
+    `history` frames for that. A lost last frame is not noticed until the
+    sender sends again.
+
+    A sender starts its sequence numbers at a random point, so a badge that
+    rebooted or made a new Group is not taken for repeats of what it sent
+    before. Joining starts receiving afresh.
+
+    Attributes:
+        group_id (int): 1..127, same on every member.
+        members (set): MACs frames are accepted from, empty accepts anyone.
+        reliable (bool): Ask for lost frames with GroupNack.
+        in_q (Queue): Received message contents.
+        sent (int): Frames broadcast.
+        resent (int): Frames resent on a NACK.
+        nacks (int): NACKs sent.
+
+    Methods:
+        join(): Start receiving, registers with NowListener.
+        leave(): Stop receiving.
+        send(msg): Broadcast msg to the group.
+        async get(): Next received message content.
+    """
+
+    def __init__(self, group_id, members=(), reliable=False, history=16, in_q=8):
+        if not 0 < group_id < 0x80:
+            raise ValueError(f"group id {group_id} not in 1..127")
+        self.group_id = group_id
+        self.members = set(members)
+        self.reliable = reliable
+        self.history = history
+        self.in_q = Queue(maxsize=in_q)
+        self.sent = 0
+        self.resent = 0
+        self.nacks = 0
+        self._seq = randint(0, SEQ_MASK)
+        self._sent = {}  # seq -> frame, last history frames sent
+        self._seen = DupFilter()
+        self._next = {}  # sender mac -> next seq expected
+
+    def join(self):
+        from badge.msg.connection import NowListener
+
+        self._seen = DupFilter()
+        self._next = {}
+        NowListener.join_group(self)
+
+    def leave(self):
+        from badge.msg.connection import NowListener
+
+        NowListener.leave_group(self)
+
+    def send(self, msg: BadgeMsg):
+        from badge.msg.connection import NowListener
+
+        gmsg = GroupMsg(msg, self.group_id)
+        gmsg._id = self._seq
+        frame = gmsg.srlz()
+        if self.reliable:
+            self._sent[self._seq] = frame
+            self._sent.pop((self._seq - self.history) & SEQ_MASK, None)
+        self._seq = (self._seq + 1) & SEQ_MASK
+        self.sent += 1
+        NowListener.send_frame(BROADCAST, frame)
+
+    def accepts(self, mac, seq):
+        # from triage: frame from a member and not a duplicate
+        if self.members and mac not in self.members:
+            return False
+        return self._seen.check(mac, seq)
+
+    def recv(self, mac, gmsg: GroupMsg):
+        from badge.msg.connection import NowListener
+
+        seq = gmsg.id
+        nxt = self._next.get(mac)
+        d = 0 if nxt is None else seq_diff(seq, nxt)
+        if d > RESYNC or d <= -RESYNC:
+            d = 0  # the sender restarted, nothing to ask for
+        if d > 0 and self.reliable:
+            self.nacks += 1
+            nack = GroupNack(self.group_id, nxt, min(d, self.history))
+            NowListener.send_frame(mac, nack.srlz())
+        if d >= 0:
+            self._next[mac] = (seq + 1) & SEQ_MASK
+        if self.in_q.full():
+            print(f"group {self.group_id} in_q full, dropped {gmsg.content}")
+            return
+        self.in_q.put_nowait(gmsg.content)
+
+    def nacked(self, mac, nack: GroupNack):
+        from badge.msg.connection import NowListener
+
+        for i in range(nack.count):
+            frame = self._sent.get((nack.first + i) & SEQ_MASK)
+            if frame is not None:
+                self.resent += 1
+                NowListener.send_frame(mac, frame)
+
+    async def get(self):
+        return await self.in_q.get()
@@ -0,0 +1,99 @@
+from badge.msg import BROADCAST
+
+
+class PeerTable:
+    """
+    Keeps track of the ESP-NOW driver peer slots. The driver only sends to
+    added peers and has room for a few (20), so peers are added on first
+    use and the least recently used one that is not pinned is removed when
+    the table is full. Peers with an active session or group are pinned,
+    and so is BROADCAST that beacons go to every few seconds.
+
+    Attributes:
+        size (int): Driver peer slots this table may use.
+        adds (int): Peers added to the driver.
+        evictions (int): Peers removed to make room.
+
+    Methods:
+        use(mac): Make sure mac is a driver peer before sending to it.
+        mac in table: True if mac holds a driver slot.
+        pin(mac), unpin(mac): Keep mac from being evicted, counted.
+        stats(): Counters and slots used.
+    """
+
+    def __init__(self, espnow, size=20):
+        self.espnow = espnow
+        self.size = size
+        self.adds = 0
+        self.evictions = 0
+        self._used = {}  # mac -> use stamp, driver peers
+        self._pins = {BROADCAST: 1}  # mac -> pin count, added on first use
+        self._clock = 0
+        try:
+            for p in espnow.get_peers():
+                self._used[p[0]] = 0  # added before us, e.g. beacon peer
+        except (AttributeError, OSError):
+            pass
+
+    def use(self, mac):
+        self._clock += 1
+        if mac in self._used:
+            self._used[mac] = self._clock
+            return True
+        if len(self._used) >= self.size and not self._evict():
+            print(f"peer table full, all {self.size} pinned")
+            return False
+        while True:
+            try:
+                self.espnow.add_peer(mac)
+                break
+            except OSError as err:
+                code = err.args[1] if len(err.args) > 1 else None
+                if code == "ESP_ERR_ESPNOW_EXIST":
+                    break  # added outside the table, just track it
+                if code != "ESP_ERR_ESPNOW_FULL" or not self._evict():
+                    raise err
+                # peers added outside the table took our slots
+        self.adds += 1
+        self._used[mac] = self._clock
+        return True
+
+    def __contains__(self, mac):
+        return mac in self._used
+
+    def _evict(self):
+        lru = None
+        for mac, stamp in self._used.items():
+            if mac not in self._pins and (lru is None or stamp < self._used[lru]):
+                lru = mac
+        if lru is None:
+            return False
+        del self._used[lru]
+        self.evictions += 1
+        try:
+            self.espnow.del_peer(lru)
+        except OSError:
+            pass  # already gone
+        return True
+
+    def pin(self, mac):
+        self._pins[mac] = self._pins.get(mac, 0) + 1
+        try:
+            self.use(mac)
+        except OSError as err:
+            print(f"pin {mac}: {err}")  # use() tries again on send
+
+    def unpin(self, mac):
+        n = self._pins.get(mac, 0)
+        if n > 1:
+            self._pins[mac] = n - 1
+        elif n:
+            del self._pins[mac]
+
+    def stats(self):
+        return {
+            "peers": len(self._used),
+            "pinned": len(self._pins),
+            "adds": self.adds,
+            "evictions": self.evictions,
+        }
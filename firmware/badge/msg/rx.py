@@ -0,0 +1,235 @@
+import asyncio
+from array import array
+
+from badge.msg import ACK, BEACON, CONTROL, DATA, MAX_FRAME, frame_class
+
+
+class MacTable:
+    """
+    Interns peer addresses to small integer handles, so the receive path
+    keeps one bytes object per peer instead of one per frame. Pinned
+    handles (frames of the peer still buffered) are never reused, the
+    others are recycled second chance style once size peers are known.
+
+    Methods:
+        intern(mac): Handle for mac, known or new.
+        mac(h): The interned address of handle h.
+        pin(h), unpin(h): Keep h from being reused while it is referenced.
+    """
+
+    def __init__(self, size=64):
+        self.size = size
+        self.macs = []  # handle -> mac
+        self._h = {}  # mac -> handle
+        self._pins = []  # handle -> buffered frames referencing it
+        self._ref = bytearray(size)  # handle -> used since the hand passed
+        self._hand = 0
+
+    def intern(self, mac):
+        if not isinstance(mac, bytes):
+            mac = bytes(mac)  # a reused driver buffer, copied once per new peer
+        h = self._h.get(mac)
+        if h is None:
+            h = self._new(mac)
+        self._ref[h] = 1
+        return h
+
+    def _new(self, mac):
+        n = len(self.macs)
+        if n < self.size:
+            self.macs.append(mac)
+            self._pins.append(0)
+            self._h[mac] = n
+            return n
+        for _ in range(2 * n):
+            h = self._hand
+            self._hand = (h + 1) % n
+            if self._pins[h]:
+                continue
+            if self._ref[h]:
+                self._ref[h] = 0
+                continue
+            del self._h[self.macs[h]]
+            self.macs[h] = mac
+            self._h[mac] = h
+            return h
+        # every handle is pinned, grow
+        self.size += 1
+        self._ref.append(0)
+        self.macs.append(mac)
+        self._pins.append(0)
+        self._h[mac] = n
+        return n
+
+    def mac(self, h):
+        return self.macs[h]
+
+    def pin(self, h):
+        self._pins[h] += 1
+
+    def unpin(self, h):
+        self._pins[h] -= 1
+
+
+class RxBuffer:
+    """
+    Bounded buffer between the ESP-NOW drain loop and the dispatch worker of
+    NowListener. The drain loop only copies frames in, decoding and routing
+    happens in the worker at its own pace.
+
+    Frames are copied into a ring of preallocated slots and handed out as
+    memoryviews of them, with the sender interned in a MacTable: buffering
+    a frame allocates nothing once the peer is known. A frame from get() is
+    valid until the next get(), anything kept longer has to be decoded or
+    copied.
+
+    When full the oldest beacon is dropped first, then the oldest data
+    frame, see frame_class(). Acks and control frames are only dropped
+    past max_slots, below it the buffer goes over size and grows slots for
+    them if needed.
+
+    Attributes:
+        size (int): Max frames buffered, acks and control frames excluded.
+        max_slots (int): Hard limit on slots, frames past it are dropped.
+        frames (int): Frames put in.
+        drops (list): Frames dropped, indexed by frame class.
+        peak (int): Most frames buffered at once.
+        handles (MacTable): Interned sender addresses.
+
+    Methods:
+        put(mac, frame, rssi): Buffer a copy of frame, False if it was dropped.
+        async get(): Oldest frame as (mac, frame, rssi), waits if empty.
+        get_nowait(): Same without waiting, the buffer must not be empty.
+        async wait(): Until a frame is buffered.
+        stats(): Counters as a dict.
+    """
+
+    def __init__(self, size=32, frame_len=MAX_FRAME, max_slots=None):
+        self.size = size
+        self.max_slots = 2 * size + 1 if max_slots is None else max_slots
+        self.frames = 0
+        self.drops = [0, 0, 0, 0]
+        self.peak = 0
+        self.handles = MacTable(2 * size)
+        self._len = frame_len
+        self._buf = []
+        self._view = []
+        self._peer = []  # slot -> mac handle
+        self._rssi = []  # slot -> rssi
+        self._n = []  # slot -> frame length
+        self._cls = bytearray()  # slot -> frame class
+        self._free = array("H")  # stack of free slots
+        self._nfree = 0
+        self._order = array("H")  # ring of buffered slots, oldest at _head
+        self._head = 0
+        self._count = 0
+        self._cur = -1  # slot handed out by the last get()
+        self._ev = asyncio.Event()
+        self._grow(size + 1)  # one more for the frame being dispatched
+
+    def _grow(self, n):
+        # only on start and when control frames overflow a full buffer,
+        # the ring is rebuilt oldest first
+        cap = len(self._order)
+        old, h = self._order, self._head
+        order = array("H", (old[(h + k) % cap] for k in range(self._count)))
+        first = len(self._buf)
+        for i in range(first, first + n):
+            b = bytearray(self._len)
+            self._buf.append(b)
+            self._view.append(memoryview(b))
+            self._peer.append(0)
+            self._rssi.append(0)
+            self._n.append(0)
+            self._cls.append(0)
+            self._free.append(0)
+            self._free[self._nfree] = i
+            self._nfree += 1
+        while len(order) < len(self._buf):
+            order.append(0)
+        self._order = order
+        self._head = 0
+
+    def __len__(self):
+        return self._count
+
+    def put(self, mac, frame, rssi):
+        self.frames += 1
+        cls = frame_class(frame)
+        if self._count >= self.size and not self._make_room(cls):
+            return False
+        if not self._nfree:
+            n = min(max(1, self.size // 4), self.max_slots - len(self._buf))
+            if n <= 0:
+                self.drops[cls] += 1
+                return False
+            self._grow(n)
+        self._nfree -= 1
+        i = self._free[self._nfree]
+        n = len(frame)
+        self._view[i][:n] = frame
+        self._n[i] = n
+        self._rssi[i] = rssi
+        self._cls[i] = cls
+        h = self.handles.intern(mac)
+        self.handles.pin(h)
+        self._peer[i] = h
+        cap = len(self._order)
+        self._order[(self._head + self._count) % cap] = i
+        self._count += 1
+        if self._count > self.peak:
+            self.peak = self._count
+        self._ev.set()
+        return True
+
+    def _make_room(self, cls):
+        o, h, cap = self._order, self._head, len(self._order)
+        for k in (BEACON, DATA):
+            if k < cls:
+                break
+            for p in range(self._count):
+                i = o[(h + p) % cap]
+                if self._cls[i] == k:
+                    # close the gap, later frames move up one
+                    for q in range(p, self._count - 1):
+                        o[(h + q) % cap] = o[(h + q + 1) % cap]
+                    self._count -= 1
+                    self._release(i)
+                    self.drops[k] += 1
+                    return True
+        if cls < DATA:
+            return True  # acks and control
+        self.drops[cls] += 1
+        return False
+
+    def _release(self, i):
+        self.handles.unpin(self._peer[i])
+        self._free[self._nfree] = i
+        self._nfree += 1
+
+    async def wait(self):
+        while not self._count:
+            self._ev.clear()
+            await self._ev.wait()
+
+    async def get(self):
+        await self.wait()
+        return self.get_nowait()
+
+    def get_nowait(self):
+        if self._cur >= 0:
+            self._release(self._cur)
+        i = self._cur = self._order[self._head]
+        self._head = (self._head + 1) % len(self._order)
+        self._count -= 1
+        mac = self.handles.mac(self._peer[i])
+        return mac, self._view[i][: self._n[i]], self._rssi[i]
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "beacon_drops": self.drops[BEACON],
+            "data_drops": self.drops[DATA],
+            "control_drops": self.drops[CONTROL] + self.drops[ACK],
+            "peak": self.peak,
+        }
@@ -0,0 +1,158 @@
+# per peer counters, one list of ints per peer
+_TX = 0  # frames sent
+_TX_B = 1  # bytes sent
+_RX = 2  # frames received
+_RX_B = 3  # bytes received
+_RETRY = 4  # frames resent
+_TIMEOUT = 5  # frames given up without an ack
+_DUP = 6  # duplicate frames filtered
+_RSSI_MIN = 7
+_RSSI_SUM = 8  # avg is sum / rx
+_RSSI_MAX = 9
+_ERR = 10  # last send error, 0 if none
+_RTT = 11  # first RTT bucket
+RTT_EDGES = (10, 25, 50, 100, 250, 500)  # ms, buckets are < edge and the rest
+
+
+class LinkStats:
+    """
+    Per peer transport counters, updated from the send and receive paths
+    with a dict lookup and a list increment. Only peers that hold an
+    ESP-NOW driver slot in peers (session peers are pinned there) are
+    counted, in records allocated up front: the beacons of a hall full of
+    badges cost nothing. A peer that got a slot takes over the record of
+    one that lost its slot, or else the oldest one. The others are counted
+    together, line() shows them as untracked.
+
+    Methods:
+        tx(mac, n), rx(mac, n, rssi): Count a frame of n bytes.
+        retry(mac), timeout(mac), dup(mac): Count a resend, a give up, a duplicate.
+        rtt(mac, ms): Count an RTT sample into its bucket.
+        error(mac, code): Record the last send error.
+        get(mac): Counters of one peer as a dict, None if not seen.
+        get(): Counters of all untracked peers together.
+        line(): All peers and the untracked ones on one line, for logging over
+            serial.
+        reset(): Forget everything.
+    """
+
+    def __init__(self, peers=None, max_peers=None):
+        self.table = peers
+        if max_peers is None:
+            max_peers = 32 if peers is None else peers.size
+        self.max_peers = max_peers
+        self._peers = {}  # mac -> record
+        self._free = [self._new() for _ in range(max_peers)]
+        self._void = self._clear(self._new())  # counts of untracked peers
+
+    @staticmethod
+    def _new():
+        return [0] * (_RTT + len(RTT_EDGES) + 1)
+
+    @staticmethod
+    def _clear(st):
+        for i in range(len(st)):
+            st[i] = 0
+        st[_RSSI_MAX] = -128
+        return st
+
+    def _peer(self, mac):
+        st = self._peers.get(mac)
+        if st is None:
+            if self.table is not None and mac not in self.table:
+                return self._void
+            st = self._clear(self._free.pop() if self._free else self._reuse())
+            self._peers[mac] = st
+        return st
+
+    def _reuse(self):
+        # record of a peer that lost its driver slot, else the oldest
+        if self.table is not None:
+            for mac in self._peers:
+                if mac not in self.table:
+                    return self._peers.pop(mac)
+        return self._peers.pop(next(iter(self._peers)))
+
+    def tx(self, mac, n):
+        st = self._peer(mac)
+        st[_TX] += 1
+        st[_TX_B] += n
+
+    def rx(self, mac, n, rssi):
+        st = self._peer(mac)
+        st[_RX] += 1
+        st[_RX_B] += n
+        st[_RSSI_SUM] += rssi
+        if rssi < st[_RSSI_MIN]:
+            st[_RSSI_MIN] = rssi
+        if rssi > st[_RSSI_MAX]:
+            st[_RSSI_MAX] = rssi
+
+    def retry(self, mac):
+        self._peer(mac)[_RETRY] += 1
+
+    def timeout(self, mac):
+        self._peer(mac)[_TIMEOUT] += 1
+
+    def dup(self, mac):
+        self._peer(mac)[_DUP] += 1
+
+    def rtt(self, mac, ms):
+        st = self._peer(mac)
+        i = 0
+        for edge in RTT_EDGES:
+            if ms < edge:
+                break
+            i += 1
+        st[_RTT + i] += 1
+
+    def error(self, mac, code):
+        self._peer(mac)[_ERR] = code
+
+    def get(self, mac=None):
+        st = self._void if mac is None else self._peers.get(mac)
+        if st is None:
+            return None
+        rx = st[_RX]
+        return {
+            "tx": st[_TX],
+            "tx_bytes": st[_TX_B],
+            "rx": rx,
+            "rx_bytes": st[_RX_B],
+            "retries": st[_RETRY],
+            "timeouts": st[_TIMEOUT],
+            "dups": st[_DUP],
+            "rssi": (st[_RSSI_MIN], st[_RSSI_SUM] // rx, st[_RSSI_MAX]) if rx else None,
+            "rtt": st[_RTT:],
+            "err": st[_ERR],
+        }
+
+    def peers(self):
+        return list(self._peers)
+
+    def line(self):
+        # net <peers> | <mac> tx=<n>/<bytes> rx=<n>/<bytes> re=.. to=.. dup=..
+        # rssi=<min>/<avg>/<max> rtt=<bucket counts> [err=<code>] | ...
+        # [| untracked tx=.. the same for all peers without a driver slot]
+        out = [f"net {len(self._peers)}"]
+        rows = [(mac.hex(), st) for mac, st in self._peers.items()]
+        if self._void[_TX] or self._void[_RX]:
+            rows.append(("untracked", self._void))
+        for name, st in rows:
+            rx = st[_RX]
+            s = (
+                f"{name} tx={st[_TX]}/{st[_TX_B]} rx={rx}/{st[_RX_B]}"
+                f" re={st[_RETRY]} to={st[_TIMEOUT]} dup={st[_DUP]}"
+            )
+            if rx:
+                s += f" rssi={st[_RSSI_MIN]}/{st[_RSSI_SUM] // rx}/{st[_RSSI_MAX]}"
+            s += " rtt=" + ",".join(str(n) for n in st[_RTT:])
+            if st[_ERR]:
+                s += f" err={st[_ERR]}"
+            out.append(s)
+        return " | ".join(out)
+
+    def reset(self):
+        self._free.extend(self._peers.values())
+        self._peers = {}
+        self._clear(self._void)
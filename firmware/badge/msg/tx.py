@@ -0,0 +1,557 @@
+import asyncio
+from heapq import heappop, heappush
+from time import ticks_ms, ticks_diff
+
+from badge.msg import (
+    BEACON,
+    CONTROL,
+    MAX_FRAME,
+    AckMsg,
+    bundle,
+    frame_class,
+    is_legacy,
+    send_message,
+)
+
+SEQ_MASK = 0xFFFF
+SACK_BITS = 16
+RESYNC = 256  # ids further off than this mean the peer restarted
+RUN_MAX = 255  # longest run an ack claims, keeps it within two msgpack bytes
+
+
+def seq_diff(a, b):
+    # signed distance a - b in the 16-bit sequence space
+    d = (a - b) & SEQ_MASK
+    return d - 0x10000 if d & 0x8000 else d
+
+
+def is_acked(seq, cum, sack, run=RUN_MAX):
+    # seq is covered by a cumulative ack of the run ids up to cum plus
+    # selective bitmap sack
+    d = seq_diff(seq, cum)
+    if d <= 0:
+        return d > -run
+    return d <= SACK_BITS and (sack >> (d - 1)) & 1 == 1
+
+
+class AckTracker:
+    """
+    Per peer acknowledgement state of received message ids: cumulative ack
+    (the run ids up to cum all received) and a SACK bitmap of the ids after
+    it. The run starts at the first id received from a peer, an ack never
+    covers ids from before it.
+
+    Acks are not sent per message. A pending ack is piggybacked on the next
+    bundle going to the same peer, or sent alone after delay_ms.
+    """
+
+    def __init__(self, delay_ms=30):
+        self.delay_ms = delay_ms
+        self._peers = {}  # mac -> [cum, sack, due ticks_ms or None, run]
+
+    def received(self, mac, seq):
+        st = self._peers.get(mac)
+        if st is None:
+            self._peers[mac] = [seq, 0, ticks_ms(), 1]
+            return
+        d = seq_diff(seq, st[0])
+        if d > RESYNC or d <= -RESYNC:
+            # peer restarted or we lost track of it, start over from seq
+            st[0], st[1], st[3] = seq, 0, 1
+        elif d > SACK_BITS:
+            # past the bitmap, acking it would ack the gap too. The
+            # sender resends it once the gap is filled
+            return
+        elif d > 0:
+            st[1] |= 1 << (d - 1)
+            while st[1] & 1:
+                st[0] = (st[0] + 1) & SEQ_MASK
+                st[1] >>= 1
+                st[3] = min(st[3] + 1, RUN_MAX)
+        elif d == -st[3] and st[3] < RUN_MAX:
+            # the id just before the run, sent before the first one we got
+            st[3] += 1
+        elif d <= -st[3]:
+            # from before the run and not next to it: not received, acking
+            # cum would ack the gap. Acked once the ids after it are in
+            return
+        # else d <= 0 in the run is a retry of something acked, ack it again
+        if st[2] is None:
+            st[2] = ticks_ms()
+
+    def take(self, mac):
+        # ack frame for mac if one is pending, clears pending state
+        st = self._peers.get(mac)
+        if st is None or st[2] is None:
+            return None
+        st[2] = None
+        return AckMsg(id=st[0], sack=st[1], run=st[3]).srlz()
+
+    def due(self):
+        # peers whose ack has waited delay_ms without a frame to ride on
+        now = ticks_ms()
+        return [
+            mac
+            for mac, st in self._peers.items()
+            if st[2] is not None and ticks_diff(now, st[2]) >= self.delay_ms
+        ]
+
+    def pending(self):
+        for st in self._peers.values():
+            if st[2] is not None:
+                return True
+        return False
+
+    def forget(self, mac):
+        self._peers.pop(mac, None)
+
+
+class DupFilter:
+    """
+    Per peer duplicate filter over the 16-bit message id space. Keeps the
+    highest id seen and a ring bitmap of the `bits` ids below it, so a
+    check costs the same regardless of how many peers or retries there are.
+    Ids older than the window are reported as duplicates, the sender has
+    given up on them long ago. Ids more than RESYNC behind it are a peer
+    that restarted at a lower id, the window starts over from them.
+
+    Attributes:
+        bits (int): Window size in ids, multiple of 8.
+        dups (int): Duplicates filtered out.
+
+    Methods:
+        check(mac, seq): True if seq from mac is new, marks it seen.
+        forget(mac): Drop the state of a peer.
+    """
+
+    def __init__(self, bits=128):
+        self.bits = bits
+        self.dups = 0
+        self._peers = {}  # mac -> [highest id seen, bytearray ring bitmap]
+
+    def check(self, mac, seq):
+        st = self._peers.get(mac)
+        if st is None:
+            st = self._peers[mac] = [seq, bytearray(self.bits // 8)]
+            st[1][(seq % self.bits) >> 3] |= 1 << (seq & 7)
+            return True
+        ring, bits = st[1], self.bits
+        d = seq_diff(seq, st[0])
+        if d <= -RESYNC:
+            d = bits  # restarted, clear the whole window
+        if d > 0:
+            # window moves forward, clear the slots it slides over
+            if d >= bits:
+                for i in range(len(ring)):
+                    ring[i] = 0
+            else:
+                for s in range(st[0] + 1, st[0] + d):
+                    s &= SEQ_MASK
+                    ring[(s % bits) >> 3] &= ~(1 << (s & 7))
+            st[0] = seq
+        elif d <= -bits:
+            self.dups += 1
+            return False
+        i, b = (seq % bits) >> 3, 1 << (seq & 7)
+        if d <= 0 and ring[i] & b:
+            self.dups += 1
+            return False
+        ring[i] |= b
+        return True
+
+    def forget(self, mac):
+        self._peers.pop(mac, None)
+
+
+class FrameAggregator:
+    """
+    Transmit side frame aggregator. Message frames (app messages, retries,
+    acks) added for the same peer within flush_ms are sent as one ESP-NOW
+    frame, the receiver unpacks them in the order they were added. Pending
+    acks from AckTracker ride along on the bundle to the same peer.
+
+    Frames have a priority class, see frame_class(): CONTROL > ACK > DATA >
+    BEACON. A flush sends bundles in the order of the highest class they
+    carry, beacons last. Control frames don't wait for the flush_ms window.
+    Each class has a bound on frames waiting for a flush, frames over it
+    are dropped and left to RetxScheduler to resend. Acks are bounded by AckTracker (one
+    per peer) and only the newest beacon is kept.
+
+    Older firmware can't unpack bundles: frames in its map format always
+    go alone, and peers in legacy are acked one message at a time in it.
+
+    Attributes:
+        flush_ms (int): How long to wait for more frames to the same peer.
+        max_len (int): Max size of a bundled frame, ESP-NOW limit is 250.
+        limits (tuple): Max frames waiting per class for add(), by class value.
+        frames (int): Message frames handed to add().
+        sent (int): ESP-NOW frames actually sent.
+        drops (list): Frames dropped per class.
+        peers (PeerTable): Adds peers to the driver before sending to them, optional.
+        stats (LinkStats): Counts frames sent and send errors per peer, optional.
+        legacy (dict): Peers on older firmware, keyed by mac, optional.
+
+    Methods:
+        add(mac, frame): Queue a serialized message frame for mac.
+        ack(mac, msg_id): Mark msg_id from mac received, acked later.
+        beacon(mac, frame): Send a beacon once nothing else is waiting.
+        async flush(): Send everything pending right away.
+    """
+
+    def __init__(
+        self,
+        espnow,
+        flush_ms=10,
+        max_len=MAX_FRAME,
+        limits=(16, 16, 32, 1),
+        peers=None,
+        stats=None,
+        legacy=None,
+    ):
+        self.espnow = espnow
+        self.peers = peers
+        self.stats = stats
+        self.legacy = {} if legacy is None else legacy
+        self.flush_ms = flush_ms
+        self.max_len = max_len
+        self.limits = limits
+        self.frames = 0
+        self.sent = 0
+        self.drops = [0, 0, 0, 0]
+        self._queued = [0, 0, 0, 0]  # frames per class since last flush
+        self._pending = {}  # mac -> [frames], bundle being collected
+        self._size = {}  # mac -> bundle length so far
+        self._full = []  # [(mac, [frames])] bundles that can't grow anymore
+        self._urgent = False  # control frame waiting, skip the window
+        self._beacon = None  # (mac, frame)
+        self._task = None
+        self.acks = AckTracker()
+
+    def add(self, mac, frame):
+        self.frames += 1
+        cls = frame_class(frame)
+        if self._queued[cls] >= self.limits[cls]:
+            self.drops[cls] += 1
+            return  # resent later by RetxScheduler
+        self._queued[cls] += 1
+        if cls == CONTROL:
+            self._urgent = True
+        if is_legacy(frame):
+            self._full.append((mac, [frame]))
+            self._start()
+            return
+        frames = self._pending.get(mac)
+        if frames is not None and self._size[mac] + 1 + len(frame) > self.max_len:
+            # no room left, send what we have without waiting for the window
+            self._full.append((mac, frames))
+            frames = None
+        if frames is None:
+            frames = self._pending[mac] = []
+            self._size[mac] = 1
+        frames.append(frame)
+        self._size[mac] += 1 + len(frame)
+        self._start()
+
+    def ack(self, mac, msg_id):
+        if mac in self.legacy:
+            self.add(mac, AckMsg(id=msg_id).srlz_dict())
+            return
+        self.acks.received(mac, msg_id)
+        self._start()
+
+    def beacon(self, mac, frame):
+        if self._beacon is not None:
+            self.drops[BEACON] += 1  # replaced by the newer one
+        self._beacon = (mac, frame)
+        self._start()
+
+    def _start(self):
+        # start flush task to eat pending frames
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._flusher())
+
+    async def _flusher(self):
+        while self._pending or self._full or self._beacon or self.acks.pending():
+            if not self._full and not self._urgent:
+                await asyncio.sleep(self.flush_ms / 1000)
+            await self.flush()
+
+    async def flush(self):
+        out = self._full
+        out.extend(self._pending.items())
+        self._full, self._pending, self._size = [], {}, {}
+        self._queued = [0, 0, 0, 0]
+        self._urgent = False
+        macs = [mac for mac, _ in out]
+        for mac in self.acks.due():
+            if mac not in macs:
+                out.append((mac, []))  # standalone ack
+        for mac, frames in out:
+            ack = self.acks.take(mac)
+            if ack is not None:
+                fits = sum(len(f) + 1 for f in frames) + len(ack) + 2 <= self.max_len
+                if fits and not (frames and is_legacy(frames[0])):
+                    frames.append(ack)
+                else:
+                    out.append((mac, [ack]))
+        out = [(min(frame_class(f) for f in fs), mac, fs) for mac, fs in out if fs]
+        out.sort(key=lambda b: b[0])
+        if self._beacon is not None:
+            out.append((BEACON, self._beacon[0], [self._beacon[1]]))
+            self._beacon = None
+        for _, mac, frames in out:
+            self.sent += 1
+            msg = frames[0] if len(frames) == 1 else bundle(frames)
+            try:
+                if self.peers is not None:
+                    self.peers.use(mac)
+                await send_message(self.espnow, mac, msg, sync=False)
+                if self.stats is not None:
+                    self.stats.tx(mac, len(msg))
+            except Exception as e:
+                # lost frames are recovered by retries, keep the flusher alive
+                print(f"flush failed {mac}: {e}")
+                if self.stats is not None:
+                    args = getattr(e, "args", ())
+                    self.stats.error(mac, args[1] if len(args) > 1 else repr(e))
+
+
+class RetxScheduler:
+    """
+    Persistent retransmission scheduler. Every sent frame waits in a min-heap
+    keyed by its retransmit deadline until it is acked or runs out of
+    retries. The task sleeps exactly until the earliest deadline.
+
+    Acked frames are only flagged and dropped lazily when they reach the top
+    of the heap, so an ack costs a dict lookup per covered frame.
+
+    The retransmit timeout is adaptive per peer (RFC 6298 style): smoothed
+    RTT and RTT variance are measured from acks of frames sent only once,
+    RTO = srtt + max(4 * rttvar, srtt / 4) clamped to [min_ms, max_ms].
+    Losses here are mostly collisions and range, not congestion, so backoff
+    is linear: the n-th resend waits n * RTO. The backoff also applies to
+    new frames to the peer (Karn), otherwise an RTT that grew would never be
+    measured. A new sample clears it, and so does an ack that comes srtt
+    give or take the variance after the last copy of a resent frame: that
+    copy got through, the others were lost. Until a peer has a sample
+    timeout_ms is used.
+    A frame is resent retry times and dropped when the last copy goes
+    unacked for an RTO.
+
+    Attributes:
+        timeout_ms (int): Initial RTO, and the fixed one if adaptive is False.
+        min_ms (int): Lower clamp of the RTO.
+        max_ms (int): Upper clamp of the RTO, also for backoff.
+        retries (int): Frames resent.
+        timeouts (int): Frames dropped after running out of retries.
+        wakeups (int): Times the task woke up, for checking CPU use.
+        acked (asyncio.Event): Set when an ack or timeout frees frames.
+        stats (LinkStats): Counts retries, timeouts and RTT samples per peer, optional.
+        clock (callable): Milliseconds like ticks_ms(), for simulations. With
+            a clock no task is started, the caller runs poll() as it advances.
+
+    Methods:
+        send(mac, msg_id, frame, retry): Send frame and keep it until acked.
+        ack(mac, cum, sack): Drop frames covered by a cumulative + selective ack.
+        ack_one(mac, msg_id): Drop just msg_id, older firmware acks that way.
+        outstanding(mac=None): Number of frames waiting for an ack.
+        waiting(mac, msg_id): True while msg_id to mac is not acked or dropped.
+        rto(mac, tries=1): Retransmit timeout for a frame to mac sent tries times.
+        poll(): Resend or drop the frames due, ms until the next deadline.
+    """
+
+    def __init__(
+        self,
+        tx,
+        timeout_ms=500,
+        min_ms=80,
+        max_ms=4000,
+        adaptive=True,
+        stats=None,
+        clock=None,
+    ):
+        self.tx = tx
+        self.clock = clock
+        self.stats = stats
+        self.timeout_ms = timeout_ms
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.adaptive = adaptive
+        self.retries = 0
+        self.timeouts = 0
+        self.wakeups = 0
+        self._heap = []  # (deadline, n, entry)
+        self._n = 0  # tie breaker, entries are never compared
+        self._out = {}  # mac -> {msg_id: entry}
+        self._rtt = {}  # mac -> [srtt, rttvar in ms, backoff]
+        self._wake = asyncio.Event()
+        self.acked = asyncio.Event()
+        self._mono = 0
+        self._ticks = ticks_ms if clock is None else clock
+        self._last = self._ticks()
+        self._task = None
+
+    def now(self):
+        # monotonic ms, heap keys must not wrap like ticks_ms() does
+        t = self._ticks()
+        self._mono += ticks_diff(t, self._last)
+        self._last = t
+        return self._mono
+
+    def rto(self, mac, tries=1):
+        if not self.adaptive:
+            return self.timeout_ms
+        st = self._rtt.get(mac)
+        if st is None:
+            return min(self.max_ms, self.timeout_ms * tries)
+        var = self._var(st)
+        base = min(self.max_ms, max(self.min_ms, st[0] + var))
+        return min(self.max_ms, base * max(tries, st[2]))
+
+    def _var(self, st):
+        # the variance of samples that beat the RTO shrinks, Karn drops the
+        # rest, a quarter of srtt is the least it counts for
+        return max(4 * st[1], st[0] // 4)
+
+    def _sample(self, mac, rtt):
+        if self.stats is not None:
+            self.stats.rtt(mac, rtt)
+        st = self._rtt.get(mac)
+        if st is None:
+            self._rtt[mac] = [rtt, rtt // 2, 1]
+        else:
+            st[1] = (3 * st[1] + abs(st[0] - rtt)) // 4
+            st[0] = (7 * st[0] + rtt) // 8
+            st[2] = 1
+
+    def send(self, mac, msg_id, frame, retry=3):
+        # entry: [mac, msg_id, frame, retries left, waiting for ack,
+        #         last sent ms, times sent, backoff used]
+        entry = [mac, msg_id, frame, retry, True, self.now(), 1, 1]
+        peer = self._out.get(mac)
+        if peer is None:
+            peer = self._out[mac] = {}
+        old = peer.get(msg_id)
+        if old is not None:
+            old[4] = False
+        peer[msg_id] = entry
+        self.tx.add(mac, frame)
+        self._push(entry)
+        self.start()
+
+    def ack(self, mac, cum, sack=0, run=RUN_MAX):
+        peer = self._out.get(mac)
+        if not peer:
+            return 0
+        done = [i for i in peer if is_acked(i, cum, sack, run)]
+        return self._acked(mac, peer, done)
+
+    def ack_one(self, mac, msg_id):
+        peer = self._out.get(mac)
+        if not peer or msg_id not in peer:
+            return 0
+        return self._acked(mac, peer, [msg_id])
+
+    def _acked(self, mac, peer, done):
+        now = self.now()
+        for i in done:
+            entry = peer.pop(i)
+            entry[4] = False
+            if entry[6] == 1:
+                # Karn: only frames sent once give an unambiguous sample
+                self._sample(mac, now - entry[5])
+            else:
+                st = self._rtt.get(mac)
+                if st is not None and abs(now - entry[5] - st[0]) <= self._var(st):
+                    # acked an RTT after the last copy: that one got through,
+                    # the others were lost and the RTT did not grow. New
+                    # frames don't back off
+                    st[2] = 1
+        if not peer:
+            del self._out[mac]
+        if done:
+            self.acked.set()
+        return len(done)
+
+    def outstanding(self, mac=None):
+        if mac is not None:
+            return len(self._out.get(mac, ()))
+        return sum(len(p) for p in self._out.values())
+
+    def waiting(self, mac, msg_id):
+        peer = self._out.get(mac)
+        return peer is not None and msg_id in peer
+
+    def _push(self, entry):
+        st = self._rtt.get(entry[0])
+        entry[7] = entry[6] if st is None else max(entry[6], st[2])
+        timeout = self.rto(entry[0], entry[7])
+        self._n += 1
+        heappush(self._heap, (entry[5] + timeout, self._n, entry))
+        if self._heap[0][2] is entry:
+            self._wake.set()  # new earliest deadline
+
+    def _drop(self, entry):
+        peer = self._out.get(entry[0])
+        if peer is not None and peer.get(entry[1]) is entry:
+            del peer[entry[1]]
+            if not peer:
+                del self._out[entry[0]]
+
+    def start(self):
+        if self.clock is None and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self.run())
+        return self._task
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def poll(self):
+        heap = self._heap
+        while heap:
+            if not heap[0][2][4]:
+                heappop(heap)  # acked while waiting
+                continue
+            delay = heap[0][0] - self.now()
+            if delay > 0:
+                return delay
+            self._expire(heappop(heap)[2])
+        return None
+
+    def _expire(self, entry):
+        mac, msg_id, frame, retry = entry[0], entry[1], entry[2], entry[3]
+        if retry <= 0:
+            print(f"retry timeout {mac}:{msg_id}")
+            self.timeouts += 1
+            if self.stats is not None:
+                self.stats.timeout(mac)
+            self._drop(entry)
+            self.acked.set()
+            return
+        print(f"<<{'r' * retry}{frame}")
+        entry[3] = max(0, retry - 1)
+        entry[5] = self.now()
+        entry[6] += 1
+        st = self._rtt.get(mac)
+        if st is not None and st[2] <= entry[7]:
+            st[2] = entry[7] + 1
+        self.retries += 1
+        if self.stats is not None:
+            self.stats.retry(mac)
+        self.tx.add(mac, frame)
+        self._push(entry)
+
+    async def run(self):
+        while True:
+            delay = self.poll()
+            self._wake.clear()
+            if delay is None:
+                await self._wake.wait()
+            else:
+                try:
+                    await asyncio.wait_for(self._wake.wait(), delay / 1000)
+                except asyncio.TimeoutError:
+                    pass
+            self.wakeups += 1
@@ -1,6 +1,7 @@
 import asyncio
 
 from badge.msg import BadgeAdr, null_badge_adr
+from badge.msg.bus import LEAVE, STALE
 from badge.msg.connection import NowListener, Beacon
 from gui.core.colors import GREEN, BLACK, RED
 from gui.core.ugui import Screen, ssd
@@ -170,7 +171,17 @@ class ScannerScreen(Screen):
         if hasattr(self, "listbox"):
             self.listbox.update()
 
+    def remove_list(self, badge_addr: BadgeAdr):
+        # the badge left or went stale, it is not around to connect to
+        for ui, el in enumerate(self.elements):
+            if el[2][0].mac == badge_addr.mac:
+                del self.elements[ui]
+                if hasattr(self, "listbox"):
+                    self.listbox.update()
+                return
+
     async def update_resuls_task(self):
+        updates = None
         try:
             print("update_resuls_task: start")
             NowListener.start(None)  # ensure scanner is running
@@ -180,11 +191,18 @@ class ScannerScreen(Screen):
             self.append_list(NowListener.last_seen.values())
 
             # wait for changes
-            async for latest_key in NowListener.updates():
-                self.append_list(NowListener.last_seen[latest_key])
+            updates = NowListener.updates()
+            async for badge_addr in updates:
+                gone = updates.event & (STALE | LEAVE)
+                if gone and not NowListener.last_seen.is_fresh(badge_addr.mac):
+                    self.remove_list(badge_addr)
+                else:
+                    self.append_list(badge_addr)
                 await asyncio.sleep(0)
             print("update_resuls_task: no more updates")
         except Exception as e:
             print(f"update_resuls_task: {e}")
         finally:
+            if updates is not None:
+                updates.close()
             print("update_resuls_task: end")
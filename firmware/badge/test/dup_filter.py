@@ -0,0 +1,60 @@
+import asyncio
+import random
+
+from badge.msg import AppMsg, RPSMsg
+from badge.msg.connection import Connection, NowListener
+from host.transport import Fabric
+
+# Runs without radio: 20 peers with an open connection each send MSGS app
+# messages through NowListener.handle_msg, every frame arrives 1 to 4 times
+# and retries of different peers interleave. Each message must reach its
+# connection exactly once.
+PEERS = 20
+MSGS = 300
+MAX_COPIES = 4
+SEED = 2025
+ME = b"\xaa\x00\x00\x00\x00\xff"
+
+
+async def main():
+    random.seed(SEED)
+    e = Fabric().port(ME)  # acks go nowhere
+    listener = NowListener(e)
+    got = {}  # (mac, choice) -> deliveries
+    frames = []
+    for p in range(PEERS):
+        mac = bytes([0xAA, 0, 0, 0, 0, p])
+        con = Connection(mac, 200 + p, e)
+        con.active = True
+
+        async def recv(msg, mac=mac):
+            key = (mac, msg.choice)
+            got[key] = got.get(key, 0) + 1
+
+        con.recv_msg = recv
+        # some peers start right before the 16-bit id wraps around
+        seq = 0xFFFF - 100 if p % 4 == 0 else random.randint(0, 0xFFFF)
+        for n in range(MSGS):
+            # unordered like old firmware, only the id filter stops retries
+            amsg = AppMsg(RPSMsg(choice=n), con_id=200 + p)
+            amsg._id = (seq + n) & 0xFFFF
+            frame = amsg.srlz()
+            # all peers send at once, retries arrive up to 90 messages later
+            at = n * PEERS + p
+            for c in range(random.randint(1, MAX_COPIES)):
+                frames.append((at + c * random.randint(1, 30 * PEERS), mac, frame))
+    frames.sort(key=lambda f: f[0])
+
+    for _, mac, frame in frames:
+        await listener.handle_msg(mac, frame, -40)
+
+    dups = sum(n - 1 for n in got.values())
+    assert len(got) == PEERS * MSGS, len(got)
+    assert dups == 0, dups
+    print(
+        f"ok: {len(frames)} frames, {len(got)} delivered,"
+        f" {NowListener.seen.dups} retries filtered, {dups} duplicates"
+    )
+
+
+asyncio.run(main())
@@ -0,0 +1,63 @@
+import asyncio
+import random
+from time import ticks_ms, ticks_diff
+
+from badge.msg import RPSMsg
+from badge.msg.connection import NowListener
+from host.transport import Fabric
+from host.virtual_badge import VirtualBadge
+
+# Runs on the host: one badge running the badge.msg stack in a hall of
+# BADGES virtual badges on an in process Fabric, each beaconing every
+# BEACON_MS. Meanwhile one of them plays MOVES moves with the badge over a
+# connection. All moves must arrive in order despite the beacon load.
+BADGES = 200
+BEACON_MS = 1000
+SECONDS = 3
+MOVES = 30
+APP = 3
+HUB = b"\xaa\xff\x00\x00\x00\x00"
+SEED = 2025
+
+
+async def player(badge):
+    # opens a connection and sends moves as far as its credit goes
+    await badge.connect(HUB, APP)
+    for n in range(MOVES):
+        await badge.send_app(HUB, APP, RPSMsg(choice=n % 3), n)
+        await asyncio.sleep(0.02)
+
+
+async def main():
+    random.seed(SEED)
+    fabric = Fabric(delay_ms=2)
+    hub = fabric.port(HUB)
+    NowListener.start(hub)
+    macs = [bytes([0xAA, 0, 0, 0, p >> 8, p & 0xFF]) for p in range(BADGES)]
+    badges = []
+    for p, mac in enumerate(macs):
+        port = fabric.port(mac, rx_broadcast=False)
+        badges.append(VirtualBadge(port, f"Anon{p:04}", beacon_ms=BEACON_MS))
+        badges[-1].start()
+
+    start = ticks_ms()
+    asyncio.create_task(player(badges[0]))
+    while NowListener.session(macs[0], APP) is None:
+        await asyncio.sleep(0.01)
+    con = NowListener.session(macs[0], APP)
+    got = [(await con.get(5)).choice for _ in range(MOVES)]
+    assert got == [n % 3 for n in range(MOVES)], got
+    took = ticks_diff(ticks_ms(), start)
+    await asyncio.sleep(max(0, SECONDS - took / 1000))
+    for badge in badges:
+        badge.stop()
+    took = ticks_diff(ticks_ms(), start)
+    print(
+        f"ok: {MOVES} moves in order among {BADGES} badges,"
+        f" {fabric.frames * 1000 // took} frames/s on air,"
+        f" badge dropped {hub.rx_drops}, rx {NowListener.rx_stats()}"
+    )
+    NowListener.stop()
+
+
+asyncio.run(main())
@@ -0,0 +1,95 @@
+import asyncio
+from time import ticks_ms, ticks_diff
+
+from badge.msg import ConCredit, RPSMsg
+from badge.msg.connection import Connection, NowListener
+from host.transport import Fabric
+from host.virtual_badge import VirtualBadge
+
+# Runs without radio: one badge streams MOVES app messages as fast as it
+# can, the other one's UI takes one message every UI_MS. Both directions
+# are checked against a VirtualBadge peer on a loss free link:
+#   slow_reader: our Connection receives, in_q must never overflow and
+#                credit goes out once half of in_q has freed up
+#   fast_writer: our Connection sends, it must never go past the credit
+MOVES = 40
+UI_MS = 30
+CON_IN, CON_OUT = 5, 6
+ME = b"\xaa\x00\x00\x00\x00\x00"
+PEER = b"\xaa\x00\x00\x00\x00\x01"
+
+
+async def slow_reader(e, peer):
+    con = Connection(PEER, CON_IN, e)
+    con.active = True
+    peer.open(ME, CON_IN)
+
+    async def stream():
+        # the peer sends as far as its credit goes
+        for seq in range(MOVES):
+            await peer.send_app(ME, CON_IN, RPSMsg(choice=seq), seq)
+
+    asyncio.create_task(stream())
+    start = ticks_ms()
+    peak = 0
+    got = []
+    for _ in range(MOVES):
+        await asyncio.sleep(UI_MS / 1000)  # busy redrawing
+        peak = max(peak, con.in_q.qsize())
+        got.append((await con.get(2)).choice)
+    took = ticks_diff(ticks_ms(), start)
+    assert got == list(range(MOVES)), got
+    assert peak <= Connection.IN_Q, peak
+    half = (Connection.IN_Q + 1) // 2
+    grants = peer.heard.get(ConCredit.TYPE_ID, 0)
+    assert grants <= MOVES // half, grants
+    NowListener.unregister_con(con)
+    print(
+        f"slow reader ok: {MOVES} moves in {took}ms, in_q peak {peak},"
+        f" {grants} grants"
+    )
+
+
+async def fast_writer(e, peer):
+    con = Connection(PEER, CON_OUT, e)
+    con.active = True
+    peer.open(ME, CON_OUT)
+    peer.grant = False
+    granted = [Connection.IN_Q]
+
+    async def ui():
+        # peer's UI takes a move every UI_MS and grants one more each time
+        while granted[0] < MOVES:
+            await asyncio.sleep(UI_MS / 1000)
+            granted[0] += 1
+            await peer.send(ME, ConCredit(CON_OUT, granted[0]))
+
+    asyncio.create_task(ui())
+    start = ticks_ms()
+    over = 0
+    for n in range(MOVES):
+        await con.send(RPSMsg(choice=n % 3))
+        over = max(over, con.tx_seq - granted[0])
+    got = peer.got[(ME, CON_OUT)]
+    while len(got) < MOVES:
+        await asyncio.sleep(0.01)
+    took = ticks_diff(ticks_ms(), start)
+    assert over <= 0, over
+    assert list(got) == list(range(MOVES)), got
+    NowListener.unregister_con(con)
+    print(f"fast writer ok: {MOVES} moves in {took}ms, never past credit")
+
+
+async def main():
+    fabric = Fabric(delay_ms=2)
+    e = fabric.port(ME)
+    NowListener.start(e)
+    peer = VirtualBadge(fabric.port(PEER), "Peer", beacon_ms=0)
+    peer.start()
+    await slow_reader(e, peer)
+    await fast_writer(e, peer)
+    peer.stop()
+    NowListener.stop()
+
+
+asyncio.run(main())
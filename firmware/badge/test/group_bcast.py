@@ -0,0 +1,118 @@
+import asyncio
+
+from badge.msg import GroupMsg, GroupNack, RPSMsg, peek
+from badge.msg.connection import NowListener
+from badge.msg.group import BROADCAST, Group
+from host.transport import Fabric
+
+# Runs without radio: a game table of MEMBERS badges in group GROUP.
+#   fan_out: MOVES moves to the group take one frame each, unicast would
+#            take one per member
+#   filter:  frames of a group not joined and repeats never reach the app
+#   nack:    a lost frame is asked for and resent to the one that lost it
+MEMBERS = 5
+MOVES = 10
+GROUP = 12
+MACS = [bytes([0xAA, 0, 0, 0, 0, p]) for p in range(MEMBERS)]
+ME = b"\xaa\x00\x00\x00\x00\xff"
+
+
+def inject(air, mac, seq, msg, group=GROUP):
+    gmsg = GroupMsg(msg, group)
+    gmsg._id = seq
+    air.inject(mac, ME, gmsg.srlz())
+
+
+def sent(air, mac):
+    # records we sent to mac
+    return [rec for _, _, rec in air.sent(ME, mac)]
+
+
+async def fan_out(air):
+    g = Group(GROUP, members=MACS[1:])
+    g.join()
+    for n in range(MOVES):
+        g.send(RPSMsg(choice=n % 3))
+    await asyncio.sleep(0.1)
+    frames = sent(air, BROADCAST)
+    assert len(frames) == MOVES, len(air.log)
+    assert all(peek(f)[0] == GroupMsg.TYPE_ID for f in frames)
+    print(f"fan out ok: {MOVES} frames, unicast would be {MOVES * (MEMBERS - 1)}")
+    g.leave()
+
+
+async def filter(air):
+    g = Group(GROUP)
+    g.join()
+    inject(air, MACS[1], 0, RPSMsg(choice=1))
+    inject(air, MACS[1], 0, RPSMsg(choice=1))  # repeat
+    inject(air, MACS[2], 0, RPSMsg(choice=2), group=GROUP + 1)  # not joined
+    inject(air, MACS[2], 0, RPSMsg(choice=0))
+    await asyncio.sleep(0.1)
+    got = []
+    while not g.in_q.empty():
+        got.append((await g.get()).choice)
+    assert got == [1, 0], got
+    print(f"filter ok: {got}")
+    g.leave()
+
+
+async def nack(air):
+    g = Group(GROUP, reliable=True)
+    g.join()
+    air.log.clear()
+    # MACS[1] sends 0..3, 2 is lost on the way to us
+    for seq in (0, 1, 3):
+        inject(air, MACS[1], seq, RPSMsg(choice=seq % 3))
+    await asyncio.sleep(0.1)
+    nacks = [GroupNack.desrlz(f) for f in sent(air, MACS[1])]
+    assert [(n.first, n.count) for n in nacks] == [(2, 1)], nacks
+    inject(air, MACS[1], 2, RPSMsg(choice=2))  # the resend
+    await asyncio.sleep(0.1)
+    assert g.in_q.qsize() == 4
+
+    # we sent 0..3 from a random start, MACS[3] lost 1 and 2
+    first = g._seq
+    for n in range(4):
+        g.send(RPSMsg(choice=n % 3))
+    air.log.clear()
+    nk = GroupNack(GROUP, (first + 1) & 0xFFFF, 2)
+    nk._id = 9
+    air.inject(MACS[3], ME, nk.srlz())
+    await asyncio.sleep(0.1)
+    resent = [GroupMsg.desrlz(f).id - first for f in sent(air, MACS[3])]
+    assert [i & 0xFFFF for i in resent] == [1, 2], resent
+    print(f"nack ok: nacks sent {g.nacks}, frames resent {g.resent}")
+    g.leave()
+
+
+async def restart(air):
+    # MACS[1] rebooted and starts over behind the ids it used, then again
+    # right on them while we were away: nothing is taken for a repeat
+    g = Group(GROUP, reliable=True)
+    g.join()
+    air.log.clear()
+    for seq in (1000, 1001, 5, 6):
+        inject(air, MACS[1], seq, RPSMsg(choice=seq % 3))
+    await asyncio.sleep(0.1)
+    g.leave()
+    g.join()
+    for seq in (5, 6, 7):
+        inject(air, MACS[1], seq, RPSMsg(choice=seq % 3))
+    await asyncio.sleep(0.1)
+    assert g.in_q.qsize() == 7 and not g.nacks, (g.in_q.qsize(), g.nacks)
+    print("restart ok: a rebooted sender and a rejoin lose nothing")
+    g.leave()
+
+
+async def main():
+    air = Fabric(log=True)
+    NowListener.start(air.port(ME))
+    await fan_out(air)
+    await filter(air)
+    await nack(air)
+    await restart(air)
+    NowListener.stop()
+
+
+asyncio.run(main())
@@ -0,0 +1,116 @@
+import asyncio
+from time import ticks_ms, ticks_diff
+
+import umsgpack
+
+from badge.msg import RPSMsg, is_legacy
+from badge.msg.connection import Connection, NowListener
+from host.transport import Fabric
+
+# Runs without radio: a badge on older firmware, which only reads and sends
+# the name keyed map format and acks each message by its id modulo 255,
+# opens a session to this one. Everything it gets must decode the way the
+# old decoder does it, one message per frame. Its retries must not reach
+# the app twice, and replies must flow past the initial credit as old
+# firmware never grants more.
+ME = b"\xaa\x00\x00\x00\x00\x00"
+OLD = b"\xaa\x00\x00\x00\x00\x0b"
+APP = 3
+MOVES = 12
+# constructor arguments of the messages older firmware knows
+OLD_ARGS = {
+    "BeaconMsg": {"nick"},
+    "AckMsg": set(),
+    "OpenConn": {"con_id", "accept"},
+    "ConTerm": {"con_id"},
+    "AppMsg": {"con_id", "content"},
+}
+
+
+class OldBadge:
+    # scripted badge on older firmware on a fabric port
+    def __init__(self, port):
+        self.port = port
+        self.id = 245  # old ids wrap at 255 during the test
+        self.got = []  # decoded frames from this badge
+        self.moves = []  # app message contents
+        self.drop_ack = None  # msg id the old badge doesn't ack once
+        port.add_peer(ME)
+
+    async def receive(self):
+        async for mac, msg in self.port:
+            assert is_legacy(msg), bytes(msg)  # no bundles, no new format
+            d = umsgpack.loads(bytes(msg))
+            assert set(d) - {"msg_type", "_id"} == OLD_ARGS[d["msg_type"]], d
+            assert 0 <= d["_id"] < 255, d
+            self.got.append(d)
+            if d["msg_type"] == "AppMsg":
+                self.moves.append(d["content"]["choice"])
+            if d["msg_type"] in ("AppMsg", "OpenConn"):
+                if d["_id"] == self.drop_ack:
+                    self.drop_ack = None
+                    continue
+                # acks carry the id acked, they take no id of their own
+                ack = {"msg_type": "AckMsg", "_id": d["_id"]}
+                await self.port.asend(ME, umsgpack.dumps(ack))
+
+    async def send(self, d, again=False):
+        if not again:
+            self.id += 1
+        d["_id"] = self.id % 255
+        await self.port.asend(ME, umsgpack.dumps(d))
+
+
+async def accept(con, req=False):
+    return True
+
+
+async def main():
+    fabric = Fabric()
+    NowListener.con_cb = accept
+    NowListener.start(fabric.port(ME))
+    e = OldBadge(fabric.port(OLD))
+    rx = asyncio.create_task(e.receive())
+    await e.send({"msg_type": "BeaconMsg", "nick": "Old"})
+    await e.send({"msg_type": "OpenConn", "con_id": APP, "accept": True})
+    open_id = e.id
+    await asyncio.sleep(0.3)
+    con = NowListener.session(OLD, APP)
+    assert con and OLD in NowListener.legacy and OLD in NowListener.last_seen
+    acks = [d["_id"] for d in e.got if d["msg_type"] == "AckMsg"]
+    assert acks == [open_id], (acks, open_id)
+    assert any(d["msg_type"] == "OpenConn" for d in e.got), e.got
+    print("open ok: acked and answered in the map format")
+
+    start = ticks_ms()
+    for n in range(MOVES):
+        move = {"msg_type": "AppMsg", "con_id": APP, "content": {}}
+        move["content"] = {"msg_type": "RPSMsg", "choice": n % 3}
+        await e.send(move)
+        if n % 4 == 1:
+            await e.send(move, again=True)  # our ack got lost, the old badge resends
+        got = await con.get(2)
+        assert got.choice == n % 3, (n, got)
+        if n == 5:
+            e.drop_ack = (NowListener.tx_seq[OLD] + 1) % 255
+        con.send_app_msg(RPSMsg(choice=n % 3))
+    await asyncio.sleep(0.1)
+    assert con.in_q.empty(), "retry delivered twice"
+    while len(e.moves) < MOVES + 1:
+        await asyncio.sleep(0.05)
+        assert ticks_diff(ticks_ms(), start) < 5000, e.moves
+    await asyncio.sleep(0.1)
+    retx = NowListener.retx_sched()
+    # one move resent for the ack dropped, the others acked one by one
+    assert e.moves == [n % 3 for n in range(MOVES)] + [5 % 3], e.moves
+    assert retx.outstanding(OLD) == 0
+    assert e.id > 255  # its ids wrapped
+    print(
+        f"moves ok: {MOVES} each way past {Connection.IN_Q} credit,"
+        f" {retx.retries} resent"
+    )
+    rx.cancel()
+    NowListener.stop()
+
+
+asyncio.run(main())
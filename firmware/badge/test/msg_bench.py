@@ -0,0 +1,77 @@
+import gc
+from time import ticks_us, ticks_diff
+
+import umsgpack
+
+from badge.msg import (
+    AckMsg,
+    AppMsg,
+    BadgeMsg,
+    BeaconMsg,
+    ConTerm,
+    OpenConn,
+    PingMsg,
+    RPSMsg,
+    VictoryMsg,
+)
+
+ROUNDS = 500
+
+
+def samples():
+    s = [
+        BeaconMsg(nick="Anon1234"),
+        AckMsg(id=42),
+        OpenConn(con_id=1),
+        ConTerm(con_id=1),
+        AppMsg(PingMsg(mark=123456, reply=False), con_id=1),
+        AppMsg(RPSMsg(choice=3), con_id=3),
+        AppMsg(VictoryMsg(your=1, mine=2, tie=False, me_win=True), con_id=3),
+    ]
+    try:
+        from badge.games.tictac import TttStart, TttMove, TttEnd
+
+        s += [
+            AppMsg(TttStart(iam="x", move=4, init=123.25, round=1), con_id=1),
+            AppMsg(TttMove(move=8), con_id=1),
+            AppMsg(TttEnd(iam_winner=True, move=2), con_id=1),
+        ]
+    except ImportError as e:
+        print(f"tictac messages skipped: {e}")
+    return s
+
+
+def name(msg):
+    if isinstance(msg, AppMsg):
+        return f"AppMsg+{msg.content.msg_type}"
+    return msg.msg_type
+
+
+def per_msg_us(fn, arg):
+    gc.collect()
+    start = ticks_us()
+    for _ in range(ROUNDS):
+        fn(arg)
+    return ticks_diff(ticks_us(), start) / ROUNDS
+
+
+def dict_srlz(msg):
+    # encoder of the old name keyed map format
+    return umsgpack.dumps(msg.to_dict())
+
+
+def main():
+    # sizes in bytes, encode + decode cost in us per message
+    print(f"{'type':<20} {'dict B':>7} {'pos B':>6} {'dict us':>8} {'pos us':>7}")
+    for msg in samples():
+        legacy = dict_srlz(msg)
+        frame = msg.srlz()
+        dict_us = per_msg_us(dict_srlz, msg) + per_msg_us(BadgeMsg.desrlz, legacy)
+        pos_us = per_msg_us(type(msg).srlz, msg) + per_msg_us(BadgeMsg.desrlz, frame)
+        print(
+            f"{name(msg):<20} {len(legacy):>7} {len(frame):>6}"
+            f" {dict_us:>8.1f} {pos_us:>7.1f}"
+        )
+
+
+main()
@@ -0,0 +1,91 @@
+import asyncio
+from time import ticks_us, ticks_diff
+
+from badge.msg import APPEAR, LEAVE, STALE, BadgeAdrDict
+from badge.msg.bus import PeerBus
+
+# Runs without radio: PEERS badges heard once each, one a second, then the
+# table is swept like NowListener.sweep() does. Peers not heard for stale_s
+# leave matchmaking (fresh_len, fresh_keys) with STALE published, peers not
+# heard for expire_s are removed with LEAVE. A sweep must only cost the
+# peers it changes: timed against a scan of the whole table, for a full
+# table with nothing to do.
+PEERS = 500
+STALE_S = 30
+EXPIRE_S = 600
+SWEEPS = 200
+
+
+def scan(table, now):
+    # what a sweep without the recency order would do
+    return [m for m in table.keys() if now - table[m].last_seen >= STALE_S]
+
+
+async def main():
+    t = BadgeAdrDict(PEERS, stale_s=STALE_S, expire_s=EXPIRE_S)
+    bus = PeerBus(t)
+    sub = bus.subscribe(depth=PEERS)
+    macs = [bytes([0xBB, 0, 0, 0, p >> 8, p & 0xFF]) for p in range(PEERS)]
+    for p, mac in enumerate(macs):
+        t.add(mac, f"Anon{p:04}", -50, p)
+    assert len(sub) == PEERS
+    while len(sub):
+        await sub.get()
+        assert sub.event == APPEAR
+
+    # at PEERS + 9 the first PEERS - STALE_S + 10 are stale
+    now = PEERS + 9
+    assert t.sweep(now) == 0
+    stale = PEERS - STALE_S + 10
+    assert t.fresh_len() == PEERS - stale, t.fresh_len()
+    assert t.fresh_keys() == macs[stale:][::-1]
+    assert not t.is_fresh(macs[0]) and t.is_fresh(macs[-1]) and macs[0] in t
+    events = set()
+    while len(sub):
+        adr = await sub.get()
+        events.add(sub.event)
+    assert events == {STALE}, events
+    print(f"stale ok: {t.fresh_len()} fresh of {len(t)}")
+
+    # a stale peer heard again is back in matchmaking, as a new one
+    assert t.refresh(macs[0], now, -50) == APPEAR
+    assert t.is_fresh(macs[0]) and t.fresh_len() == PEERS - stale + 1
+    await sub.get()
+    assert sub.event == APPEAR and t.sweep(now) == 0 and not len(sub)
+
+    # nothing changes, sweep against a scan of the table
+    start = ticks_us()
+    for _ in range(SWEEPS):
+        t.sweep(now)
+    swept = ticks_diff(ticks_us(), start) / SWEEPS
+    start = ticks_us()
+    for _ in range(SWEEPS // 20):
+        scan(t, now)
+    scanned = ticks_diff(ticks_us(), start) / (SWEEPS // 20)
+    assert swept * 10 < scanned, (swept, scanned)
+    print(
+        f"sweep ok: {swept:.1f}us with nothing to do,"
+        f" scanning {PEERS} peers {scanned:.1f}us"
+    )
+
+    # the oldest 100 expire, the refreshed one stays
+    now = EXPIRE_S + 99
+    assert t.sweep(now) == 100 - 1, len(t)
+    assert macs[0] in t and macs[1] not in t and macs[100] in t
+    gone = 0
+    while len(sub):
+        adr = await sub.get()
+        if sub.event & LEAVE:
+            assert adr.mac in macs[1:100] and adr.last_seen < 100
+            gone += 1
+    assert gone == 99, gone
+    assert t.fresh_len() == 0 and t.fresh_keys() == []
+
+    # everything left expires, the stale edge goes with it
+    assert t.sweep(10 * EXPIRE_S) == len(macs) - 99 and len(t) == 0
+    t.add(macs[1], "Anon", -50, 10 * EXPIRE_S)
+    assert t.sweep(10 * EXPIRE_S) == 0 and t.fresh_keys() == [macs[1]]
+    print(f"expire ok: LEAVE published for {gone} peers")
+
+
+asyncio.run(main())
@@ -0,0 +1,102 @@
+import asyncio
+import random
+
+from badge.msg import BeaconMsg
+from badge.msg.bus import APPEAR, BAND, LEAVE, NICK
+from badge.msg.connection import NowListener
+
+# Runs without radio: beacons of PEERS badges walking around go through
+# NowListener.handle_msg while three listeners subscribe to last_seen
+# changes: a scanner screen that reads everything, a slow screen that
+# reads once in a while and a game screen following one opponent. Each
+# must get its own events, the slow one only the latest state per peer.
+PEERS = 30
+ROUNDS = 40
+SEED = 2025
+
+
+async def reader(sub, got, pause):
+    try:
+        async for adr in sub:
+            got[adr.mac] = (sub.event, adr)
+            await asyncio.sleep(pause)
+    finally:
+        sub.close()
+
+
+async def main():
+    random.seed(SEED)
+    listener = NowListener(None)
+    macs = [bytes([0xBB, 0, 0, 0, 0, p]) for p in range(PEERS)]
+    beacons = [BeaconMsg(nick=f"Anon{p:04}").srlz() for p in range(PEERS)]
+    rssi = [random.randint(-70, -40) for _ in range(PEERS)]
+
+    scanner, slow = {}, {}
+    subs = [
+        NowListener.updates(),
+        NowListener.updates(),
+        NowListener.updates(filter_mac=macs[3], events=BAND | LEAVE),
+    ]
+    subs[0].depth = PEERS
+    subs[1].depth = 16
+    game = []
+    tasks = [
+        asyncio.create_task(reader(subs[0], scanner, 0)),
+        asyncio.create_task(reader(subs[1], slow, 0.05)),
+    ]
+
+    async def follow():
+        # closed by the cancel while waiting in get()
+        async for adr in subs[2]:
+            game.append(subs[2].event)
+
+    tasks.append(asyncio.create_task(follow()))
+    for _ in range(ROUNDS):
+        for p in range(PEERS):
+            rssi[p] = max(-70, min(-30, rssi[p] + random.randint(-6, 6)))
+            await listener.handle_msg(macs[p], beacons[p], rssi[p])
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.3)
+
+    assert set(scanner) == set(macs), len(scanner)
+    assert all(scanner[m][1].band == NowListener.last_seen[m].band for m in macs)
+    assert len(slow) < PEERS and subs[1].dropped > 0 and NowListener.bus.coalesced > 0
+    assert game and all(e & (BAND | LEAVE) for e in game), game
+    print(f"subscribers ok: {NowListener.bus.stats()}")
+    print(
+        f"scanner saw {len(scanner)} peers, slow one {len(slow)},"
+        f" game {len(game)} band changes"
+    )
+
+    # the table is full, a new peer evicts the one seen longest ago
+    NowListener.last_seen.max_size = PEERS
+    mac = bytes([0xBB, 0, 0, 0, 1, 0])
+    oldest = NowListener.last_seen._oldest
+    gone = NowListener.last_seen.mac(oldest)
+    await listener.handle_msg(mac, beacons[0], -50)
+    await asyncio.sleep(0.1)
+    assert scanner[gone][0] & LEAVE and scanner[mac][0] & APPEAR
+    print("evict ok: LEAVE and APPEAR published")
+
+    # a known peer renames itself, the fast path of its beacons notices
+    await listener.handle_msg(macs[5], BeaconMsg(nick="Renamed").srlz(), -50)
+    await asyncio.sleep(0.1)
+    assert scanner[macs[5]][0] & NICK and scanner[macs[5]][1].nick == "Renamed"
+    assert NowListener.last_seen[macs[5]].nick == "Renamed"
+    # nicks take up to 20 characters, a change past the 15th is one too
+    for nick in ("CyberPhantomRogue001", "CyberPhantomRogue002"):
+        scanner.pop(macs[5])
+        await listener.handle_msg(macs[5], BeaconMsg(nick=nick).srlz(), -50)
+        await asyncio.sleep(0.1)
+        assert scanner[macs[5]][0] & NICK and scanner[macs[5]][1].nick == nick
+        assert NowListener.last_seen[macs[5]].nick == nick
+    print("nick ok: NICK published, for 20 character nicks too")
+
+    for t in tasks:
+        t.cancel()
+    await asyncio.sleep(0.1)
+    assert NowListener.bus.stats()["subscribers"] == 0
+    print("cancel ok: subscriptions closed")
+
+
+asyncio.run(main())
@@ -0,0 +1,69 @@
+import asyncio
+
+import umsgpack
+
+from badge.msg import AckMsg
+from badge.msg.connection import NowListener
+from badge.msg.tx import RESYNC, AckTracker, DupFilter, is_acked
+from host.transport import Fabric
+
+# Runs without radio: acks must only cover ids that were received. A peer
+# first heard mid stream, or heard again after it restarted at a lower or
+# higher id, gets acks for what it sent since, never for the ids around it,
+# and its frames are not taken for retries. The state kept per peer goes
+# when the peer leaves last_seen.
+ME = b"\xaa\x00\x00\x00\x00\x00"
+PEER = b"\xaa\x00\x00\x00\x00\x0c"
+
+
+def acked(acks, ids):
+    # ids the pending ack for PEER covers
+    frame = acks.take(PEER)
+    ack = AckMsg(*umsgpack.loads(frame[3:]), id=int.from_bytes(frame[1:3], "big"))
+    return [i for i in ids if is_acked(i, ack.id, ack.sack, ack.run)]
+
+
+async def main():
+    acks = AckTracker()
+    # first contact with 101, 100 was lost or is late
+    acks.received(PEER, 101)
+    assert acked(acks, range(95, 105)) == [101]
+    acks.received(PEER, 100)
+    assert acked(acks, range(95, 105)) == [100, 101]
+    # 97 is not next to the run, acking it would ack 98 and 99
+    acks.received(PEER, 97)
+    assert acks.take(PEER) is None
+    for i in (102, 103):
+        acks.received(PEER, i)
+    assert acked(acks, range(95, 105)) == [100, 101, 102, 103]
+    print("first contact ok: only ids received are acked")
+
+    # the peer restarted behind the ids it used before, then ahead of them
+    for start in (103 - RESYNC - 400, 103 + RESYNC + 400):
+        for i in range(start, start + 3):
+            acks.received(PEER, i & 0xFFFF)
+        got = acked(acks, [i & 0xFFFF for i in range(start - 5, start + 5)])
+        assert got == [i & 0xFFFF for i in range(start, start + 3)], (start, got)
+    print("restart ok: acks follow the peer both ways")
+
+    seen = DupFilter()
+    for i in range(40000, 40010):
+        assert seen.check(PEER, i)
+    assert not seen.check(PEER, 40005) and not seen.check(PEER, 40009 - RESYNC + 1)
+    # restarted at 30000: new ids, then its retries are dups again
+    assert all(seen.check(PEER, i) for i in range(30000, 30005))
+    assert not seen.check(PEER, 30002) and seen.dups == 3
+    print("dup filter ok: a restart behind the window is not a retry")
+
+    # a peer leaving last_seen takes its ack state with it
+    nl = NowListener(Fabric().port(ME))
+    NowListener.last_seen.add(PEER, "Anon0000", -50, 0)
+    nl.tx.acks.received(PEER, 7)
+    assert nl.seen.check(PEER, 7) and PEER in nl.tx.acks._peers
+    NowListener.last_seen.sweep(NowListener.last_seen.expire_s + 1)
+    assert PEER not in NowListener.last_seen and PEER not in nl.tx.acks._peers
+    assert PEER not in nl.seen._peers
+    print("leave ok: ack and dup filter state dropped with the peer")
+
+
+asyncio.run(main())
@@ -0,0 +1,126 @@
+import gc
+import random
+from time import ticks_us, ticks_diff, time
+
+from badge.msg import BAND, BadgeAdr, BadgeAdrDict
+
+# Host benchmark, beacon ingest cost of NowListener.last_seen against its
+# size: a hall with twice as many badges as the table holds, every beacon
+# stored like handle_msg() does for a new peer or refreshed like triage()
+# does for a known one. Compared with the old table, a dict of BadgeAdr
+# that scanned for the oldest entry on every store and evicted even when
+# refreshing. Then the heap both take for MEM_PEERS peers, and how often
+# RSSI smoothing lets a peer at a band edge change band.
+SIZES = (20, 100, 500)
+BEACONS = 5000
+MEM_PEERS = 500
+SEED = 2025
+
+
+class MinScanDict:
+    # the table before the packed one
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.store = {}
+
+    def add(self, mac, nick, rssi, last_seen):
+        if len(self.store) >= self.max_size:
+            oldest = min(self.store, key=lambda k: self.store[k].last_seen)
+            del self.store[oldest]
+        self.store[mac] = BadgeAdr(mac, nick, rssi, last_seen)
+
+    def update_last_seen(self, key, last_seen, rssi=None):
+        if key in self.store:
+            self.store[key].last_seen = last_seen
+            return True
+        return False
+
+    def __len__(self):
+        return len(self.store)
+
+
+def ingest(table, macs):
+    start = ticks_us()
+    now = int(time())
+    for n in range(BEACONS):
+        mac = macs[(n * 7) % len(macs)]
+        if not table.update_last_seen(mac, now + n, -50):
+            table.add(mac, "Anon", -50, now + n)
+    return ticks_diff(ticks_us(), start) / BEACONS
+
+
+def heap():
+    gc.collect()
+    if hasattr(gc, "mem_alloc"):
+        return gc.mem_alloc()
+    import tracemalloc
+
+    return tracemalloc.get_traced_memory()[0]
+
+
+def memory(cls, macs):
+    before = heap()
+    table = cls(MEM_PEERS)
+    for p, mac in enumerate(macs):
+        table.add(mac, f"Anon{p:04}x{p:06}", -50 - p % 40, 1000 + p)
+    used = heap() - before
+    assert len(table) == MEM_PEERS
+    return table, used
+
+
+def main():
+    print(f"{'size':>5} {'min scan us':>12} {'packed us':>10}")
+    for size in SIZES:
+        macs = [bytes([0xBB, 0, 0, 0, p >> 8, p & 0xFF]) for p in range(2 * size)]
+        old = ingest(MinScanDict(size), macs)
+        t = BadgeAdrDict(size)
+        new = ingest(t, macs)
+        assert len(t) == size
+        print(f"{size:>5} {old:>12.1f} {new:>10.1f}")
+
+    if not hasattr(gc, "mem_alloc"):
+        import tracemalloc
+
+        tracemalloc.start()
+    # macs as the driver hands them, allocated for every frame anyway
+    macs = [bytes([0xBB, 0, 0, 0, p >> 8, p & 0xFF]) for p in range(MEM_PEERS)]
+    old, old_b = memory(MinScanDict, macs)
+    new, new_b = memory(BadgeAdrDict, macs)
+    print(f"{MEM_PEERS} peers: dict of BadgeAdr {old_b} B, packed {new_b} B")
+    # read back what was stored
+    assert new[macs[7]].nick == old.store[macs[7]].nick
+    assert new[macs[7]].rssi == -57 and new[macs[7]].last_seen == 1007
+
+    # refreshing a known peer in a full table evicts nobody
+    t = BadgeAdrDict(3)
+    macs = [bytes([0xBB, 0, 0, 0, 0, p]) for p in range(4)]
+    for mac in macs[:3]:
+        t[mac] = BadgeAdr(mac, "Anon", -50, 0)
+    t[macs[0]] = BadgeAdr(macs[0], "Anon", -40, 0)
+    assert len(t) == 3 and macs[1] in t
+    t[macs[3]] = BadgeAdr(macs[3], "Anon", -50, 0)
+    assert macs[1] not in t and macs[0] in t, t.keys()
+    del t[macs[2]]
+    assert t.keys() == [macs[3], macs[0]], t.keys()
+    print("refresh ok: full table keeps its peers, evicts the one seen longest ago")
+
+    # a peer standing at a band edge, raw RSSI jumping +-4 dB around it
+    random.seed(SEED)
+    t = BadgeAdrDict(4)
+    mac = macs[0]
+    edge = t.bands[0]
+    t.add(mac, "Anon", edge, 0)
+    raw = changes = 0
+    last = True  # starts at the edge
+    for n in range(BEACONS):
+        rssi = edge + random.randint(-4, 4)
+        raw += (rssi >= edge) != last
+        last = rssi >= edge
+        changes += t.refresh(mac, n, rssi) == BAND
+    assert changes < raw // 20, (changes, raw)
+    print(
+        f"bands ok: {changes} band changes," f" raw RSSI crossed the edge {raw} times"
+    )
+
+
+main()
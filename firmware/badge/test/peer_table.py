@@ -0,0 +1,72 @@
+import asyncio
+import random
+
+from badge.msg import AppMsg, BeaconMsg, RPSMsg, BROADCAST
+from badge.msg.peers import PeerTable
+from badge.msg.stats import LinkStats
+from badge.msg.tx import FrameAggregator
+from host.transport import Fabric
+
+# Runs without radio: a day at the event, the badge sends to BADGES
+# different badges, a few at a time, while PINNED session peers stay in
+# touch throughout. The transport has SLOTS peer slots and fails like
+# ESP-NOW does. No send may hit ESP_ERR_ESPNOW_NOT_FOUND and no
+# session peer, nor the broadcast peer of beacons, may be evicted. Link
+# stats are kept for the peers in the driver table only, what is heard
+# from the others is counted together as untracked.
+BADGES = 200
+SLOTS = 20
+PINNED = 3
+ROUNDS = 400
+SEED = 2025
+ME = b"\xaa\xff\x00\x00\x00\x00"
+
+
+async def main():
+    random.seed(SEED)
+    e = Fabric().port(ME, max_peers=SLOTS)
+    e.add_peer(BROADCAST)  # Beacon.setup() adds its peer before us
+    peers = PeerTable(e, size=SLOTS)
+    stats = LinkStats(peers)
+    tx = FrameAggregator(e, peers=peers, stats=stats)
+    macs = [bytes([0xAA, 0, 0, 0, p >> 8, p & 0xFF]) for p in range(BADGES)]
+    pinned = macs[:PINNED]
+    for mac in pinned:
+        peers.pin(mac)
+    frame = AppMsg(RPSMsg(choice=1), con_id=3, seq=0).srlz()
+    beacon = BeaconMsg(nick="Anon0000").srlz()
+    for _ in range(ROUNDS):
+        tx.add(BROADCAST, beacon)
+        for mac in pinned + random.sample(macs[PINNED:], 4):
+            tx.add(mac, frame)
+        await tx.flush()
+        for mac in random.sample(macs, 20):
+            stats.rx(mac, 20, -50)  # beacons
+        added = [p[0] for p in e.get_peers()]
+        assert all(mac in added for mac in pinned) and BROADCAST in added
+        assert all(mac in peers for mac in stats.peers()), stats.peers()
+    assert e.tx_errors == 0, e.tx_errors
+    assert peers.stats()["pinned"] == PINNED + 1
+    assert len(e.get_peers()) <= SLOTS
+    assert all(stats.get(mac)["tx"] == ROUNDS for mac in pinned)
+    untracked = stats.get()
+    assert len(stats.peers()) <= SLOTS and not untracked["tx"] and untracked["rx"]
+    assert f"untracked tx=0/0 rx={untracked['rx']}/" in stats.line()
+    print(f"ok: {tx.sent} frames to {BADGES} badges, {peers.stats()}")
+    reuse()
+
+
+def reuse():
+    # more driver slots than records, all their peers keep their slot: the
+    # record of the peer counted first is taken over, not the newest one
+    peers = PeerTable(Fabric().port(ME, max_peers=SLOTS), size=SLOTS)
+    stats = LinkStats(peers, max_peers=3)
+    macs = [bytes([0xCC, 0, 0, 0, 0, p]) for p in range(5)]
+    for mac in macs:
+        peers.use(mac)
+        stats.tx(mac, 10)
+    assert stats.peers() == macs[2:], stats.peers()
+    print(f"reuse ok: {len(macs)} peers in 3 records keep the newest")
+
+
+asyncio.run(main())
@@ -0,0 +1,53 @@
+import asyncio
+import gc
+from time import ticks_us, ticks_diff
+
+from badge.msg import AckMsg, AppMsg, BadgeMsg, BeaconMsg, MsgPool, RPSMsg
+
+# Simulated beacon storm: FPS received frames per second, mostly beacons,
+# decoded the way NowListener.task does it, with and without a MsgPool.
+FPS = 50
+SECONDS = 10
+PAUSE_US = 2000  # a frame slower than this is counted as a GC pause
+
+
+def storm_frames():
+    frames = [BeaconMsg(nick=f"Anon{n:04}").srlz() for n in range(8)]
+    frames.append(AckMsg(id=7).srlz())
+    frames.append(AppMsg(RPSMsg(choice=2), con_id=3).srlz())
+    return frames
+
+
+async def storm(pool):
+    frames = storm_frames()
+    worst = total = pauses = 0
+    gc.collect()
+    alloc = gc.mem_alloc() if hasattr(gc, "mem_alloc") else None
+    for n in range(FPS * SECONDS):
+        start = ticks_us()
+        msg = BadgeMsg.desrlz(frames[n % len(frames)], pool)
+        if pool:
+            pool.put(msg)
+        dt = ticks_diff(ticks_us(), start)
+        total += dt
+        worst = max(worst, dt)
+        pauses += dt > PAUSE_US
+        await asyncio.sleep_ms(1000 // FPS)
+    if alloc is not None:
+        alloc = gc.mem_alloc() - alloc
+    n = FPS * SECONDS
+    print(
+        f"{'pool' if pool else 'no pool':<8} avg {total / n:.0f}us worst {worst}us"
+        f" pauses {pauses} heap delta {alloc}"
+    )
+    if pool:
+        print(f"pool {pool.stats()}")
+
+
+async def main():
+    gc.threshold(8 * 1024) if hasattr(gc, "threshold") else None
+    await storm(None)
+    await storm(MsgPool(size=2))
+
+
+asyncio.run(main())
@@ -0,0 +1,101 @@
+import asyncio
+from time import ticks_ms, ticks_diff
+
+from badge.msg import AppMsg, RPSMsg
+from badge.msg.tx import FrameAggregator, RetxScheduler
+from host.transport import Fabric
+
+# Runs without radio: 150 outstanding frames over 30 peers, part of them
+# acked, the rest must be resent exactly RETRY times and then dropped.
+# Sends are counted on the air, through a FrameAggregator.
+# Then on virtual time to a peer with a measured RTT: a frame is sent
+# 1 + retry times for every retry budget, whatever the RTO backs off to.
+PEERS = 30
+PER_PEER = 5
+RETRY = 2
+TIMEOUT_MS = 50
+ME = b"\xaa\xff\x00\x00\x00\x00"
+
+
+def frame(con_id, i):
+    msg = AppMsg(RPSMsg(choice=i % 3), con_id=con_id, seq=i)
+    msg._id = i
+    return msg.srlz()
+
+
+def sends(air):
+    # times each frame went out, bundles unpacked
+    sent = {}
+    for _, mac, rec in air.sent():
+        sent[(mac, rec)] = sent.get((mac, rec), 0) + 1
+    return sent
+
+
+async def main():
+    air = Fabric(log=True)
+    e = air.port(ME, max_peers=PEERS)
+    tx = FrameAggregator(e, limits=(16, 16, PEERS * PER_PEER, 1))
+    sched = RetxScheduler(tx, timeout_ms=TIMEOUT_MS)
+    macs = [bytes([0xAA, 0, 0, 0, 0, p]) for p in range(PEERS)]
+    for p, mac in enumerate(macs):
+        e.add_peer(mac)
+        for i in range(PER_PEER):
+            sched.send(mac, i, frame(p, i), retry=RETRY)
+    assert sched.outstanding() == PEERS * PER_PEER
+
+    # cumulative ack up to 1, selective ack for 3
+    for mac in macs:
+        assert sched.ack(mac, 1, 0b10) == 3
+
+    # resends back off exponentially, wait until all are acked or dropped
+    start = ticks_ms()
+    while sched.outstanding() and ticks_diff(ticks_ms(), start) < 5000:
+        await asyncio.sleep(0.01)
+    took = ticks_diff(ticks_ms(), start)
+
+    assert sched.outstanding() == 0
+    await tx.flush()
+    sent = sends(air)
+    for p, mac in enumerate(macs):
+        for i in range(PER_PEER):
+            want = 1 if i in (0, 1, 3) else 1 + RETRY
+            assert sent[(mac, frame(p, i))] == want, (mac, i)
+    assert sched.timeouts == PEERS * 2
+    assert sched.retries == PEERS * 2 * RETRY
+    # all frames due at the same time are handled in one wakeup
+    assert sched.wakeups <= 2 * (RETRY + 2), sched.wakeups
+    print(
+        f"ok: {PEERS * PER_PEER} frames, {sched.retries} retries,"
+        f" {sched.timeouts} timeouts, {sched.wakeups} wakeups in {took}ms"
+    )
+    sched.stop()
+    await budget()
+
+
+async def budget():
+    air = Fabric(log=True)
+    e = air.port(ME)
+    tx = FrameAggregator(e)
+    now = [0]
+    sched = RetxScheduler(tx, timeout_ms=500, clock=lambda: now[0])
+    mac = bytes([0xAA, 0, 0, 0, 0, 0xFF])
+    e.add_peer(mac)
+    for i in range(10):  # 20ms RTT samples
+        sched.send(mac, i, frame(1, i), retry=3)
+        now[0] += 20
+        assert sched.ack(mac, i) == 1
+    sent = []
+    for i, retry in enumerate((0, 1, 3, 6), 10):
+        sched.send(mac, i, frame(1, i), retry=retry)
+        delay = sched.poll()
+        while delay is not None:
+            now[0] += delay
+            delay = sched.poll()
+        assert not sched.waiting(mac, i)
+        await tx.flush()
+        sent.append(sends(air)[(mac, frame(1, i))])
+    assert sent == [1, 2, 4, 7], sent
+    print(f"budget ok: retry 0, 1, 3, 6 sent {sent} times, rto {sched.rto(mac)}ms")
+
+
+asyncio.run(main())
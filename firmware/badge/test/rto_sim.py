@@ -0,0 +1,156 @@
+from heapq import heappop, heappush
+
+from badge.msg.tx import RetxScheduler
+
+# Runs without radio, on virtual time: stop-and-wait message exchanges with
+# PEERS peers over a lossy link with per peer round trip times, once with
+# the old fixed 500 ms retransmit timeout and once with the adaptive one,
+# at a few loss rates. Loss applies to frames and acks alike. Frames and
+# acks are events on a clock the scheduler reads, loss and jitter depend
+# only on which copy of which message it is: both runs see the same channel
+# and a run gives the same numbers every time. Adaptive must not give up
+# on more messages than fixed, and must be faster on the messages both
+# deliver once frames get lost. An RTT that grows must still be measured.
+PEERS = 10
+MSGS = 50  # per peer, each sent after the previous one is acked or dropped
+RETRY = 3
+LOSS = (0, 10, 30)  # percent
+SEED = 2025
+
+
+def draw(*key):
+    # 0..99 from key, the same channel for both runs: the n-th copy of a
+    # message is lost or delayed alike with the fixed and the adaptive RTO
+    h = SEED
+    for k in key:
+        h = (h * 1103515245 + k + 12345) & 0x7FFFFFFF
+        h ^= h >> 13
+    return (h * 2654435761 >> 7) % 100
+
+
+class Sim:
+    # virtual ms clock and the events due on it, stands in for
+    # FrameAggregator: the peer acks every copy it receives
+    def __init__(self, loss, rtts):
+        self.loss = loss
+        self.rtts = rtts
+        self.ms = 0
+        self.sched = None
+        self.events = []  # (ms, n, mac, frame, copy, ack)
+        self.n = 0
+        self.copies = {}  # frame -> copies sent
+        self.wasted = 0  # resends of frames the peer already had
+        self.got = set()  # frames the peer has received
+
+    def clock(self):
+        return self.ms
+
+    def later(self, mac, frame, copy, ack):
+        # half the rtt there or back, with up to 25 % jitter
+        key = (mac[-1], frame[-1], copy, ack)
+        if draw(self.loss, *key) < self.loss:
+            return
+        rtt = self.rtts[mac]
+        self.n += 1
+        at = self.ms + rtt // 2 + rtt * draw(*key) // 800
+        heappush(self.events, (at, self.n, mac, frame, copy, ack))
+
+    def add(self, mac, frame):
+        if frame in self.got:
+            self.wasted += 1
+        copy = self.copies[frame] = self.copies.get(frame, 0) + 1
+        self.later(mac, frame, copy, 0)
+
+    def step(self):
+        # advance to the next frame, ack or retransmit deadline
+        delay = self.sched.poll()
+        at = self.events[0][0] if self.events else None
+        if delay is not None and (at is None or self.ms + delay <= at):
+            self.ms += delay
+            self.sched.poll()
+            return None
+        self.ms, _, mac, frame, copy, ack = heappop(self.events)
+        if not ack:
+            self.got.add(frame)
+            self.later(mac, frame, copy, 1)
+            return None
+        return mac if self.sched.ack(mac, frame[-1]) else None
+
+
+def run(loss, adaptive):
+    macs = [bytes([0xAA, 0, 0, 0, 0, p]) for p in range(PEERS)]
+    rtts = {mac: 20 + 15 * p for p, mac in enumerate(macs)}  # 20..155 ms
+    sim = Sim(loss, rtts)
+    sched = sim.sched = RetxScheduler(
+        sim, timeout_ms=500, adaptive=adaptive, clock=sim.clock
+    )
+    took, failed = {}, 0  # (peer, msg) -> ms until acked
+    sent = {mac: [0, 0] for mac in macs}  # mac -> [msg, sent at ms]
+
+    def send(mac):
+        st = sent[mac]
+        st[1] = sim.ms
+        sched.send(mac, st[0], mac + bytes([st[0]]), retry=RETRY)
+
+    for mac in macs:
+        send(mac)
+    while sim.events or sched.outstanding():
+        acked = sim.step()
+        for mac in macs:
+            st = sent[mac]
+            if st[0] == MSGS or sched.waiting(mac, st[0]):
+                continue
+            if mac == acked:
+                took[mac[-1], st[0]] = sim.ms - st[1]
+            else:
+                failed += 1
+            st[0] += 1
+            if st[0] < MSGS:
+                send(mac)
+    lat = sorted(took.values())
+    p95 = lat[len(lat) * 95 // 100]
+    print(
+        f"{loss:>4}% {'adaptive' if adaptive else 'fixed':<9}"
+        f" avg {sum(lat) // len(lat):>4}ms p95 {p95:>5}ms"
+        f" retries {sched.retries:>4} wasted {sim.wasted:>4} failed {failed}"
+    )
+    return took, failed
+
+
+def p95(took, keys):
+    lat = sorted(took[k] for k in keys)
+    return lat[len(lat) * 95 // 100]
+
+
+def grow():
+    # the rtt of a peer jumps from 50 to 600 ms: resends must not hide it
+    # from the RTO, Karn keeps the backoff until a clean sample comes in
+    mac = bytes([0xAA, 0, 0, 0, 0, 0])
+    sim = Sim(0, {mac: 50})
+    sched = sim.sched = RetxScheduler(sim, clock=sim.clock)
+    for i in range(60):
+        if i == 20:
+            sim.rtts[mac] = 600
+            retries = sched.retries
+        sched.send(mac, i, mac + bytes([i]), retry=RETRY)
+        while sched.waiting(mac, i):
+            sim.step()
+    assert sched.rto(mac) > 750 and sched.retries - retries < 10, sched._rtt
+    print(f"rtt 50 -> 600ms: rto {sched.rto(mac)}ms, {sched.retries - retries} resent")
+
+
+def main():
+    print(f"{PEERS} peers x {MSGS} msgs, rtt 20..155ms, {RETRY} retries")
+    for loss in LOSS:
+        fixed, f_failed = run(loss, False)
+        adaptive, a_failed = run(loss, True)
+        assert a_failed <= f_failed, (loss, f_failed, a_failed)
+        # the same messages, adaptive delivers some fixed gives up on
+        both = [k for k in fixed if k in adaptive]
+        f, a = p95(fixed, both), p95(adaptive, both)
+        print(f"{loss:>4}% p95 of the {len(both)} both delivered: {f}ms, {a}ms")
+        assert not loss or a < f, (loss, f, a)
+    grow()
+
+
+main()
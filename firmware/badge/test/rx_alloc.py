@@ -0,0 +1,87 @@
+import asyncio
+import gc
+from time import ticks_us, ticks_diff
+
+from badge.msg import BadgeAdr, BeaconMsg
+from badge.msg.connection import NowListener
+from badge.msg.rx import RxBuffer
+from host.transport import Fabric
+
+# Heap allocated per received beacon of a known peer on the receive path of
+# NowListener, run as on the badge: task() draining the driver into the
+# buffer and the dispatch worker taking the frames and handling them in
+# triage(). Compared with copying every frame into a new bytes object, as
+# the buffer did before its ring of slots.
+# The transport hands out the same buffer every time like irecv() does,
+# what it allocates to pass a frame on is counted for both alike.
+# Heap numbers need gc.mem_alloc(), on the unix port or the badge.
+FRAMES = 2000
+WARMUP = 200  # interning, dict growth
+PEERS = 20
+ME = b"\xaa\x00\x00\x00\x00\x00"
+
+
+class QueueCopy:
+    # the old buffer: a bytes copy and a tuple per frame in a list
+    def __init__(self):
+        self._q = []
+        self._ev = asyncio.Event()
+
+    def __len__(self):
+        return len(self._q)
+
+    def put(self, mac, frame, rssi):
+        self._q.append((mac, bytes(frame), rssi))
+        self._ev.set()
+
+    async def wait(self):
+        while not self._q:
+            self._ev.clear()
+            await self._ev.wait()
+
+    def get_nowait(self):
+        return self._q.pop(0)
+
+
+async def feed(air, macs, frame):
+    # beacons of PEERS known badges, one per run of the event loop so the
+    # worker has handled a frame before the next one comes in. Measures the
+    # FRAMES after WARMUP
+    alloc = took = None
+    for n in range(WARMUP + FRAMES):
+        if n == WARMUP:
+            gc.collect()
+            gc.disable()
+            alloc = gc.mem_alloc() if hasattr(gc, "mem_alloc") else None
+            took = ticks_us()
+        air.inject(macs[n % PEERS], ME, frame)
+        await asyncio.sleep(0)  # the worker takes the previous frame
+    await asyncio.sleep(0)
+    took = ticks_diff(ticks_us(), took)
+    if alloc is not None:
+        alloc = gc.mem_alloc() - alloc
+    gc.enable()
+    return alloc, took
+
+
+async def main():
+    macs = [bytes([0xBB, 0, 0, 0, 0, p]) for p in range(PEERS)]
+    for mac in macs:
+        NowListener.last_seen[mac] = BadgeAdr(mac, "Anon0000", -50, 0)
+    frame = BeaconMsg(nick="Anon0000").srlz()
+    air = Fabric()
+    e = air.port(ME, irecv=True)
+    for name, rx in (("bytes copy", QueueCopy()), ("ring", RxBuffer())):
+        listener = NowListener(e)
+        listener.rx = rx
+        task = asyncio.create_task(listener.task())
+        alloc, took = await feed(air, macs, frame)
+        while len(rx):
+            await asyncio.sleep(0)
+        task.cancel()
+        assert not e.rx_drops
+        per = "n/a" if alloc is None else f"{alloc / FRAMES:.1f}"
+        print(f"{name:<10} {per:>6} bytes/beacon {took / FRAMES:.1f}us/beacon")
+
+
+asyncio.run(main())
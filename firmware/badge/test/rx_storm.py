@@ -0,0 +1,123 @@
+import asyncio
+from time import ticks_ms, ticks_diff
+
+from badge.msg import (
+    ACK,
+    BEACON,
+    DATA,
+    AckMsg,
+    AppMsg,
+    BeaconMsg,
+    GroupMsg,
+    GroupNack,
+    RPSMsg,
+    bundle,
+    frame_class,
+)
+from badge.msg.connection import NowListener
+from badge.msg.rx import RxBuffer
+from host.transport import Fabric
+
+# Runs without radio: a hall full of badges. RATE frames per second for
+# SECONDS, mostly beacons of PEERS badges, every 10th frame an ack (control)
+# and every 10th an app message. The transport buffers at most HW_BUF
+# frames and reuses its receive buffer like irecv() does.
+RATE = 300
+SECONDS = 5
+PEERS = 50
+HW_BUF = 8
+ME = b"\xaa\x00\x00\x00\x00\x00"
+
+
+async def storm(air):
+    macs = [bytes([0xBB, 0, 0, 0, 0, p]) for p in range(PEERS)]
+    beacons = [BeaconMsg(nick=f"Anon{p:04}").srlz() for p in range(PEERS)]
+    sent = [0, 0]  # control, data
+    n = 0
+    start = ticks_ms()
+    while ticks_diff(ticks_ms(), start) < SECONDS * 1000:
+        for _ in range(RATE // 100):
+            p = n % PEERS
+            if n % 10 == 3:
+                air.inject(macs[p], ME, AckMsg(id=n & 0xFFFF).srlz())
+                sent[0] += 1
+            elif n % 10 == 7:
+                air.inject(macs[p], ME, AppMsg(RPSMsg(choice=1), con_id=9).srlz())
+                sent[1] += 1
+            else:
+                air.inject(macs[p], ME, beacons[p])
+            n += 1
+        await asyncio.sleep(0.01)
+    return n, sent
+
+
+def burst():
+    # a full buffer gives up beacons first, then data, never control
+    rx = RxBuffer(size=4)
+    mac = b"\xbb" * 6
+    beacon = BeaconMsg(nick="Anon0000").srlz()
+    data = AppMsg(RPSMsg(choice=1), con_id=9).srlz()
+    ctl = AckMsg(id=1).srlz()
+    for f in (beacon, data, beacon, data, ctl, ctl, beacon, ctl, ctl, ctl):
+        rx.put(mac, f, -50)
+    kinds = [bytes(rx.get_nowait()[1]) for _ in range(len(rx))]
+    assert kinds == [ctl] * 5, kinds
+    assert rx.drops == [0, 0, 2, 3], rx.drops
+    print(f"burst ok {rx.stats()}")
+
+
+def flood():
+    # nothing is taken out: group, legacy and bundled frames are classed by
+    # what they carry, and control frames stop at max_slots
+    rx = RxBuffer(size=4)
+    mac = b"\xbb" * 6
+    app = AppMsg(RPSMsg(choice=1), con_id=9)
+    frames = (
+        GroupMsg(RPSMsg(choice=1), 5).srlz(),
+        GroupNack(5, 1, 2).srlz(),
+        app.srlz_dict(),
+        BeaconMsg(nick="Anon0000").srlz_dict(),
+        bundle([app.srlz(), BeaconMsg(nick="Anon0000").srlz()]),
+        AckMsg(id=1).srlz_dict(),
+        bundle([AckMsg(id=1).srlz(), app.srlz()]),
+    )
+    classes = [frame_class(f) for f in frames]
+    assert classes == [DATA, DATA, DATA, BEACON, DATA, ACK, ACK], classes
+    for _ in range(300):
+        for f in frames:
+            rx.put(mac, f, -50)
+    assert len(rx._buf) == rx.max_slots == len(rx) == 9, len(rx._buf)
+    assert rx.drops[ACK] and rx.drops[DATA] and rx.drops[BEACON], rx.drops
+    assert rx.frames == sum(rx.drops) + len(rx)
+    print(f"flood ok {rx.stats()}")
+
+
+async def main():
+    burst()
+    flood()
+    air = Fabric()
+    e = air.port(ME, rx_buf=HW_BUF, irecv=True)
+    NowListener.start(e)
+    retx = NowListener.retx_sched()
+    acks = [0]
+    ack = retx.ack
+
+    def count_ack(mac, cum, sack=0, run=1):
+        acks[0] += 1
+        return ack(mac, cum, sack, run)
+
+    retx.ack = count_ack
+    n, sent = await storm(air)
+    await asyncio.sleep(0.5)  # let the worker catch up
+    fps = (n - e.rx_drops) // SECONDS
+    print(
+        f"offered {n // SECONDS} fps, taken in {fps} fps,"
+        f" driver drops {e.rx_drops}, acks handled {acks[0]}/{sent[0]}"
+    )
+    print(f"rx {NowListener.rx_stats()}")
+    assert fps > 100, fps
+    assert acks[0] == sent[0]
+    NowListener.stop()
+
+
+asyncio.run(main())
@@ -0,0 +1,75 @@
+import asyncio
+from time import ticks_ms, ticks_diff
+
+from badge.msg import ConTerm, RPSMsg
+from badge.msg.connection import NowListener
+from host.transport import Fabric
+from host.virtual_badge import VirtualBadge
+
+# Runs without radio: a hub badge serving PEERS sessions of the same app at
+# once, like a referee. Every peer opens a connection and sends MOVES app
+# messages, all interleaved. Each session must get only its own peer's
+# moves, in order, and the hub's replies must go to the right peer. Then
+# half of the peers go quiet and their sessions expire, each told once
+# with a ConTerm that is not resent. A peer closing its session gets no
+# ConTerm back.
+PEERS = 10
+MOVES = 20
+APP = 3
+MACS = [bytes([0xAA, 0, 0, 0, 0, p]) for p in range(PEERS)]
+HUB = b"\xaa\x00\x00\x00\x00\xff"
+
+
+async def accept(con, req=False):
+    return True
+
+
+async def main():
+    fabric = Fabric()
+    NowListener.con_cb = accept
+    NowListener.start(fabric.port(HUB))
+    peers = [VirtualBadge(fabric.port(mac), "Peer", beacon_ms=0) for mac in MACS]
+    for peer in peers:
+        peer.start()
+    start = ticks_ms()
+    await asyncio.gather(*(peer.connect(HUB, APP) for peer in peers))
+    sessions = [NowListener.session(mac, APP) for mac in MACS]
+    assert all(sessions), sessions
+    assert len(NowListener.connections) == PEERS
+
+    for n in range(MOVES):
+        for p, peer in enumerate(peers):
+            await peer.send_app(HUB, APP, RPSMsg(choice=(p + n) % 3), n)
+        for p, con in enumerate(sessions):
+            move = await con.get(2)
+            assert move.choice == (p + n) % 3, (p, n, move)
+            con.send_app_msg(RPSMsg(choice=p % 3))
+    got = [peer.got[(HUB, APP)] for peer in peers]
+    while sum(len(g) for g in got) < PEERS * MOVES:
+        await asyncio.sleep(0.01)
+        assert ticks_diff(ticks_ms(), start) < 5000, got
+    took = ticks_diff(ticks_ms(), start)
+    for p, g in enumerate(got):
+        assert [g[s].choice for s in range(MOVES)] == [p % 3] * MOVES, p
+    print(f"{PEERS} sessions ok: {PEERS * MOVES} moves each way in {took}ms")
+
+    # the first half went quiet
+    for con in sessions[: PEERS // 2]:
+        con.last_msg -= NowListener.idle_s + 1
+    assert await NowListener.expire_idle() == PEERS // 2
+    assert len(NowListener.connections) == PEERS - PEERS // 2
+    assert not NowListener.has_con_to(MACS[0]) and NowListener.has_con_to(MACS[-1])
+    assert sessions[0].closed and not sessions[-1].closed
+    await peers[-1].send(HUB, ConTerm(con_id=APP))
+    await asyncio.sleep(1.5)  # past the retransmit timeouts
+    terms = [peer.heard.get(ConTerm.TYPE_ID, 0) for peer in peers]
+    half = PEERS // 2
+    assert terms == [1] * half + [0] * (PEERS - half), terms
+    assert sessions[-1].closed and not NowListener.has_con_to(MACS[-1])
+    print(f"expire ok: {len(NowListener.connections)} sessions left, ConTerm once")
+    for peer in peers:
+        peer.stop()
+    NowListener.stop()
+
+
+asyncio.run(main())
@@ -0,0 +1,117 @@
+import asyncio
+import random
+from time import ticks_ms, ticks_diff
+
+from badge.msg import RPSMsg, BROADCAST
+from badge.msg.connection import NowListener
+from host.channel import RadioFabric
+from host.virtual_badge import VirtualBadge
+
+# Runs on the host: two players at the edge of range, the badge running
+# the badge.msg stack and a VirtualBadge placed where the link's mean RSSI
+# is EDGE dBm, just above the -70 cutoff of NowListener. Fading pushes part
+# of the frames below it. The badge plays GAMES games of MOVES moves, each
+# opening and closing a connection. Reports
+#   discovery: time until the badge heard the other one
+#   handshakes: games whose connection opened
+#   retries per delivered message and frames cut by the RSSI filter
+# The channel alone is checked first: the same sends on two fabrics with
+# the same seed land the same, collisions and all.
+EDGE = -67
+GAMES = 10
+MOVES = 10
+CUTOFF = -70
+SEED = 2025
+BURST = 6
+
+
+def replay():
+    # BURST badges a few meters apart broadcast in rounds, on virtual time
+    got = []
+    for _ in range(2):
+        now = [0]
+        fabric = RadioFabric(seed=SEED, clock=lambda: now[0])
+        ports = [
+            fabric.port(bytes([0xAA, 1, 0, 0, 0, p]), (p % 3, p // 3))
+            for p in range(BURST)
+        ]
+        heard = []
+        for p in ports:
+            p._deliver = lambda src, frame, rssi, p=p: heard.append(
+                (p.mac, src, frame, rssi)
+            )
+        for n in range(20):
+            for p in ports[n % 2 :: 2]:
+                p._send(BROADCAST, bytes([n]) * (20 + n))
+            now[0] += 1000 * (n % 3)
+            fabric.poll()
+        while fabric.poll() is not None:
+            now[0] += 100
+        got.append((fabric.stats(), heard))
+    assert got[0] == got[1], (got[0][0], got[1][0])
+    assert got[0][0]["collided"] and got[0][0]["deferred"], got[0][0]
+    print(f"replay ok: {got[0][0]}")
+
+
+async def main():
+    replay()
+    random.seed(SEED)
+    fabric = RadioFabric(seed=SEED, fade_db=3)
+    hub_mac = b"\xaa\xff\x00\x00\x00\x00"
+    mac = b"\xaa\x00\x00\x00\x00\x01"
+    hub = fabric.port(hub_mac, (0, 0))
+    port = fabric.port(mac, (1, 0))
+    # walk away until the link is at the edge
+    d = 1
+    while fabric.mean_rssi(hub_mac, mac) > EDGE:
+        d += 0.1
+        fabric.move(mac, (d, 0))
+    cut = [0]
+    deliver = hub._deliver
+
+    def counting(src, frame, rssi):
+        if rssi < CUTOFF:
+            cut[0] += 1
+        deliver(src, frame, rssi)
+
+    hub._deliver = counting
+    badge = VirtualBadge(port, "Anon0001")
+    NowListener.start(hub)
+    start = ticks_ms()
+    badge.start()
+    while mac not in NowListener.last_seen:
+        await asyncio.sleep(0.05)
+    print(
+        f"discovery: {d:.1f}m, mean {fabric.mean_rssi(hub_mac, mac):.1f}dBm,"
+        f" heard after {ticks_diff(ticks_ms(), start)}ms"
+    )
+
+    retx = NowListener.retx_sched()
+    retries = retx.retries
+    ok = delivered = 0
+    for _ in range(GAMES):
+        if not await NowListener.conn_req(mac, 3):
+            continue
+        ok += 1
+        con = NowListener.session(mac, 3)
+        for n in range(MOVES):
+            await con.send(RPSMsg(choice=n % 3))
+        start = ticks_ms()
+        while con.out_q.qsize() or con.in_flight():
+            await asyncio.sleep(0.05)
+            if ticks_diff(ticks_ms(), start) > 10000:
+                break
+        delivered += len(badge.got.get((hub_mac, 3), {}))
+        await con.terminate()
+        await asyncio.sleep(0.2)
+    retries = retx.retries - retries + badge.retries
+    print(
+        f"handshakes: {ok}/{GAMES}, {delivered}/{ok * MOVES} moves delivered,"
+        f" {retries / max(delivered, 1):.2f} retries per delivered message"
+    )
+    print(f"channel {fabric.stats()}, {cut[0]} frames below {CUTOFF}dBm cut")
+    badge.stop()
+    NowListener.stop()
+
+
+asyncio.run(main())
@@ -0,0 +1,94 @@
+import asyncio
+import random
+from time import ticks_ms, ticks_diff
+
+from badge.msg import RPSMsg
+from badge.msg.connection import NowListener
+from host.channel import RadioFabric
+from host.virtual_badge import VirtualBadge
+
+# Runs on the host: a conference hall of W x H meters with BADGES
+# badges at random places, one in the middle runs the badge.msg stack, the
+# rest are VirtualBadges beaconing every second. Reports
+#   discovery: time until the badge heard 95% (and all) of the badges in
+#              range (mean RSSI >= -70) above the cutoff
+#   handshakes: the badge opens SESSIONS connections to badges in range
+#   retries per delivered message for MOVES moves on each session
+BADGES = 300
+W, H = 40, 25
+SESSIONS = 10
+MOVES = 10
+CUTOFF = -70
+SEED = 2025
+
+
+async def discovery(fabric, hub, in_range, start):
+    heard = set()
+    t95 = None
+    while ticks_diff(ticks_ms(), start) < 10000:
+        for mac, (rssi, _) in hub.peers_table.items():
+            if rssi >= CUTOFF and mac in in_range:
+                heard.add(mac)
+        if t95 is None and len(heard) >= 0.95 * len(in_range):
+            t95 = ticks_diff(ticks_ms(), start)
+        if len(heard) == len(in_range):
+            return t95, ticks_diff(ticks_ms(), start), len(heard)
+        await asyncio.sleep(0.05)
+    return t95, None, len(heard)
+
+
+async def session(hub_mac, mac, badge):
+    if not await NowListener.conn_req(mac, 3):
+        return False, 0
+    con = NowListener.session(mac, 3)
+    for n in range(MOVES):
+        await con.send(RPSMsg(choice=n % 3))
+    start = ticks_ms()
+    while con.out_q.qsize() or con.in_flight():
+        await asyncio.sleep(0.05)
+        if ticks_diff(ticks_ms(), start) > 10000:
+            break
+    return True, len(badge.got.get((hub_mac, 3), {}))
+
+
+async def main():
+    random.seed(SEED)
+    fabric = RadioFabric(seed=SEED)
+    hub_mac = b"\xaa\xff\x00\x00\x00\x00"
+    hub = fabric.port(hub_mac, (W / 2, H / 2))
+    badges = {}
+    for p in range(BADGES - 1):
+        mac = bytes([0xAA, 0, 0, 0, p >> 8, p & 0xFF])
+        pos = (random.random() * W, random.random() * H)
+        port = fabric.port(mac, pos, rx_broadcast=False)
+        badges[mac] = VirtualBadge(port, f"Anon{p:04}")
+    in_range = {m for m in badges if fabric.mean_rssi(m, hub_mac) >= CUTOFF}
+    NowListener.start(hub)
+    start = ticks_ms()
+    for b in badges.values():
+        b.start()
+
+    t95, t100, n = await discovery(fabric, hub, in_range, start)
+    print(
+        f"discovery: {len(in_range)}/{BADGES - 1} in range,"
+        f" 95% after {t95}ms, all after {t100}ms ({n} heard)"
+    )
+
+    retx = NowListener.retx_sched()
+    retries = retx.retries
+    peers = random.sample(sorted(in_range), SESSIONS)
+    res = await asyncio.gather(*[session(hub_mac, m, badges[m]) for m in peers])
+    ok = sum(1 for r in res if r[0])
+    delivered = sum(r[1] for r in res)
+    retries = retx.retries - retries
+    print(
+        f"handshakes: {ok}/{SESSIONS}, {delivered}/{ok * MOVES} moves delivered,"
+        f" {retries / max(delivered, 1):.2f} retries per delivered message"
+    )
+    print(f"channel {fabric.stats()}, badge rx drops {hub.rx_drops}")
+    for b in badges.values():
+        b.stop()
+    NowListener.stop()
+
+
+asyncio.run(main())
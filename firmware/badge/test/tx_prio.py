@@ -0,0 +1,44 @@
+import asyncio
+
+from badge.msg import AppMsg, BeaconMsg, ConTerm, OpenConn, RPSMsg, peek
+from badge.msg.tx import FrameAggregator
+from host.transport import Fabric
+
+# Runs without radio: a busy transmit side with app data to many peers, a
+# beacon and acks waiting, then a connection request. The request must go
+# out first, the beacon last, and nothing may raise when the app class is
+# over its limit.
+PEERS = 10
+APP_PER_PEER = 5
+ME = b"\xaa\x00\x00\x00\x00\xff"
+
+
+async def main():
+    air = Fabric(log=True)
+    e = air.port(ME)
+    tx = FrameAggregator(e, limits=(16, 16, 32, 1))
+    macs = [bytes([0xAA, 0, 0, 0, 0, p]) for p in range(PEERS)]
+    for mac in macs + [b"\xbb" * 6, b"\xcc" * 6, b"\xcd" * 6]:
+        e.add_peer(mac)
+    tx.beacon(b"\xbb" * 6, BeaconMsg(nick="old").srlz())
+    for mac in macs:
+        for n in range(APP_PER_PEER):
+            tx.add(mac, AppMsg(RPSMsg(choice=n), con_id=1, seq=n).srlz())
+    tx.ack(macs[3], 1234)
+    tx.beacon(b"\xbb" * 6, BeaconMsg(nick="new").srlz())
+    oc = OpenConn(con_id=7)
+    tx.add(b"\xcc" * 6, oc.srlz())
+    tx.add(b"\xcd" * 6, ConTerm(con_id=8).srlz())
+
+    await asyncio.sleep(0.2)
+    sent = [frame for _, _, frame in air.log]
+    assert peek(sent[0])[0] == OpenConn.TYPE_ID, sent[0]
+    assert peek(sent[1])[0] == ConTerm.TYPE_ID
+    last = sent[-1]
+    assert peek(last)[0] == BeaconMsg.TYPE_ID and b"new" in last, last
+    # 50 app frames, 32 fit, the rest is left to retries
+    assert tx.drops == [0, 0, PEERS * APP_PER_PEER - 32, 1], tx.drops
+    print(f"ok: {len(sent)} frames sent, drops per class {tx.drops}")
+
+
+asyncio.run(main())
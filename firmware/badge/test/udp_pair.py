@@ -0,0 +1,63 @@
+import asyncio
+import subprocess
+import sys
+from time import ticks_ms, ticks_diff
+
+from badge.msg import RPSMsg
+from badge.msg.connection import NowListener
+from host.transport import UdpTransport
+
+# Runs on the host, two badges in two processes over UDP multicast, from
+# the firmware directory:
+#   python -m host badge/test/udp_pair.py b    # waits for a connection
+#   python -m host badge/test/udp_pair.py a    # connects to b, sends MOVES moves
+# b answers every move with the next choice, a checks the answers. Without
+# a role b runs in a child process and a in this one.
+MOVES = 50
+APP = 3
+MACS = {"a": b"\xaa\x00\x00\x00\x00\x0a", "b": b"\xaa\x00\x00\x00\x00\x0b"}
+
+
+async def badge_a(e):
+    while not await NowListener.conn_req(MACS["b"], APP):
+        print("b not there yet")
+    con = NowListener.session(MACS["b"], APP)
+    start = ticks_ms()
+    for n in range(MOVES):
+        await con.send(RPSMsg(choice=n % 3))
+        reply = await con.get(5)
+        assert reply.choice == (n + 1) % 3, (n, reply)
+    took = ticks_diff(ticks_ms(), start)
+    print(f"a ok: {MOVES} round trips in {took}ms")
+    await con.terminate()
+
+
+async def badge_b(e):
+    con = None
+    while con is None or not con.active:
+        await asyncio.sleep(0.05)
+        con = NowListener.session(MACS["a"], APP)
+    async for move in con.get_msg_aiter():
+        con.send_app_msg(RPSMsg(choice=(move.choice + 1) % 3))
+    print("b ok: session ended")
+
+
+async def main(role):
+    e = UdpTransport(MACS[role])
+    NowListener.start(e)
+    await (badge_a if role == "a" else badge_b)(e)
+    await asyncio.sleep(0.5)  # let acks out
+    print(NowListener.link_stats().line())
+    NowListener.stop()
+    e.close()
+
+
+if len(sys.argv) > 1:
+    asyncio.run(main(sys.argv[1]))
+else:
+    b = subprocess.Popen([sys.executable, "-m", "host", sys.argv[0], "b"])
+    try:
+        asyncio.run(main("a"))
+        assert b.wait(10) == 0, b.returncode
+    finally:
+        b.kill()
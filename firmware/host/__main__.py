@@ -0,0 +1,82 @@
+import os
+import re
+import runpy
+import subprocess
+import sys
+import time
+
+# Runs a badge script on CPython, from the firmware directory:
+#   python -m host badge/test/sessions.py
+#   python -m host badge/test/udp_pair.py b
+# or every script in a directory, each in its own process as NowListener
+# and friends are singletons, and reports which passed:
+#   python -m host badge/test
+# The badge modules are found like on the badge with firmware mounted:
+# firmware/ and frozen_firmware/modules are on the path, the submodules
+# under libs/ must be checked out for umsgpack, primitives and gui.
+LIBS = "libs/micropython-msgpack libs/micropython-async libs/micropython-micro-gui"
+# scripts importing these need the badge, they are skipped
+BADGE_ONLY = ("machine", "network", "aioespnow", "espnow", "neopixel", "esp32")
+TIMEOUT_S = 300
+
+FIRMWARE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULES = os.path.join(os.path.dirname(FIRMWARE), "frozen_firmware", "modules")
+
+
+def run_all(folder):
+    failed = skipped = 0
+    scripts = sorted(f for f in os.listdir(folder) if f.endswith(".py"))
+    for name in scripts:
+        start = time.monotonic()
+        try:
+            p = subprocess.run(
+                [sys.executable, "-m", "host", os.path.join(folder, name)],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                timeout=TIMEOUT_S,
+            )
+            out, code = p.stdout.decode(errors="replace"), p.returncode
+        except subprocess.TimeoutExpired as err:
+            out, code = (err.stdout or b"").decode(errors="replace"), "timeout"
+        took = time.monotonic() - start
+        missing = re.search(r"No module named '(\w+)", out)
+        if code and missing and missing.group(1) in BADGE_ONLY:
+            skipped += 1
+            print(f"skip {name}: needs the badge ({missing.group(1)})")
+        elif code:
+            failed += 1
+            print(f"FAIL {name} ({code}) in {took:.1f}s")
+            print("\n".join(out.splitlines()[-20:]))
+        else:
+            print(f"ok   {name} in {took:.1f}s")
+    passed = len(scripts) - failed - skipped
+    print(f"{passed} passed, {failed} failed, {skipped} skipped")
+    return 1 if failed else 0
+
+
+def main(argv):
+    if not argv:
+        print("usage: python -m host <script.py> [args] | <directory>")
+        return 2
+    sys.path[:0] = [FIRMWARE, MODULES]
+    from host import compat
+
+    compat.install()
+    for dep in ("umsgpack", "primitives"):
+        try:
+            __import__(dep)
+        except ImportError as err:
+            print(
+                f"{err}, check out the submodules: git submodule update --init {LIBS}"
+            )
+            return 1
+    if os.path.isdir(argv[0]):
+        return run_all(argv[0])
+    script = os.path.abspath(argv[0])
+    sys.argv = argv
+    sys.path.insert(0, os.path.dirname(script))
+    runpy.run_path(script, run_name="__main__")
+    return 0
+
+
+sys.exit(main(sys.argv[1:]))
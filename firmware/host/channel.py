@@ -0,0 +1,299 @@
+import asyncio
+from heapq import heappop, heappush
+from math import log10, sqrt
+
+from badge.msg import BROADCAST
+from host.transport import Fabric
+
+_M32 = 0xFFFFFFFF
+
+
+def _fnv(data, h=0x811C9DC5):
+    for b in data:
+        h = ((h ^ b) * 0x01000193) & _M32
+    return h
+
+
+class _Rand:
+    # xorshift32, one stream per link so draws don't depend on task order
+    def __init__(self, seed):
+        self.s = seed or 1
+
+    def next(self):
+        s = self.s
+        s ^= (s << 13) & _M32
+        s ^= s >> 17
+        s ^= (s << 5) & _M32
+        self.s = s
+        return s / 4294967296
+
+    def gauss(self):
+        # Irwin-Hall, close enough to N(0, 1) for fading
+        return (self.next() + self.next() + self.next() + self.next() - 2) * sqrt(3)
+
+
+class RadioFabric(Fabric):
+    """
+    Fabric with a radio channel model between ports placed at (x, y) in
+    meters:
+
+    - RSSI: log distance path loss, rssi_1m at 1 m falling with exponent,
+      a fixed shadowing per link (shadow_db sigma) and per frame fading
+      (fade_db sigma). Frames below sensitivity are not received, the last
+      margin_db above it are lost more the closer they are.
+    - loss: on top of that, percent per link, link_loss[(src, dst)] or loss.
+    - latency: delay_ms + airtime at rate_kbps + uniform jitter_ms.
+    - collisions: senders that hear a transmission (cs_dbm) wait for it to
+      end plus a random backoff of slot_us slots, others (hidden nodes,
+      same slot) overlap.
+      At a receiver the stronger frame survives if it is capture_db above
+      the other one, otherwise both are lost.
+    - receive buffer: per port, port(mac, pos, rx_buf=n) like Transport.
+
+    Time on air is virtual, in microseconds. With clock (a function that
+    returns it) the caller advances it and lands the frames due with
+    poll(). Without, while frames wait to land a clock task adds tick_ms
+    to it every time the event loop runs the task, however long the host
+    took. Sends at the same time are decided in call order. Random draws
+    come from a stream per link seeded from seed, so RSSI, loss, jitter,
+    backoff and collisions repeat between runs of the same sends.
+
+    Attributes:
+        frames (int): Frames sent, a broadcast counts once.
+        delivered (int): Receptions handed to a port.
+        collided (int): Receptions lost to a collision.
+        faded (int): Receptions lost to range or link loss.
+        deferred (int): Sends that waited for a busy channel.
+        us (int): Virtual time of the last send or landing.
+
+    Methods:
+        port(mac, pos, **kwargs): Transport for a badge at pos.
+        move(mac, pos): Place a badge somewhere else.
+        mean_rssi(src, dst): Expected RSSI of the link, without fading.
+        poll(): Land the frames due, us until the next one or None.
+        stats(): Counters as a dict.
+    """
+
+    def __init__(
+        self,
+        seed=1,
+        rssi_1m=-30,
+        exponent=2.7,
+        shadow_db=4,
+        fade_db=2,
+        sensitivity=-92,
+        margin_db=6,
+        loss=0,
+        link_loss=None,
+        delay_ms=1,
+        jitter_ms=2,
+        rate_kbps=1000,
+        cs_dbm=-85,
+        slot_us=50,
+        capture_db=6,
+        tick_ms=1,
+        clock=None,
+    ):
+        super().__init__(loss=loss, delay_ms=delay_ms)
+        self.seed = seed
+        self.rssi_1m = rssi_1m
+        self.exponent = exponent
+        self.shadow_db = shadow_db
+        self.fade_db = fade_db
+        self.sensitivity = sensitivity
+        self.margin_db = margin_db
+        self.link_loss = link_loss or {}
+        self.jitter_ms = jitter_ms
+        self.rate_kbps = rate_kbps
+        self.cs_dbm = cs_dbm
+        self.slot_us = slot_us
+        self.capture_db = capture_db
+        self.tick_ms = tick_ms
+        self.clock = clock
+        self.us = 0 if clock is None else clock()
+        self.delivered = 0
+        self.collided = 0
+        self.faded = 0
+        self.deferred = 0
+        self.pos = {}  # mac -> (x, y)
+        self._mean = {}  # (src, dst) -> mean rssi
+        self._near = {}  # mac -> [(mac, mean rssi)] that can hear its broadcasts
+        self._rand = {}  # (src, dst, k) -> _Rand
+        self._air = []  # transmissions on air: [src, start, end, {mac: rssi}, lost set]
+        self._due = []  # heap of (landing us, n, tx, dst, frame)
+        self._task = None
+
+    def port(self, mac, pos=(0, 0), **kwargs):
+        self.pos[mac] = pos
+        self._near = {}
+        return super().port(mac, **kwargs)
+
+    def move(self, mac, pos):
+        self.pos[mac] = pos
+        self._mean = {}
+        self._near = {}
+
+    def _r(self, src, dst, k=0):
+        # k: 0 fading, 1 loss on landing, 2 jitter, separate streams so the
+        # order of sends and landings doesn't matter
+        r = self._rand.get((src, dst, k))
+        if r is None:
+            seed = _fnv(dst, _fnv(src, (self.seed + k) & _M32))
+            r = self._rand[(src, dst, k)] = _Rand(seed)
+        return r
+
+    def mean_rssi(self, src, dst):
+        m = self._mean.get((src, dst))
+        if m is None:
+            (x0, y0), (x1, y1) = self.pos[src], self.pos[dst]
+            d = max(1, sqrt((x1 - x0) ** 2 + (y1 - y0) ** 2))
+            # shadowing is a property of the link, same both ways
+            a, b = (src, dst) if src < dst else (dst, src)
+            shadow = _Rand(_fnv(b, _fnv(a, ~self.seed & _M32))).gauss()
+            m = self.rssi_1m - 10 * self.exponent * log10(d) + shadow * self.shadow_db
+            self._mean[(src, dst)] = m
+        return m
+
+    def _neighbours(self, src):
+        near = self._near.get(src)
+        if near is None:
+            floor = self.sensitivity - 3 * self.fade_db
+            near = self._near[src] = []
+            for mac, p in self.ports.items():
+                if mac != src and p.rx_broadcast:
+                    m = self.mean_rssi(src, mac)
+                    if m >= floor:
+                        near.append((mac, m))
+        return near
+
+    def _level(self, t, mac):
+        # RSSI of transmission t at mac, None if it doesn't reach it
+        if mac == t[0]:
+            return 0  # sending, deaf to everything else
+        rssi = t[3].get(mac)
+        if rssi is None:
+            rssi = self.mean_rssi(t[0], mac)
+        return rssi if rssi >= self.sensitivity else None
+
+    def airtime_us(self, n):
+        # payload plus ~60 bytes of 802.11 header, preamble and FCS
+        return (n + 60) * 8 * 1000 // self.rate_kbps
+
+    def _send(self, src, dst, frame):
+        self.frames += 1
+        now = self._now()
+        air = self._air
+        air[:] = [t for t in air if t[2] > now]
+        # carrier sense: every send backs off a random number of slots and
+        # goes after the transmissions it hears, the ones that start in the
+        # same slot can't be heard in time and collide. Sends are decided
+        # in call order, one that would start earlier than a decided one
+        # goes after it instead, the order is random anyway. A badge's own
+        # frames go out one after the other
+        start = now + int(self._r(src, src).next() * 16) * self.slot_us
+        busy = True
+        while busy:
+            busy = False
+            for t in air:
+                if t[2] <= start:
+                    continue
+                if t[0] == src or (
+                    abs(start - t[1]) >= self.slot_us
+                    and start + self.airtime_us(len(frame)) > t[1]
+                    and self.mean_rssi(t[0], src) >= self.cs_dbm
+                ):
+                    start = t[2] + int(self._r(src, src).next() * 16) * self.slot_us
+                    busy = True
+        if start - now >= 16 * self.slot_us:
+            self.deferred += 1
+        end = start + self.airtime_us(len(frame))
+
+        # receivers of this frame and the RSSI they get it with
+        if dst == BROADCAST:
+            near = self._neighbours(src)
+        else:
+            near = [(dst, self.mean_rssi(src, dst))] if dst in self.ports else []
+        heard = {}
+        for mac, m in near:
+            rssi = m + self._r(src, mac).gauss() * self.fade_db
+            if rssi >= self.sensitivity:
+                heard[mac] = rssi
+        lost = set()
+        for t in air:
+            if t[2] <= start or end <= t[1]:
+                continue  # no overlap
+            # at every receiver of either frame the other one interferes,
+            # even where it isn't received itself
+            for mac, rssi in heard.items():
+                other = self._level(t, mac)
+                if other is not None and rssi - other < self.capture_db:
+                    lost.add(mac)
+            for mac, rssi in t[3].items():
+                if mac == src:
+                    t[4].add(mac)  # can't receive while sending
+                    continue
+                other = heard.get(mac)
+                if other is None:
+                    other = self.mean_rssi(src, mac)
+                if other >= self.sensitivity and rssi - other < self.capture_db:
+                    t[4].add(mac)
+        tx = [src, start, end, heard, lost]
+        air.append(tx)
+        at = end + self.delay_ms * 1000
+        if self.jitter_ms:
+            at += int(self._r(src, dst, 2).next() * self.jitter_ms * 1000)
+        heappush(self._due, (at, self.frames, tx, dst, frame))
+        if self.clock is None and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._tick())
+
+    def _now(self):
+        if self.clock is not None:
+            self.us = self.clock()
+        return self.us
+
+    async def _tick(self):
+        # own clock, runs until every frame on air has landed
+        while self._due:
+            await asyncio.sleep(self.tick_ms / 1000)
+            self.us += self.tick_ms * 1000
+            self.poll()
+
+    def poll(self):
+        now = self._now()
+        due = self._due
+        while due and due[0][0] <= now:
+            _, _, tx, dst, frame = heappop(due)
+            self._land(tx, dst, frame)
+        self._air[:] = [t for t in self._air if t[2] > now]
+        return due[0][0] - now if due else None
+
+    def _land(self, tx, dst, frame):
+        src, start, end, heard, lost = tx
+        to = heard if dst == BROADCAST else ((dst,) if dst in heard else ())
+        if dst != BROADCAST and dst not in heard and dst in self.ports:
+            self.faded += 1
+        for mac in to:
+            if mac in lost:
+                self.collided += 1
+                continue
+            rssi = heard[mac]
+            r = self._r(src, mac, 1)
+            margin = rssi - self.sensitivity
+            if margin < self.margin_db and r.next() * self.margin_db > margin:
+                self.faded += 1
+                continue
+            loss = self.link_loss.get((src, mac), self.loss)
+            if loss and r.next() * 100 < loss:
+                self.faded += 1
+                continue
+            self.delivered += 1
+            self.ports[mac]._deliver(src, frame, int(rssi))
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "delivered": self.delivered,
+            "collided": self.collided,
+            "faded": self.faded,
+            "deferred": self.deferred,
+        }
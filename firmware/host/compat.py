@@ -0,0 +1,71 @@
+import asyncio
+import sys
+import time
+import types
+
+# What the badge code uses of MicroPython that CPython lacks, added where it
+# is missing: ticks_*() in time, asyncio.sleep_ms(), the micropython module
+# and the framebuf constants bdg.utils imports. Nothing is replaced on
+# MicroPython (the unix port), install() is a no-op there.
+
+TICKS_PERIOD = 1 << 30  # ticks wrap like on the ESP32 port
+_HALF = TICKS_PERIOD // 2
+_t0 = time.monotonic_ns() if hasattr(time, "monotonic_ns") else 0
+
+
+def ticks_ms():
+    return ((time.monotonic_ns() - _t0) // 1_000_000) % TICKS_PERIOD
+
+
+def ticks_us():
+    return ((time.monotonic_ns() - _t0) // 1_000) % TICKS_PERIOD
+
+
+def ticks_add(ticks, delta):
+    return (ticks + delta) % TICKS_PERIOD
+
+
+def ticks_diff(ticks1, ticks2):
+    return (ticks1 - ticks2 + _HALF) % TICKS_PERIOD - _HALF
+
+
+async def sleep_ms(ms):
+    await asyncio.sleep(ms / 1000)
+
+
+def _same(f):
+    return f
+
+
+def _module(name, **attrs):
+    m = types.ModuleType(name)
+    m.__dict__.update(attrs)
+    sys.modules[name] = m
+
+
+def install():
+    if not hasattr(time, "ticks_ms"):
+        time.ticks_ms = ticks_ms
+        time.ticks_us = ticks_us
+        time.ticks_add = ticks_add
+        time.ticks_diff = ticks_diff
+    if not hasattr(asyncio, "sleep_ms"):
+        asyncio.sleep_ms = sleep_ms
+    try:
+        import micropython
+    except ImportError:
+        _module("micropython", const=_same, native=_same, viper=_same)
+    try:
+        import framebuf
+    except ImportError:
+        # formats only, nothing is drawn on the host
+        _module(
+            "framebuf",
+            MONO_VLSB=0,
+            RGB565=1,
+            GS4_HMSB=2,
+            MONO_HLSB=3,
+            MONO_HMSB=4,
+            GS2_HMSB=5,
+            GS8=6,
+        )
@@ -0,0 +1,236 @@
+import asyncio
+import random
+import socket
+from time import ticks_ms
+
+from primitives import Queue
+
+from badge.msg import BROADCAST, BUNDLE, unbundle
+
+# error codes as the ESP-NOW driver raises them: OSError(code, name)
+ESP_ERR_ESPNOW_FULL = -12394
+ESP_ERR_ESPNOW_NOT_FOUND = -12395
+ESP_ERR_ESPNOW_EXIST = -12397
+
+
+class Transport:
+    """
+    What the badge.msg stack uses of aioespnow.AIOESPNow, for running it
+    without the radio (unix port, or CPython through python -m host).
+    Subclasses implement _send() and call _deliver() for received frames.
+
+    Like the driver it only sends to added peers, has max_peers peer
+    slots, keeps peers_table (mac -> [rssi, ms]) for everyone it heard and
+    drops frames when rx_buf of them wait unread. With irecv it hands out
+    every frame in the same buffer, overwritten by the next one, as
+    AIOESPNow does with irecv().
+
+    Attributes:
+        mac (bytes): Own address.
+        peers_table (dict): RSSI and time of the last frame per sender.
+        rx_drops (int): Frames dropped because rx_buf was full.
+        tx_errors (int): Sends refused as the peer was not added.
+        rx_broadcast (bool): Receive broadcasts, off for simulated badges
+            that don't need them, saves delivering to hundreds of them.
+
+    Methods:
+        async asend(mac, msg, sync=True): Send msg to an added peer or BROADCAST.
+        add_peer(mac), del_peer(mac), get_peers(): Peer slots.
+        active(flag=None): Like AIOESPNow.active().
+        async for mac, msg in transport: Received frames.
+    """
+
+    def __init__(self, mac, max_peers=20, rx_buf=32, rx_broadcast=True, irecv=False):
+        self.mac = mac
+        self.rx_broadcast = rx_broadcast
+        self.max_peers = max_peers
+        self.peers_table = {}
+        self.rx_drops = 0
+        self.tx_errors = 0
+        self._peers = []
+        self._rx = Queue(maxsize=rx_buf)
+        self._buf = bytearray(250) if irecv else None
+        self._active = True
+
+    def active(self, flag=None):
+        if flag is not None:
+            self._active = bool(flag)
+        return self._active
+
+    def add_peer(self, mac, *args, **kwargs):
+        if mac in self._peers:
+            raise OSError(ESP_ERR_ESPNOW_EXIST, "ESP_ERR_ESPNOW_EXIST")
+        if len(self._peers) >= self.max_peers:
+            raise OSError(ESP_ERR_ESPNOW_FULL, "ESP_ERR_ESPNOW_FULL")
+        self._peers.append(mac)
+
+    def del_peer(self, mac):
+        if mac not in self._peers:
+            raise OSError(ESP_ERR_ESPNOW_NOT_FOUND, "ESP_ERR_ESPNOW_NOT_FOUND")
+        self._peers.remove(mac)
+
+    def get_peers(self):
+        return tuple((mac, None, 0, 0, False) for mac in self._peers)
+
+    async def asend(self, mac, msg, sync=True):
+        if mac not in self._peers:
+            self.tx_errors += 1
+            raise OSError(ESP_ERR_ESPNOW_NOT_FOUND, "ESP_ERR_ESPNOW_NOT_FOUND")
+        if self._active:
+            self._send(mac, bytes(msg))
+        return True
+
+    def _send(self, mac, frame):
+        raise NotImplementedError
+
+    def _deliver(self, mac, frame, rssi):
+        if not self._active:
+            return
+        st = self.peers_table.get(mac)
+        if st is None:
+            self.peers_table[mac] = [rssi, ticks_ms()]
+        else:  # updated in place like the driver does
+            st[0], st[1] = rssi, ticks_ms()
+        if self._rx.full():
+            self.rx_drops += 1
+            return
+        self._rx.put_nowait((mac, frame))
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return self._take(await self._rx.get())
+
+    def _take(self, item):
+        if self._buf is None:
+            return item
+        mac, frame = item
+        buf = memoryview(self._buf)[: len(frame)]
+        buf[:] = frame
+        return mac, buf
+
+
+class Fabric:
+    """
+    In process radio, every Transport from port() hears the others. For
+    many badges in one asyncio loop: NowListener is a singleton, so one
+    port runs the badge.msg stack and the rest are VirtualBadges, or
+    frames the test injects.
+
+    Attributes:
+        loss (int): Percent of frames lost, per receiver.
+        rssi (int): RSSI every frame arrives with.
+        delay_ms (int): Air time before a frame arrives, 0 delivers at once.
+        frames (int): Frames sent, a broadcast counts once.
+        log (list): (src, dst, frame) sent through ports, None unless log.
+
+    Methods:
+        port(mac, **kwargs): Transport for a badge at mac.
+        inject(src, dst, frame): Frame from src that has no port.
+        sent(src=None, dst=None): Logged records, bundles unpacked.
+    """
+
+    def __init__(self, loss=0, rssi=-50, delay_ms=0, log=False):
+        self.loss = loss
+        self.rssi = rssi
+        self.delay_ms = delay_ms
+        self.frames = 0
+        self.log = [] if log else None
+        self.ports = {}  # mac -> FabricPort
+
+    def port(self, mac, **kwargs):
+        p = self.ports[mac] = FabricPort(self, mac, **kwargs)
+        return p
+
+    def inject(self, src, dst, frame):
+        self._send(src, dst, frame)
+
+    def sent(self, src=None, dst=None):
+        # [(src, dst, record)] in the order they were sent
+        out = []
+        for s, d, frame in self.log:
+            if (src is None or s == src) and (dst is None or d == dst):
+                recs = unbundle(frame) if frame[0] == BUNDLE else [frame]
+                out.extend((s, d, bytes(rec)) for rec in recs)
+        return out
+
+    def _send(self, src, dst, frame):
+        if dst == BROADCAST:
+            to = [p for mac, p in self.ports.items() if mac != src and p.rx_broadcast]
+        else:
+            p = self.ports.get(dst)
+            to = [p] if p else []
+        self.frames += 1
+        for p in to:
+            if self.loss and random.randint(0, 99) < self.loss:
+                continue
+            if self.delay_ms:
+                asyncio.create_task(self._later(p, src, frame))
+            else:
+                p._deliver(src, frame, self.rssi)
+
+    async def _later(self, p, src, frame):
+        await asyncio.sleep(self.delay_ms / 1000)
+        p._deliver(src, frame, self.rssi)
+
+
+class FabricPort(Transport):
+    def __init__(self, fabric, mac, **kwargs):
+        super().__init__(mac, **kwargs)
+        self.fabric = fabric
+
+    def _send(self, mac, frame):
+        if self.fabric.log is not None:
+            self.fabric.log.append((self.mac, mac, frame))
+        self.fabric._send(self.mac, mac, frame)
+
+
+class UdpTransport(Transport):
+    """
+    Frames over UDP multicast, each process on the host (or LAN) is one
+    badge. A datagram is destination mac + source mac + frame, receivers
+    drop ones for other macs like the radio does.
+    """
+
+    def __init__(self, mac, group="239.255.80.80", port=5580, rssi=-50, **kwargs):
+        super().__init__(mac, **kwargs)
+        self.rssi = rssi
+        self._dst = socket.getaddrinfo(group, port)[0][-1]
+        s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind(socket.getaddrinfo("0.0.0.0", port)[0][-1])
+        mreq = bytes(int(b) for b in group.split(".")) + bytes(4)
+        # IPPROTO_IP 0, IP_ADD_MEMBERSHIP 35 on Linux, unix port lacks the names
+        s.setsockopt(
+            getattr(socket, "IPPROTO_IP", 0),
+            getattr(socket, "IP_ADD_MEMBERSHIP", 35),
+            mreq,
+        )
+        s.setblocking(False)
+        self._sock = s
+        self._reader = None
+
+    def _send(self, mac, frame):
+        self._sock.sendto(mac + self.mac + frame, self._dst)
+
+    async def _read(self):
+        while True:
+            try:
+                data = self._sock.recv(512)
+            except OSError:
+                await asyncio.sleep(0.002)  # EAGAIN, nothing waiting
+                continue
+            dst, src = data[:6], data[6:12]
+            if src != self.mac and (dst == self.mac or dst == BROADCAST):
+                self._deliver(src, data[12:], self.rssi)
+
+    async def __anext__(self):
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read())
+        return self._take(await self._rx.get())
+
+    def close(self):
+        if self._reader:
+            self._reader.cancel()
+        self._sock.close()
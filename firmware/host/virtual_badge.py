@@ -0,0 +1,183 @@
+import asyncio
+import random
+
+from badge.msg import (
+    AckMsg,
+    AppMsg,
+    BadgeMsg,
+    BeaconMsg,
+    ConCredit,
+    ConTerm,
+    OpenConn,
+    BROADCAST,
+    BUNDLE,
+    peek,
+    unbundle,
+)
+from badge.msg.connection import Connection
+from badge.msg.tx import AckTracker, is_acked
+
+
+class VirtualBadge:
+    """
+    Scripted badge on a transport port: beacons, accepts every connection,
+    acks, grants credit and keeps the app messages it gets. Speaks the same
+    frames as badge.msg, without its singletons, so hundreds fit in one
+    process, next to the one badge running the stack. Resends what is not
+    acked every RESEND_MS, RETRY times.
+
+    Attributes:
+        got (dict): (mac, con_id) -> {seq: content} of open sessions.
+        limit (dict): (mac, con_id) -> seq this badge may send up to.
+        heard (dict): Type id -> records received, retries included.
+        grant (bool): Grant credit as app messages come in, off to grant
+            with send(ConCredit) from the test.
+        retries (int): Frames resent.
+
+    Methods:
+        start(), stop(): Beacon, receive and resend tasks.
+        open(mac, con_id): A session made active without OpenConn.
+        async connect(mac, con_id): Open a session, wait for the accept.
+        async send(mac, msg): Send msg reliably.
+        async send_app(mac, con_id, content, seq): Once the credit allows.
+    """
+
+    RESEND_MS = 200
+    RETRY = 5
+
+    def __init__(self, port, nick, beacon_ms=1000, grant=True):
+        self.port = port
+        self.nick = nick
+        self.beacon_ms = beacon_ms
+        self.grant = grant
+        self.acks = AckTracker(delay_ms=0)
+        self.got = {}
+        self.limit = {}
+        self.heard = {}
+        self.retries = 0
+        self._mid = random.randint(0, 0xFFFF)
+        self._unacked = {}  # (mac, id) -> [frame, tries left]
+        self._credit = asyncio.Event()  # limit changed
+        self._tasks = []
+
+    def start(self):
+        self._add(BROADCAST)
+        self._tasks = [
+            asyncio.create_task(self._receive()),
+            asyncio.create_task(self._resend()),
+        ]
+        if self.beacon_ms:
+            self._tasks.append(asyncio.create_task(self._beacon()))
+
+    def stop(self):
+        for t in self._tasks:
+            t.cancel()
+
+    def _add(self, mac):
+        try:
+            self.port.add_peer(mac)
+        except OSError:
+            pass  # already a peer
+
+    def _set_limit(self, key, limit):
+        self.limit[key] = limit
+        self._credit.set()
+
+    def open(self, mac, con_id):
+        self.got[(mac, con_id)] = {}
+        self._set_limit((mac, con_id), Connection.IN_Q)
+
+    async def connect(self, mac, con_id, timeout=2):
+        self.got[(mac, con_id)] = {}
+        await self.send(mac, OpenConn(con_id))
+        await asyncio.wait_for(self._room((mac, con_id), 0), timeout)
+
+    async def _room(self, key, seq):
+        while seq >= self.limit.get(key, 0):
+            self._credit.clear()
+            await self._credit.wait()
+
+    async def send_app(self, mac, con_id, content, seq):
+        await self._room((mac, con_id), seq)
+        await self.send(mac, AppMsg(content, con_id=con_id, seq=seq))
+
+    async def send(self, mac, msg):
+        self._mid = (self._mid + 1) & 0xFFFF
+        msg._id = self._mid
+        frame = msg.srlz()
+        self._unacked[(mac, msg.id)] = [frame, self.RETRY]
+        self._add(mac)
+        await self.port.asend(mac, frame)
+
+    async def _beacon(self):
+        frame = BeaconMsg(nick=self.nick).srlz()
+        await asyncio.sleep(random.randint(0, self.beacon_ms) / 1000)
+        while True:
+            await self.port.asend(BROADCAST, frame)
+            await asyncio.sleep(self.beacon_ms / 1000)
+
+    async def _resend(self):
+        while True:
+            await asyncio.sleep(self.RESEND_MS / 1000)
+            for key, entry in list(self._unacked.items()):
+                if entry[1] <= 0:
+                    del self._unacked[key]
+                    continue
+                entry[1] -= 1
+                self.retries += 1
+                await self.port.asend(key[0], entry[0])
+
+    def _grant(self, key):
+        # credit up to IN_Q past the messages received in order
+        got = self.got.get(key)
+        if not self.grant or got is None:
+            return []
+        nxt = 0
+        while nxt in got:
+            nxt += 1
+        return [ConCredit(key[1], nxt + Connection.IN_Q)]
+
+    async def _receive(self):
+        async for mac, frame in self.port:
+            replies = []
+            for rec in unbundle(frame) if frame[0] == BUNDLE else [frame]:
+                tid, mid = peek(rec)
+                if tid == BeaconMsg.TYPE_ID:
+                    continue
+                self.heard[tid] = self.heard.get(tid, 0) + 1
+                if tid == AckMsg.TYPE_ID:
+                    ack = BadgeMsg.desrlz(rec)
+                    for key in list(self._unacked):
+                        if key[0] == mac and is_acked(
+                            key[1], ack.id, ack.sack, ack.run
+                        ):
+                            del self._unacked[key]
+                    continue
+                self.acks.received(mac, mid)
+                msg = BadgeMsg.desrlz(rec)
+                key = (mac, getattr(msg, "con_id", None))
+                if isinstance(msg, OpenConn):
+                    if key not in self.got:
+                        self.got[key] = {}
+                        replies.append(OpenConn(msg.con_id, accept=True))
+                    if key not in self.limit:
+                        self._set_limit(key, Connection.IN_Q)
+                elif isinstance(msg, ConTerm):
+                    self.got.pop(key, None)
+                    self.limit.pop(key, None)
+                elif isinstance(msg, ConCredit):
+                    if msg.probe:
+                        replies.extend(self._grant(key))
+                    elif key in self.limit:
+                        self._set_limit(key, msg.limit)
+                elif isinstance(msg, AppMsg):
+                    got = self.got.get(key)
+                    if got is not None:
+                        got[msg.seq] = msg.content
+                        replies.extend(self._grant(key))
+            for msg in replies:
+                await self.send(mac, msg)
+            ack = self.acks.take(mac)
+            if ack is not None:
+                self._add(mac)
+                await self.port.asend(mac, ack)
@@ -137,3 +137,26 @@ def load_app(
     # Change to the screen
     print(f"Loading {screen_class.__name__} from {import_path}")
     Screen.change(screen_class, mode=mode, args=final_args, kwargs=final_kwargs)
+
+
+def net_stats(mac=None):
+    """
+    Transport counters of the running NowListener, for tuning the radio stack.
+
+    Usage examples:
+        net_stats()                            # one line, all peers and untracked
+        net_stats(b"\\xaa\\xbb\\xcc\\xdd\\xee\\xff")  # dict of one peer
+
+    Args:
+        mac: Peer MAC as bytes, if None prints all peers on one line
+    """
+    from badge.msg.connection import NowListener
+
+    stats = NowListener.link_stats()
+    if stats is None:
+        print("NowListener not running")
+        return None
+    if mac is None:
+        print(stats.line())
+        return None
+    return stats.get(mac)
@@ -4,7 +4,7 @@
 import frozen_fs
 from bdg.config import Config
 from bdg.version import Version
-from bdg.repl_helpers import load_app
+from bdg.repl_helpers import load_app, net_stats
 from ota import rollback as ota_rollback
 from ota import status as ota_status
 
@@ -17,6 +17,7 @@ print(f"")
 print(f"Global variables and objects available:")
 print(f"  - 'config': Config() object with firmware version info")
 print(f"  - 'load_app': Helper function to load apps for testing")
+print(f"  - 'net_stats': Per peer radio stats, net_stats() prints one line")
 print(f"")
 print(f"Check also Badge API documentation in Github")
 
@@ -29,3 +30,4 @@ if not boot_partition.info()[4] == "factory":
 Config.load()
 globals()["config"] = Config()
 globals()["load_app"] = load_app
+globals()["net_stats"] = net_stats